@@ -0,0 +1,172 @@
+"""Deleting accounts.
+
+Deleting an account only tombstones it: `deleted_at` is set, which hides
+the user everywhere at once. Their messages, likes and follow edges are
+purged afterwards in batches of PURGE_BATCH_SIZE rows, each batch its own
+short transaction, so neither the request nor any one statement works
+through a prolific account's rows all at once. Other users' counters are
+fixed batch by batch. Last goes the user row, and with it (ON DELETE
+CASCADE) their home timeline.
+
+Purges run as background jobs (see jobs.py); `flask purge-deleted` purges
+any tombstones left over too.
+"""
+
+from datetime import datetime
+from time import sleep
+
+from flask import current_app
+from sqlalchemy import and_, select
+
+import counters
+import jobs
+from models import db, Follows, Likes, Message, User
+
+DEFAULT_BATCH_SIZE = 1000
+
+users = User.__table__
+messages = Message.__table__
+follows = Follows.__table__
+likes = Likes.__table__
+
+
+def tombstone(user):
+    """Mark `user` deleted; the caller also calls `schedule`, then commits."""
+
+    user.deleted_at = datetime.utcnow()
+
+
+##############################################################################
+# Purging, a batch at a time
+
+
+def ids(column, where, limit):
+    return [id_ for (id_,) in db.session.execute(select([column])
+                                                 .where(where)
+                                                 .limit(limit))]
+
+
+def purge_messages(user_id, limit):
+    """Delete up to `limit` of the user's messages, and the likes,
+    timeline entries (cascaded) and likers' counts that go with them."""
+
+    batch = ids(messages.c.id, messages.c.user_id == user_id, limit)
+
+    if batch:
+        counters.likes_removed(batch)
+        db.session.execute(messages.delete().where(messages.c.id.in_(batch)))
+
+    return len(batch)
+
+
+def purge_likes(user_id, limit):
+    """Delete up to `limit` of the user's likes."""
+
+    batch = ids(likes.c.message_id, likes.c.user_id == user_id, limit)
+
+    if batch:
+        db.session.execute(likes.delete().where(and_(
+            likes.c.user_id == user_id, likes.c.message_id.in_(batch))))
+
+    return len(batch)
+
+
+def purge_following(user_id, limit):
+    """Unfollow up to `limit` of the users the user follows."""
+
+    batch = ids(follows.c.user_being_followed_id,
+                follows.c.user_following_id == user_id, limit)
+
+    if batch:
+        db.session.execute(follows.delete().where(and_(
+            follows.c.user_following_id == user_id,
+            follows.c.user_being_followed_id.in_(batch))))
+        db.session.execute(users
+                           .update()
+                           .where(users.c.id.in_(batch))
+                           .values(followers_count=users.c.followers_count - 1))
+
+    return len(batch)
+
+
+def purge_followers(user_id, limit):
+    """Drop up to `limit` of the user's followers."""
+
+    batch = ids(follows.c.user_following_id,
+                follows.c.user_being_followed_id == user_id, limit)
+
+    if batch:
+        db.session.execute(follows.delete().where(and_(
+            follows.c.user_being_followed_id == user_id,
+            follows.c.user_following_id.in_(batch))))
+        db.session.execute(users
+                           .update()
+                           .where(users.c.id.in_(batch))
+                           .values(following_count=users.c.following_count - 1))
+
+    return len(batch)
+
+
+# Messages first, so they leave other people's feeds soonest.
+PURGE_STEPS = [purge_messages, purge_likes, purge_following, purge_followers]
+
+
+@jobs.handler
+def purge_user(user_id, batch_size=None, pause=None):
+    """Remove a tombstoned user and everything of theirs, committing after
+    each batch. Returns the number of rows removed."""
+
+    config = current_app.config
+    batch_size = batch_size or config.get('PURGE_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    pause = config.get('PURGE_PAUSE', 0) if pause is None else pause
+
+    deleted_at = (db.session
+                  .query(User.deleted_at)
+                  .filter(User.id == user_id)
+                  .scalar())
+
+    if deleted_at is None:
+        return 0
+
+    removed = 0
+
+    for step in PURGE_STEPS:
+        while True:
+            count = step(user_id, batch_size)
+            db.session.commit()
+            removed += count
+
+            if count < batch_size:
+                break
+            if pause:
+                sleep(pause)
+
+    db.session.execute(users.delete().where(users.c.id == user_id))
+    db.session.commit()
+
+    return removed + 1
+
+
+def purge_deleted(batch_size=None):
+    """Purge every tombstoned account; returns how many there were."""
+
+    tombstoned = [user_id for (user_id,) in (db.session
+                                             .query(User.id)
+                                             .filter(User.deleted_at.isnot(None))
+                                             .order_by(User.deleted_at))]
+
+    for user_id in tombstoned:
+        purge_user(user_id, batch_size)
+
+    return len(tombstoned)
+
+
+##############################################################################
+# Scheduling
+
+
+def schedule(user_id):
+    """Queue the purge of a tombstoned account; it runs once the caller
+    commits."""
+
+    jobs.enqueue(purge_user, user_id)
@@ -0,0 +1,241 @@
+"""Versioned JSON API for Warbler, under /api/v1.
+
+Feeds and user lists are streamed: rows are read from the database in
+chunks and written to the client as they arrive, so a page of a thousand
+messages never sits in server memory as a list.
+
+Responses are a JSON object, `{"items": [...], "next": <url or null>}`,
+or with `?format=ndjson` (or `Accept: application/x-ndjson`) one item per
+line followed by a final `{"next": <url or null>}` line. Follow `next` to
+page further back.
+
+Endpoints that change things take the session's CSRF token in an
+X-CSRFToken header.
+"""
+
+import json
+from functools import wraps
+from itertools import islice
+
+from flask import (Blueprint, Response, g, jsonify, request,
+                   stream_with_context)
+from sqlalchemy.exc import IntegrityError
+
+import feeds
+import follows
+import likes
+import timelines
+from models import db, Message, User
+from pagination import (encode_cursor, keyset_query, message_key, page_args,
+                        page_url)
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+API_MAX_PAGE_SIZE = 1000
+STREAM_CHUNK_SIZE = timelines.STREAM_CHUNK_SIZE
+
+NDJSON = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    return (request.args.get('format') == 'ndjson'
+            or request.accept_mimetypes.best == NDJSON)
+
+
+def login_required(view):
+    """Answer 401 unless someone is logged in."""
+
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not g.user:
+            return jsonify(error="Access unauthorized."), 401
+        return view(*args, **kwargs)
+
+    return wrapped
+
+
+def stream_items(rows, serialize, limit, next_url):
+    """Stream up to `limit` of `rows`, then a link to the next page.
+
+    `rows` should yield one extra row when there's another page;
+    `next_url(last_row)` builds the link.
+    """
+
+    rows = iter(rows)
+    ndjson = wants_ndjson()
+
+    def generate():
+        last = None
+
+        if not ndjson:
+            yield '{"items": ['
+
+        for i, row in enumerate(islice(rows, limit)):
+            last = row
+            item = json.dumps(serialize(row))
+            yield f"{item}\n" if ndjson else f"{',' if i else ''}{item}"
+
+        has_more = last is not None and next(rows, None) is not None
+        links = json.dumps({'next': next_url(last) if has_more else None})
+
+        yield f"{links}\n" if ndjson else f"], {links[1:]}"
+
+    return Response(stream_with_context(generate()),
+                    mimetype=NDJSON if ndjson else 'application/json')
+
+
+def stream_messages(rows_for):
+    """Stream a message feed; `rows_for(before, limit)` yields its rows."""
+
+    args = page_args(maximum=API_MAX_PAGE_SIZE)
+    limit = args['limit']
+
+    return stream_items(
+        rows_for(args['before'], limit), Message.serialize, limit,
+        lambda last: page_url(before=encode_cursor(message_key(last))))
+
+
+def stream_follows(query, order):
+    """Stream a follower/following list, newest follow first."""
+
+    args = page_args(maximum=API_MAX_PAGE_SIZE)
+    limit = args['limit']
+
+    return stream_items(
+        keyset_query(query, *order, before=args['before'], limit=limit)
+        .yield_per(STREAM_CHUNK_SIZE),
+        feeds.serialize_follow, limit,
+        lambda last: page_url(before=encode_cursor(feeds.follow_key(last))))
+
+
+##############################################################################
+# Endpoints
+
+
+@api.route('/timeline')
+@login_required
+def timeline():
+    """The logged-in user's home feed, newest first."""
+
+    return stream_messages(lambda before, limit: timelines.home_timeline_rows(
+        g.user, before=before, limit=limit, stream=True))
+
+
+@api.route('/users/<int:user_id>')
+def user_profile(user_id):
+    """A user's public profile and counts."""
+
+    return jsonify(User.get_active_or_404(user_id).serialize())
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    """Messages written by a user, newest first."""
+
+    User.get_active_or_404(user_id)
+
+    return stream_messages(lambda before, limit: keyset_query(
+        feeds.user_messages_query(user_id),
+        Message.timestamp, Message.id, before=before, limit=limit,
+    ).yield_per(STREAM_CHUNK_SIZE))
+
+
+@api.route('/users/<int:user_id>/likes')
+@login_required
+def user_likes(user_id):
+    """Messages liked by a user, newest first."""
+
+    User.get_active_or_404(user_id)
+
+    return stream_messages(lambda before, limit: keyset_query(
+        feeds.liked_messages_query(user_id),
+        Message.timestamp, Message.id, before=before, limit=limit,
+    ).yield_per(STREAM_CHUNK_SIZE))
+
+
+@api.route('/users/<int:user_id>/following')
+@login_required
+def user_following(user_id):
+    """Users a user follows, most recently followed first."""
+
+    User.get_active_or_404(user_id)
+    return stream_follows(feeds.following_query(user_id), feeds.FOLLOWING_ORDER)
+
+
+@api.route('/users/<int:user_id>/followers')
+@login_required
+def user_followers(user_id):
+    """Users following a user, most recent followers first."""
+
+    User.get_active_or_404(user_id)
+    return stream_follows(feeds.followers_query(user_id), feeds.FOLLOWERS_ORDER)
+
+
+@api.route('/messages/<int:message_id>/like', methods=['POST', 'PUT', 'DELETE'])
+@login_required
+def message_like(message_id):
+    """Like (PUT), unlike (DELETE) or toggle (POST) a message.
+
+    Answers with whether the logged-in user now likes it.
+    """
+
+    try:
+        if request.method == 'POST':
+            liked = likes.toggle_like(g.user.id, message_id)
+        else:
+            liked = request.method == 'PUT'
+            likes.set_like(g.user.id, message_id, liked)
+        db.session.commit()
+    except likes.OwnMessage:
+        return jsonify(error="You can't like your own messages."), 403
+    except (likes.NoSuchMessage, IntegrityError):
+        db.session.rollback()
+        return jsonify(error="No such message."), 404
+
+    return jsonify(message_id=message_id, liked=liked)
+
+
+@api.route('/following/<int:user_id>', methods=['PUT', 'DELETE'])
+@login_required
+def following_user(user_id):
+    """Follow (PUT) or unfollow (DELETE) a user; repeating it is harmless."""
+
+    if request.method == 'PUT':
+        if not follows.follow(g.user.id, user_id):
+            User.get_active_or_404(user_id)
+    else:
+        follows.unfollow(g.user.id, user_id)
+
+    db.session.commit()
+    return jsonify(user_id=user_id,
+                   following=request.method == 'PUT' and user_id != g.user.id)
+
+
+@api.route('/following', methods=['POST'])
+@login_required
+def following_bulk():
+    """Follow and unfollow many users at once, e.g. when importing contacts.
+
+    Takes `{"follow": [user ids], "unfollow": [user ids]}` (either may be
+    left out) and answers with the ids that actually changed. Unknown ids
+    are skipped.
+    """
+
+    body = request.get_json(silent=True)
+
+    if not isinstance(body, dict):
+        return jsonify(error="Expected a JSON object."), 400
+
+    lists = {key: body.get(key, []) for key in ('follow', 'unfollow')}
+
+    for key, ids in lists.items():
+        if (not isinstance(ids, list) or len(ids) > follows.BULK_LIMIT
+                or not all(type(i) is int for i in ids)):
+            return jsonify(error=f"'{key}' must be a list of at most "
+                                 f"{follows.BULK_LIMIT} user ids."), 400
+
+    unfollowed = follows.unfollow_many(g.user.id, lists['unfollow'])
+    followed = follows.follow_many(g.user.id, lists['follow'])
+    db.session.commit()
+
+    return jsonify(followed=followed, unfollowed=unfollowed)
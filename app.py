@@ -1,14 +1,35 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g, jsonify
+from datetime import datetime
+from time import perf_counter, sleep
+
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, jsonify, abort
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_
-
+from sqlalchemy.orm import joinedload
+
+import accounts
+import assets
+import caching
+import compression
+import counters
+import feeds
+import follows
+import fragments
+import identity
+import jobs
+import likes
+import passwords
+import profiling
+import search
+import timelines
+import viewer
+from api import api
+from pagination import Page, limit_arg, page_args, paginate
 from forms import UserAddForm, LoginForm, MessageForm, UserEditForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message
 from flask_wtf.csrf import CSRFProtect
-from werkzeug.exceptions import BadRequestKeyError
 
 CURR_USER_KEY = "curr_user"
 
@@ -24,9 +45,86 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Home timelines keep this many entries per user; authors with at least
+# TIMELINE_FANOUT_LIMIT followers are merged into feeds at read time, until
+# they drop below half that.
+app.config['TIMELINE_DEPTH'] = int(os.environ.get('TIMELINE_DEPTH', 800))
+app.config['TIMELINE_FANOUT_LIMIT'] = int(
+    os.environ.get('TIMELINE_FANOUT_LIMIT', 10000))
+
+# Logged-in users' profiles are cached per process for this many seconds.
+app.config['USER_CACHE_SIZE'] = 1024
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 30))
+
+# bcrypt runs on a pool of PASSWORD_POOL_SIZE processes (0 = inline); at
+# most PASSWORD_QUEUE_DEPTH hashes may wait, each for PASSWORD_TIMEOUT secs.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_POOL_SIZE'] = int(
+    os.environ.get('PASSWORD_POOL_SIZE', os.cpu_count() or 1))
+app.config['PASSWORD_QUEUE_DEPTH'] = int(
+    os.environ.get('PASSWORD_QUEUE_DEPTH', 4 * app.config['PASSWORD_POOL_SIZE']))
+app.config['PASSWORD_TIMEOUT'] = float(os.environ.get('PASSWORD_TIMEOUT', 5))
+
+# Rendered message items are cached in-process (FRAGMENT_CACHE_SIZE
+# entries), or shared between processes when FRAGMENT_CACHE_URL names a
+# Redis server.
+app.config['FRAGMENT_CACHE_SIZE'] = int(
+    os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+app.config['FRAGMENT_CACHE_URL'] = os.environ.get('FRAGMENT_CACHE_URL')
+
+# Text responses of at least COMPRESS_MIN_SIZE bytes are gzipped at
+# COMPRESS_LEVEL (1-9) for clients that accept it.
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+
+# Send each request's SQL statement count as an X-SQL-Statements header
+# (for tests and loadtest.py).
+app.config['SQL_STATEMENTS_HEADER'] = bool(os.environ.get('SQL_STATEMENTS_HEADER'))
+
+# A sample of requests (0 to 1) time their SQL, reported in Server-Timing
+# (which misses queries run while streaming API responses, after the
+# headers are sent); statements slower than SLOW_QUERY_MS are logged to
+# 'warbler.sql'.
+app.config['SQL_PROFILE_SAMPLE_RATE'] = float(
+    os.environ.get('SQL_PROFILE_SAMPLE_RATE', 0.1))
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+
+# Deleted accounts are purged PURGE_BATCH_SIZE rows per transaction, with
+# PURGE_PAUSE seconds between batches, by a background job.
+app.config['PURGE_BATCH_SIZE'] = int(os.environ.get('PURGE_BATCH_SIZE', 1000))
+app.config['PURGE_PAUSE'] = float(os.environ.get('PURGE_PAUSE', 0.01))
+
+# Background jobs (timeline fan-out, account purges) are queued in the
+# database and run by `flask worker` processes. JOB_WORKERS > 0 also runs
+# that many threads in each web process, sharing its connection pool and
+# dying with it mid-job (the job is retried once its lease runs out); off
+# by default. With JOBS_INLINE set they run right away in the request
+# instead. Failed jobs are retried JOB_MAX_ATTEMPTS times,
+# backing off from JOB_RETRY_DELAY seconds; a claimed job is retried if
+# its worker hasn't finished within JOB_LEASE seconds.
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 0))
+app.config['JOBS_INLINE'] = bool(os.environ.get('JOBS_INLINE'))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+app.config['JOB_RETRY_DELAY'] = float(os.environ.get('JOB_RETRY_DELAY', 5))
+app.config['JOB_LEASE'] = int(os.environ.get('JOB_LEASE', 3600))
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', 1))
+
+# Compression must see the final body, so it's registered before the
+# toolbar (which rewrites HTML): after_request hooks run in reverse.
+compression.init_app(app)
+
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+assets.init_app(app)
+caching.init_app(app)
+fragments.init_app(app)
+identity.init_app(app)
+passwords.init_app(app)
+profiling.init_app(app)
+
+app.register_blueprint(api)
 
 
 ##############################################################################
@@ -35,10 +133,14 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    The user is only looked up when something first reads `g.user`.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        user_id = session[CURR_USER_KEY]
+        g.set_lazy('user', lambda: identity.load_user(user_id))
 
     else:
         g.user = None
@@ -50,6 +152,13 @@ def do_login(user):
     session[CURR_USER_KEY] = user.id
 
 
+def wants_json():
+    """Did the client ask for JSON instead of an HTML page?"""
+
+    return (request.args.get('format') == 'json'
+            or request.accept_mimetypes.best == 'application/json')
+
+
 def do_logout():
     """Logout user."""
 
@@ -86,6 +195,13 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        except passwords.PasswordWorkUnavailable:
+            db.session.rollback()
+            flash("We're very busy right now; please try again.", 'danger')
+            return render_template('users/signup.html', form=form), 503
+
+        search.index_user(user)
+
         do_login(user)
 
         return redirect("/")
@@ -102,10 +218,16 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except passwords.PasswordWorkUnavailable:
+            flash("We're very busy right now; please try again.", 'danger')
+            return render_template('users/login.html', form=form), 503
 
         if user:
+            # authenticate() may have upgraded the password hash
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -136,35 +258,42 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username,
+    and a 'page' param for further pages of results.
     """
 
-    search = request.args.get('q')
+    query = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
+    if not query:
+        users = search.list_all_users(page=search.page_arg())
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users = search.search_users(query, page=search.page_arg())
+
+    if g.user:
+        g.user.load_follow_state(users)
 
     return render_template('users/index.html', users=users)
 
 
 @app.route('/users/<int:user_id>')
 @csrf.exempt
+@caching.conditional(caching.profile_validator)
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = User.get_active_or_404(user_id)
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    messages = paginate(feeds.user_messages_query(user_id),
+                        Message.timestamp, Message.id, **page_args())
+
+    if wants_json():
+        return jsonify(messages.serialize(Message.serialize))
+
+    fragments.prefetch(messages)
+    return render_template('users/show.html', user=user, messages=messages,
+                           viewer=viewer.load(messages))
 
 
 @app.route('/users/<int:user_id>/following')
@@ -176,8 +305,15 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = User.get_active_or_404(user_id)
+    page = paginate(feeds.following_query(user_id), *feeds.FOLLOWING_ORDER,
+                    key=feeds.follow_key, **page_args())
+
+    if wants_json():
+        return jsonify(page.serialize(feeds.serialize_follow))
+
+    g.user.load_follow_state([followed for followed, _ in page])
+    return render_template('users/following.html', user=user, follows=page)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -189,39 +325,58 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.get_active_or_404(user_id)
+    page = paginate(feeds.followers_query(user_id), *feeds.FOLLOWERS_ORDER,
+                    key=feeds.follow_key, **page_args())
+
+    if wants_json():
+        return jsonify(page.serialize(feeds.serialize_follow))
+
+    g.user.load_follow_state([follower for follower, _ in page])
+    return render_template('users/followers.html', user=user, follows=page)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
 @csrf.exempt
 def add_follow(follow_id):
-    """Add a follow for the currently-logged-in user."""
+    """Add a follow for the currently-logged-in user.
+
+    Following someone twice is harmless. Answers JSON when asked for it,
+    otherwise redirects to the following page.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    if not follows.follow(g.user.id, follow_id):
+        User.get_active_or_404(follow_id)
     db.session.commit()
 
+    if wants_json():
+        return jsonify(user_id=follow_id, following=follow_id != g.user.id)
+
     return redirect(f"/users/{g.user.id}/following")
 
 
 @app.route('/users/stop-following/<int:follow_id>', methods=['POST'])
 @csrf.exempt
 def stop_following(follow_id):
-    """Have currently-logged-in-user stop following this user."""
+    """Have currently-logged-in-user stop following this user.
+
+    Unfollowing someone not followed is harmless.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    follows.unfollow(g.user.id, follow_id)
     db.session.commit()
 
+    if wants_json():
+        return jsonify(user_id=follow_id, following=False)
+
     return redirect(f"/users/{g.user.id}/following")
 
 
@@ -237,8 +392,12 @@ def edit_profile():
     form = UserEditForm(obj=g.user)
 
     if form.validate_on_submit():
-        user = User.authenticate(g.user.username,
-                                 form.password.data)
+        try:
+            user = User.authenticate(g.user.username,
+                                     form.password.data)
+        except passwords.PasswordWorkUnavailable:
+            flash("We're very busy right now; please try again.", 'danger')
+            return render_template('users/edit.html', form=form), 503
 
         if user:
             try:
@@ -247,8 +406,12 @@ def edit_profile():
                 user.image_url = form.image_url.data or User.image_url.default.arg
                 user.header_image_url = form.header_image_url.data or User.header_image_url.default.arg
                 user.bio = form.bio.data
+                user.profile_updated_at = datetime.utcnow()
 
                 db.session.commit()
+                identity.invalidate(user.id)
+                fragments.invalidate_author(user.id)
+                search.index_user(user)
                 flash(f"Username {user.username} successfully updated.","success")
                 return redirect(f'/users/{g.user.id}')
 
@@ -269,7 +432,11 @@ def edit_profile():
 @app.route('/users/delete', methods=["POST"])
 @csrf.exempt
 def delete_user():
-    """Delete user."""
+    """Delete user.
+
+    The account is tombstoned (hidden) at once; its messages, likes and
+    follows are purged in the background.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
@@ -277,8 +444,13 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    user_id = g.user.id
+    accounts.tombstone(g.user)
+    accounts.schedule(user_id)
     db.session.commit()
+    identity.invalidate(user_id)
+    fragments.invalidate_author(user_id)
+    search.unindex_user(user_id)
 
     return redirect("/signup")
 
@@ -301,21 +473,60 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        counters.adjust(g.user.id, messages_count=1)
+        timelines.add_own_message(msg)
+        jobs.enqueue(timelines.fan_out, msg.id)
         db.session.commit()
+        search.index_message(msg)
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/messages/search')
+@csrf.exempt
+def messages_search():
+    """Full-text search over messages.
+
+    Takes a 'q' param; results are best match first, paged with a
+    'before' cursor. Time spent searching is reported in a Server-Timing
+    header (and as 'took_ms' in JSON).
+    """
+
+    query = request.args.get('q', '').strip()
+    before = request.args.get('before')
+    limit = limit_arg()
+
+    started = perf_counter()
+    messages = search.search_messages(
+        query,
+        before=search.decode_rank_cursor(before) if before else None,
+        limit=limit) if query else Page([])
+    took_ms = (perf_counter() - started) * 1000
+
+    if wants_json():
+        resp = jsonify(dict(messages.serialize(Message.serialize),
+                            query=query, took_ms=round(took_ms, 2)))
+    else:
+        fragments.prefetch(messages)
+        resp = app.make_response(render_template('messages/search.html',
+                                                 query=query, messages=messages))
+
+    profiling.add_server_timing(resp, 'search', took_ms / 1000)
+    return resp
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
 @csrf.exempt
+@caching.conditional(caching.message_validator)
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = Message.query.options(joinedload(Message.user)).get(message_id)
     return render_template('messages/show.html', message=msg)
 
 
@@ -329,8 +540,12 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    counters.message_removed(message_id, msg.user_id)
+    timelines.remove_message(message_id)
     db.session.delete(msg)
     db.session.commit()
+    fragments.invalidate_message(message_id)
+    search.unindex_message(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -348,20 +563,14 @@ def like_page(message_id):
         return redirect("/")
     
     try:
-        if request.method == 'POST':
-            like = Likes.query.filter_by(user_id=g.user.id, message_id=message_id).first()
-
-            if like is None:
-                like = Likes(user_id=g.user.id, message_id=message_id)
-                db.session.add(like)
-            else:
-                db.session.delete(like)
-
-    except BadRequestKeyError:
-        flash("Access unauthorized.", "danger")
-        return redirect("/")
+        likes.toggle_like(g.user.id, message_id)
+        db.session.commit()
+    except likes.OwnMessage:
+        flash("You can't like your own warbles.", "danger")
+    except (likes.NoSuchMessage, IntegrityError):
+        db.session.rollback()
+        abort(404)
 
-    db.session.commit()
     return redirect('/')
 
 @app.route('/users/<int:user_id>/likes')
@@ -373,8 +582,16 @@ def show_likes(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user)
+    user = User.get_active_or_404(user_id)
+    messages = paginate(feeds.liked_messages_query(user_id),
+                        Message.timestamp, Message.id, **page_args())
+
+    if wants_json():
+        return jsonify(messages.serialize(Message.serialize))
+
+    fragments.prefetch(messages)
+    return render_template('users/likes.html', user=user, messages=messages,
+                           viewer=viewer.load(messages, all_liked=user.id == g.user.id))
 
 
 ##############################################################################
@@ -383,26 +600,25 @@ def show_likes(user_id):
 
 @app.route('/')
 @csrf.exempt
+@caching.conditional(caching.timeline_validator)
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, read from
+      the user's materialized timeline a page at a time
     """
 
     if g.user:
-        followed_users_ids = [user.id for user in g.user.following]
-
-        messages = (Message
-                    .query
-                    .filter(or_(Message.user_id.in_(followed_users_ids), Message.user_id == g.user.id))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        
-        likes = [like.id for like in g.user.likes]
+        messages = timelines.home_timeline(g.user, **page_args())
+
+        if wants_json():
+            return jsonify(messages.serialize(Message.serialize))
 
-        return render_template('home.html', messages=messages, likes=likes)
+        fragments.prefetch(messages)
+
+        return render_template('home.html', messages=messages,
+                               viewer=viewer.load(messages))
         
     else:
     
@@ -410,18 +626,64 @@ def homepage():
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
\ No newline at end of file
+# Maintenance commands
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines_command():
+    """Recompute every user's materialized home timeline."""
+
+    timelines.rebuild_all_timelines()
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recompute every user's stored message/follow/like counts."""
+
+    counters.reconcile_counters()
+    db.session.commit()
+
+
+@app.cli.command('purge-deleted')
+def purge_deleted_command():
+    """Purge every deleted account's rows, a batch at a time."""
+
+    print(f"Purged {accounts.purge_deleted()} deleted accounts")
+
+
+@app.cli.command('worker')
+@click.option('--concurrency', default=1, help="jobs run at once (threads)")
+def worker_command(concurrency):
+    """Run background jobs until interrupted."""
+
+    workers = jobs.Workers()
+    workers.start(app, concurrency)
+    print(f"Running jobs with {concurrency} threads; Ctrl-C to stop")
+
+    try:
+        while True:
+            sleep(60)
+            for name, totals in sorted(jobs.stats.snapshot().items()):
+                print(f"{name}: {totals['jobs']} run, {totals['failed']} failed, "
+                      f"wait avg {totals['avg_wait']:.2f}s max {totals['max_wait']:.2f}s, "
+                      f"run avg {totals['avg_run']:.2f}s")
+    except KeyboardInterrupt:
+        print("Stopping after the jobs in progress...")
+        workers.stop()
+
+
+@app.cli.command('jobs')
+def jobs_command():
+    """Show the job queue: jobs due, scheduled, failed, longest wait."""
+
+    depth = jobs.queue_stats()
+    print(f"{depth['due']} due (oldest waiting {depth['oldest_wait']:.1f}s), "
+          f"{depth['scheduled']} scheduled, {depth['failed']} failed")
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and gzip static files into static/dist."""
+
+    built = assets.build_assets(app)
+    print(f"Built {len(built)} assets into {assets.dist_folder(app)}")
@@ -0,0 +1,167 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies every file under static/ into static/dist/
+with a content hash in its name (style.css -> style.3f2a9c1e0b.css),
+writes a `.gz` sibling for compressible files, and records the mapping in
+static/dist/manifest.json. CSS references to other static files are
+rewritten to their hashed names.
+
+Templates link assets with `static_url()`, which uses the manifest when
+there is one and the plain /static/ URL otherwise, so the app still works
+without a build. Hashed files never change, so they're served with a
+year-long immutable Cache-Control; the `.gz` sibling is sent to clients
+that accept gzip. Old hashed files are kept on rebuild, for pages and
+caches that still link them.
+"""
+
+import gzip
+import json
+import mimetypes
+import os
+import re
+from hashlib import sha256
+
+from flask import current_app, request, send_from_directory, url_for
+
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.txt', '.json', '.html'}
+
+STATIC_URL = re.compile(r'/static/([\w./-]+)')
+
+manifest = {}
+
+
+def init_app(app):
+    """Load the manifest, serve hashed files and add `static_url()`."""
+
+    load_manifest(app)
+
+    app.add_url_rule(f"{app.static_url_path}/{DIST_DIR}/<path:filename>",
+                     'assets', send_asset)
+    app.add_template_global(static_url)
+
+
+def dist_folder(app):
+    return os.path.join(app.static_folder, DIST_DIR)
+
+
+def load_manifest(app):
+    path = os.path.join(dist_folder(app), MANIFEST)
+
+    manifest.clear()
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest.update(json.load(f))
+
+
+def static_url(filename):
+    """URL of a static file, fingerprinted when it has been built.
+
+    Takes a path relative to static/ or a '/static/...' URL (as stored in
+    users' default image fields); any other URL is returned unchanged.
+    """
+
+    prefix = current_app.static_url_path + '/'
+
+    if not filename:
+        return filename
+    elif filename.startswith(prefix):
+        filename = filename[len(prefix):]
+    elif '://' in filename or filename.startswith('/'):
+        return filename
+
+    if filename in manifest:
+        return url_for('assets', filename=manifest[filename])
+
+    return url_for('static', filename=filename)
+
+
+def send_asset(filename):
+    """Serve a hashed file, gzipped when the client accepts it."""
+
+    folder = dist_folder(current_app)
+    gzipped = filename + '.gz'
+
+    if ('gzip' in request.accept_encodings
+            and os.path.exists(os.path.join(folder, gzipped))):
+        resp = send_from_directory(folder, gzipped)
+        resp.mimetype = mimetypes.guess_type(filename)[0] or resp.mimetype
+        resp.headers['Content-Encoding'] = 'gzip'
+    else:
+        resp = send_from_directory(folder, filename)
+
+    resp.headers['Cache-Control'] = IMMUTABLE
+    resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+
+##############################################################################
+# Build
+
+
+def hashed_name(path, data):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{sha256(data).hexdigest()[:10]}{ext}"
+
+
+def rewrite_css(data, built):
+    """Point /static/ URLs in a stylesheet at their hashed copies."""
+
+    def replace(match):
+        hashed = built.get(match.group(1))
+        return f"/static/{DIST_DIR}/{hashed}" if hashed else match.group(0)
+
+    return STATIC_URL.sub(replace, data.decode('UTF-8')).encode('UTF-8')
+
+
+def write_asset(dist, name, data):
+    path = os.path.join(dist, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, 'wb') as f:
+        f.write(data)
+
+    if os.path.splitext(name)[1] in COMPRESSIBLE:
+        compressed = gzip.compress(data, compresslevel=9, mtime=0)
+        if len(compressed) < len(data):
+            with open(path + '.gz', 'wb') as f:
+                f.write(compressed)
+
+
+def build_assets(app):
+    """Fingerprint and compress everything under static/; return the manifest."""
+
+    static = app.static_folder
+    dist = dist_folder(app)
+    sources = []
+
+    for root, dirs, files in os.walk(static):
+        dirs[:] = [d for d in dirs
+                   if os.path.join(root, d) != dist and not d.startswith('.')]
+        sources += [os.path.relpath(os.path.join(root, name), static)
+                    for name in files if not name.startswith('.')]
+
+    # Stylesheets last, so the files they reference are already hashed.
+    sources.sort(key=lambda name: (name.endswith('.css'), name))
+    built = {}
+
+    for name in sources:
+        with open(os.path.join(static, name), 'rb') as f:
+            data = f.read()
+
+        if name.endswith('.css'):
+            data = rewrite_css(data, built)
+
+        key = name.replace(os.sep, '/')
+        built[key] = hashed_name(key, data)
+        write_asset(dist, built[key], data)
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(built, f, indent=2, sort_keys=True)
+
+    load_manifest(app)
+    return built
@@ -0,0 +1,198 @@
+"""HTTP cache policies and conditional GET for Warbler's pages.
+
+Views opt in with `@conditional(validator)`. The validator runs a few
+cheap queries (counters, newest message id...) and returns the parts
+that, with the viewer and their CSRF token, make up the ETag. When the
+browser already holds that version we answer `304 Not Modified` without
+running the view or rendering anything.
+
+These pages are put together from many rows (likes, follows, counters,
+other users' profiles), so no single date says when one last changed:
+they get no Last-Modified, and If-Modified-Since is ignored.
+
+Pages with pending flash messages are always rendered, so a flash is never
+lost to a 304. Responses that don't set their own policy are marked
+`private, no-cache`; static files keep Flask's own headers.
+"""
+
+from functools import wraps
+from hashlib import sha1
+from time import time
+
+from flask import current_app, g, request, session
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy import func
+
+import timelines
+from models import db, Follows, Message, User
+
+REVALIDATE = 'private, no-cache'
+
+VARY = 'Cookie, Accept'
+
+
+def init_app(app):
+    """Give every dynamic response a cache policy."""
+
+    @app.after_request
+    def apply_default_policy(resp):
+        if request.endpoint != 'static' and 'Cache-Control' not in resp.headers:
+            resp.headers['Cache-Control'] = REVALIDATE
+        return resp
+
+
+def csrf_bucket():
+    """Changes with the session's CSRF token, and often enough that a
+    cached page's signed token never outlives WTF_CSRF_TIME_LIMIT."""
+
+    generate_csrf()
+    token = session[current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')]
+
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    bucket = int(time() // (limit / 2)) if limit else None
+
+    return sha1(token.encode('UTF-8')).hexdigest(), bucket
+
+
+def viewer_parts():
+    """What the page chrome shows about the logged-in user."""
+
+    if not g.user:
+        return None
+
+    return g.user.id, g.user.username, g.user.image_url, g.user.header_image_url
+
+
+def make_etag(parts):
+    raw = repr((parts,
+                request.full_path,
+                request.accept_mimetypes.best,
+                viewer_parts(),
+                csrf_bucket()))
+    return sha1(raw.encode('UTF-8')).hexdigest()
+
+
+def is_fresh(etag):
+    """Does the client's copy match? Compares weakly (gzipped responses
+    carry weak ETags)."""
+
+    return request.if_none_match.contains_weak(etag)
+
+
+def conditional(validator, cache_control=REVALIDATE):
+    """Answer GETs with 304 when `validator(**view_args)` hasn't changed.
+
+    `validator` returns the ETag's parts, or None to always render.
+    """
+
+    def decorator(view):
+
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            parts = validator(*args, **kwargs)
+
+            if parts is None:
+                return view(*args, **kwargs)
+
+            etag = make_etag(parts)
+
+            if is_fresh(etag):
+                resp = current_app.response_class(status=304)
+            else:
+                resp = current_app.make_response(view(*args, **kwargs))
+
+                if resp.status_code != 200:
+                    return resp
+
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = cache_control
+            resp.headers['Vary'] = VARY
+            return resp
+
+        return wrapped
+
+    return decorator
+
+
+##############################################################################
+# Validators
+
+
+def follows(user_id):
+    """Does the viewer follow `user_id`?"""
+
+    if not g.user or g.user.id == user_id:
+        return None
+
+    return (db.session
+            .query(Follows.query
+                   .filter(Follows.user_following_id == g.user.id,
+                           Follows.user_being_followed_id == user_id)
+                   .exists())
+            .scalar())
+
+
+def viewer_likes():
+    """Changes whenever the viewer likes or unlikes something."""
+
+    if not g.user:
+        return None
+
+    return g.user.likes_version
+
+
+def profile_validator(user_id):
+    """Profile page: the user's details and counters, their newest message,
+    and which of them the viewer has liked."""
+
+    user = User.query.get(user_id)
+
+    if user is None or user.deleted_at:
+        return None
+
+    newest_id = (db.session
+                 .query(func.max(Message.id))
+                 .filter(Message.user_id == user_id)
+                 .scalar())
+
+    parts = (user.username, user.image_url, user.header_image_url,
+             user.bio, user.location,
+             user.messages_count, user.following_count,
+             user.followers_count, user.likes_count,
+             newest_id, follows(user_id),
+             None if g.user and g.user.id == user_id else viewer_likes())
+
+    return parts
+
+
+def message_validator(message_id):
+    """Message permalink: the message, its author, and whether we follow them."""
+
+    row = (db.session
+           .query(User.id, User.username, User.image_url)
+           .select_from(Message)
+           .join(User, User.id == Message.user_id)
+           .filter(Message.id == message_id)
+           .first())
+
+    if row is None:
+        return None
+
+    author_id, username, image_url = row
+    return author_id, username, image_url, follows(author_id)
+
+
+def timeline_validator():
+    """Home feed: what's in it (authors' names and pictures included), the
+    viewer's counters, and which messages they've liked."""
+
+    if not g.user:
+        return None
+
+    counts = (g.user.messages_count, g.user.following_count,
+              g.user.followers_count)
+
+    return timelines.timeline_version(g.user.id), counts, viewer_likes()
@@ -0,0 +1,139 @@
+"""gzip compression for HTML and JSON responses.
+
+Responses are compressed when the client sends `Accept-Encoding: gzip`,
+the body is a text type, and it's at least COMPRESS_MIN_SIZE bytes.
+Streamed responses (the JSON API) are compressed chunk by chunk as they're
+sent, so they still reach the client progressively.
+
+Strong ETags become weak ones on compressed responses, since the bytes
+differ from the identity encoding; conditional GETs compare weakly.
+
+Bytes in, bytes out and CPU time are totalled per endpoint in `stats`.
+"""
+
+import gzip
+import zlib
+from threading import Lock
+from time import thread_time
+
+from flask import request
+
+DEFAULT_LEVEL = 6
+DEFAULT_MIN_SIZE = 500
+
+COMPRESSIBLE = {
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/csv',
+    'application/json', 'application/x-ndjson', 'application/javascript',
+    'application/xml', 'image/svg+xml',
+}
+
+
+class CompressionStats:
+    """Per-endpoint totals: responses, bytes before/after, CPU seconds."""
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = Lock()
+
+    def record(self, endpoint, bytes_in, bytes_out, cpu):
+        with self._lock:
+            route = self._routes.setdefault(
+                endpoint, {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu': 0.0})
+            route['responses'] += 1
+            route['bytes_in'] += bytes_in
+            route['bytes_out'] += bytes_out
+            route['cpu'] += cpu
+
+    def snapshot(self):
+        """{endpoint: totals}, with bytes saved added."""
+
+        with self._lock:
+            return {endpoint: dict(route, saved=route['bytes_in'] - route['bytes_out'])
+                    for endpoint, route in self._routes.items()}
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+
+
+stats = CompressionStats()
+
+
+def init_app(app):
+    """Compress responses after every other hook has run.
+
+    Register this before anything that rewrites response bodies (like the
+    debug toolbar): after_request hooks run in reverse order.
+    """
+
+    @app.after_request
+    def compress_response(resp):
+        if not should_compress(resp):
+            return resp
+
+        level = app.config.get('COMPRESS_LEVEL', DEFAULT_LEVEL)
+
+        if resp.is_streamed:
+            source = resp.response
+            resp.response = compress_stream(
+                resp.iter_encoded(), source, level, request.endpoint)
+            resp.headers.pop('Content-Length', None)
+        else:
+            data = resp.get_data()
+
+            if len(data) < app.config.get('COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE):
+                return resp
+
+            started = thread_time()
+            compressed = gzip.compress(data, compresslevel=level)
+            stats.record(request.endpoint, len(data), len(compressed),
+                         thread_time() - started)
+            resp.set_data(compressed)
+
+        resp.headers['Content-Encoding'] = 'gzip'
+        resp.vary.add('Accept-Encoding')
+
+        etag, weak = resp.get_etag()
+        if etag and not weak:
+            resp.set_etag(etag, weak=True)
+
+        return resp
+
+
+def should_compress(resp):
+    return ('gzip' in request.accept_encodings
+            and request.method != 'HEAD'
+            and resp.status_code == 200
+            and not resp.direct_passthrough
+            and 'Content-Encoding' not in resp.headers
+            and resp.mimetype in COMPRESSIBLE)
+
+
+def compress_stream(chunks, source, level, endpoint):
+    """gzip `chunks` as they're produced; then close `source`."""
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    bytes_in = bytes_out = 0
+    cpu = 0.0
+
+    try:
+        for chunk in chunks:
+            started = thread_time()
+            out = compressor.compress(chunk)
+            cpu += thread_time() - started
+
+            bytes_in += len(chunk)
+            if out:
+                bytes_out += len(out)
+                yield out
+
+        out = compressor.flush()
+        bytes_out += len(out)
+        yield out
+
+    finally:
+        stats.record(endpoint, bytes_in, bytes_out, cpu)
+
+        close = getattr(source, 'close', None)
+        if close is not None:
+            close()
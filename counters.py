@@ -0,0 +1,83 @@
+"""Denormalized per-user counters.
+
+`User` stores how many messages, follows, followers and likes it has so
+pages can show them without loading whole relationships. Every route that
+changes one of those relationships adjusts the counter in the same
+transaction with an in-database `col = col + n`, so concurrent requests
+can't lose updates.
+"""
+
+from sqlalchemy import func, select
+
+from models import db, Follows, Likes, Message, User
+
+users = User.__table__
+
+
+def adjust(user_id, **deltas):
+    """Add `deltas` (e.g. messages_count=1) to one user's counters."""
+
+    db.session.execute(users
+                       .update()
+                       .where(users.c.id == user_id)
+                       .values({users.c[name]: users.c[name] + delta
+                                for name, delta in deltas.items()}))
+
+
+def liked(user_id, delta=1):
+    """Record a like (or, with delta=-1, an unlike) by `user_id`."""
+
+    adjust(user_id, likes_count=delta, likes_version=1)
+
+
+def followed_many(follower_id, followed_ids, delta=1):
+    """Record follows (or unfollows) of several users at once."""
+
+    if not followed_ids:
+        return
+
+    adjust(follower_id, following_count=delta * len(followed_ids))
+    db.session.execute(users
+                       .update()
+                       .where(users.c.id.in_(followed_ids))
+                       .values(followers_count=users.c.followers_count + delta))
+
+
+def message_removed(message_id, author_id):
+    """Record deletion of a message, and of the likes it takes with it."""
+
+    adjust(author_id, messages_count=-1)
+    likes_removed([message_id])
+
+
+def likes_removed(message_ids):
+    """Record that every like of `message_ids` is about to be deleted."""
+
+    liked_here = (select([func.count()])
+                  .where(Likes.message_id.in_(message_ids))
+                  .where(Likes.user_id == users.c.id)
+                  .as_scalar())
+    likers = select([Likes.user_id]).where(Likes.message_id.in_(message_ids))
+    db.session.execute(users
+                       .update()
+                       .where(users.c.id.in_(likers))
+                       .values(likes_count=users.c.likes_count - liked_here,
+                               likes_version=users.c.likes_version + 1))
+
+
+def reconcile_counters():
+    """Recompute every user's counters from the source tables in one pass."""
+
+    def count(column, match):
+        return (select([func.count(column)])
+                .where(match == users.c.id)
+                .as_scalar())
+
+    db.session.execute(users.update().values(
+        messages_count=count(Message.id, Message.user_id),
+        following_count=count(Follows.user_being_followed_id,
+                              Follows.user_following_id),
+        followers_count=count(Follows.user_following_id,
+                              Follows.user_being_followed_id),
+        likes_count=count(Likes.message_id, Likes.user_id),
+    ))
@@ -0,0 +1,70 @@
+"""Queries behind Warbler's feeds and user lists.
+
+The HTML views and the JSON API page through the same queries; they
+differ only in how rows are rendered.
+"""
+
+from sqlalchemy.orm import joinedload
+
+from models import db, Follows, Likes, Message, User
+
+# Follow lists are (user, followed at) rows, newest follow first; these are
+# the columns keyset_query pages them by.
+FOLLOWING_ORDER = (Follows.timestamp, Follows.user_being_followed_id)
+FOLLOWERS_ORDER = (Follows.timestamp, Follows.user_following_id)
+
+
+def user_messages_query(user_id):
+    """Messages written by `user_id` (unordered; page with keyset_query).
+
+    Their author is already in the session as the profile being shown,
+    so `msg.user` needs no eager load.
+    """
+
+    return Message.query.filter(Message.user_id == user_id)
+
+
+def liked_messages_query(user_id):
+    """Messages liked by `user_id` (unordered; page with keyset_query)."""
+
+    return (Message
+            .query
+            .options(joinedload(Message.user))
+            .join(Likes, Likes.message_id == Message.id)
+            .filter(Likes.user_id == user_id))
+
+
+def following_query(user_id):
+    """(user, followed at) for everyone `user_id` follows (unordered; page
+    with keyset_query by FOLLOWING_ORDER)."""
+
+    return (db.session
+            .query(User, Follows.timestamp)
+            .join(Follows, Follows.user_being_followed_id == User.id)
+            .filter(Follows.user_following_id == user_id,
+                    User.deleted_at.is_(None)))
+
+
+def followers_query(user_id):
+    """(user, followed at) for everyone following `user_id` (unordered;
+    page with keyset_query by FOLLOWERS_ORDER)."""
+
+    return (db.session
+            .query(User, Follows.timestamp)
+            .join(Follows, Follows.user_following_id == User.id)
+            .filter(Follows.user_being_followed_id == user_id,
+                    User.deleted_at.is_(None)))
+
+
+def follow_key(row):
+    """Sort key of a (user, followed at) row in a follow list."""
+
+    user, timestamp = row
+    return timestamp, user.id
+
+
+def serialize_follow(row):
+    """JSON-friendly dict of a (user, followed at) row."""
+
+    user, timestamp = row
+    return dict(user.serialize(), followed_at=timestamp.isoformat())
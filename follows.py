@@ -0,0 +1,123 @@
+"""Following and unfollowing users.
+
+Each is a write to the follows edges themselves; nobody's `following`
+collection is loaded. Repeating a follow or unfollow changes nothing: on
+Postgres the INSERT skips existing edges (ON CONFLICT DO NOTHING) and
+both statements report back the edges they changed (RETURNING); other
+databases look the edges up first and INSERT OR IGNORE. Only edges that
+really changed move the counters and the follower's home timeline (a
+backfill job pulls in the newly followed users' recent messages).
+
+Ids of users that don't exist (or were deleted), and the follower's own
+id, are skipped.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import and_, literal, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+import counters
+import jobs
+import timelines
+from models import db, is_postgres, Follows, User
+
+follows = Follows.__table__
+
+COLUMNS = ['user_following_id', 'user_being_followed_id', 'timestamp']
+
+# Most users a single bulk request may follow or unfollow.
+BULK_LIMIT = 1000
+
+
+def edges(follower_id, followed_ids):
+    return and_(follows.c.user_following_id == follower_id,
+                follows.c.user_being_followed_id.in_(followed_ids))
+
+
+def existing(follower_id, followed_ids):
+    """Which of `followed_ids` `follower_id` already follows."""
+
+    rows = db.session.execute(select([follows.c.user_being_followed_id])
+                              .where(edges(follower_id, followed_ids)))
+    return {followed_id for (followed_id,) in rows}
+
+
+def follow_many(follower_id, followed_ids):
+    """Make `follower_id` follow each of `followed_ids`.
+
+    Returns the ids newly followed.
+    """
+
+    followed_ids = set(followed_ids) - {follower_id}
+
+    if not followed_ids:
+        return []
+
+    targets = (select([literal(follower_id), User.id, literal(datetime.utcnow())])
+               .where(User.id.in_(followed_ids))
+               .where(User.deleted_at.is_(None)))
+
+    if is_postgres():
+        rows = db.session.execute(pg_insert(follows)
+                                  .from_select(COLUMNS, targets)
+                                  .on_conflict_do_nothing()
+                                  .returning(follows.c.user_being_followed_id))
+        added = sorted(followed_id for (followed_id,) in rows)
+    else:
+        already = existing(follower_id, followed_ids)
+        targets = targets.where(~User.id.in_(already)) if already else targets
+        added = sorted(user_id for (_, user_id, _) in db.session.execute(targets))
+
+        if added:
+            db.session.execute(follows.insert().prefix_with('OR IGNORE', dialect='sqlite'),
+                               [dict(zip(COLUMNS, (follower_id, user_id, datetime.utcnow())))
+                                for user_id in added])
+
+    counters.followed_many(follower_id, added)
+
+    for followed_id in added:
+        jobs.enqueue(timelines.backfill, follower_id, followed_id)
+
+    return added
+
+
+def unfollow_many(follower_id, followed_ids):
+    """Make `follower_id` stop following each of `followed_ids`.
+
+    Returns the ids no longer followed.
+    """
+
+    followed_ids = set(followed_ids) - {follower_id}
+
+    if not followed_ids:
+        return []
+
+    delete = follows.delete().where(edges(follower_id, followed_ids))
+
+    if is_postgres():
+        rows = db.session.execute(delete.returning(follows.c.user_being_followed_id))
+        removed = sorted(followed_id for (followed_id,) in rows)
+    else:
+        removed = sorted(existing(follower_id, followed_ids))
+        if removed:
+            db.session.execute(delete)
+
+    counters.followed_many(follower_id, removed, delta=-1)
+
+    if removed:
+        timelines.remove_follows(follower_id, removed)
+
+    return removed
+
+
+def follow(follower_id, followed_id):
+    """Follow one user; returns whether that's new."""
+
+    return bool(follow_many(follower_id, [followed_id]))
+
+
+def unfollow(follower_id, followed_id):
+    """Unfollow one user; returns whether they were followed."""
+
+    return bool(unfollow_many(follower_id, [followed_id]))
@@ -0,0 +1,187 @@
+"""Cache of rendered message list items.
+
+Each message's `<li>` body (avatar, author, date, text) is rendered once
+and reused by every feed that shows it; only the viewer-specific parts
+(the like button) are rendered per request.
+
+Entries are stored per message id together with a version made from the
+author's displayed profile fields, so a profile edit makes old entries
+miss. The in-process LRU backend also drops an author's entries eagerly;
+a shared backend (Redis, via FRAGMENT_CACHE_URL) relies on the version and
+its TTL. Deleted messages are removed explicitly.
+"""
+
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+
+from flask import g, render_template
+from markupsafe import Markup
+
+# Bump when templates/messages/_item.html changes.
+TEMPLATE_VERSION = 2
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_SHARED_TTL = 24 * 60 * 60
+
+
+class LRUBackend:
+    """Bounded in-process cache with tags for group invalidation."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = Lock()
+
+    def get_many(self, keys):
+        with self._lock:
+            found = {}
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key][0]
+            return found
+
+    def set(self, key, value, tag=None):
+        with self._lock:
+            self._delete(key)
+            self._entries[key] = (value, tag)
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.maxsize:
+                self._delete(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._delete(key)
+
+    def delete_tag(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._delete(key)
+
+    def _delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[1] is not None:
+            keys = self._tags.get(entry[1])
+            keys.discard(key)
+            if not keys:
+                del self._tags[entry[1]]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+
+class SharedBackend:
+    """Cache shared between processes, on a Redis-like client.
+
+    `client` needs get/mget/set(ex=)/delete. Tags aren't tracked; stale
+    entries are skipped by their version and expire after `ttl`.
+    """
+
+    def __init__(self, client, ttl=DEFAULT_SHARED_TTL, prefix='warbler:fragment:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([self.prefix + key for key in keys])
+        return {key: value.decode('UTF-8') for key, value in zip(keys, values)
+                if value is not None}
+
+    def set(self, key, value, tag=None):
+        self.client.set(self.prefix + key, value.encode('UTF-8'), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def delete_tag(self, tag):
+        pass
+
+    def clear(self):
+        pass
+
+
+backend = LRUBackend()
+
+
+def init_app(app):
+    """Pick the backend from config and register `message_fragment()`."""
+
+    global backend
+
+    url = app.config.get('FRAGMENT_CACHE_URL')
+
+    if url:
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("FRAGMENT_CACHE_URL needs the 'redis' package installed")
+        backend = SharedBackend(redis.Redis.from_url(url),
+                                ttl=app.config.get('FRAGMENT_CACHE_TTL', DEFAULT_SHARED_TTL))
+    else:
+        backend = LRUBackend(app.config.get('FRAGMENT_CACHE_SIZE', DEFAULT_CACHE_SIZE))
+
+    app.add_template_global(message_fragment)
+
+
+def message_cache_key(message_id):
+    return f"message:{message_id}"
+
+
+def author_tag(user_id):
+    return f"author:{user_id}"
+
+
+def fragment_version(msg):
+    """Changes whenever anything the fragment shows about the author changes."""
+
+    author = msg.user
+    raw = f"{TEMPLATE_VERSION}|{author.username}|{author.image_url}"
+    return sha1(raw.encode('UTF-8')).hexdigest()[:12]
+
+
+def prefetch(messages):
+    """Fetch cached fragments for a page of messages in one backend call."""
+
+    keys = [message_cache_key(msg.id) for msg in messages]
+    g.message_fragments = backend.get_many(keys)
+
+
+def message_fragment(msg):
+    """Rendered `<li>` body for `msg`, from the cache when possible."""
+
+    key = message_cache_key(msg.id)
+    version = fragment_version(msg)
+
+    prefetched = g.get('message_fragments')
+    cached = (prefetched.get(key) if prefetched is not None
+              else backend.get_many([key]).get(key))
+
+    if cached is not None:
+        cached_version, _, html = cached.partition('\n')
+        if cached_version == version:
+            return Markup(html)
+
+    html = render_template('messages/_item.html', msg=msg)
+    backend.set(key, f"{version}\n{html}", tag=author_tag(msg.user_id))
+    return Markup(html)
+
+
+def invalidate_message(message_id):
+    """Forget a deleted message's fragment."""
+
+    backend.delete(message_cache_key(message_id))
+
+
+def invalidate_author(user_id):
+    """Forget fragments showing an author whose profile changed."""
+
+    backend.delete_tag(author_tag(user_id))
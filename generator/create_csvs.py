@@ -2,76 +2,227 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows:
+
+    python generator/create_csvs.py --users 1000000 --messages 50000000 \\
+        --follows 40000000 --likes 10000000 --processes 8
+
+Output is the same for the same --seed whatever the number of processes:
+every chunk of rows draws from its own random generator, seeded from the
+seed and the chunk's position. Chunks are written by worker processes to
+part files, which are then joined in order. Nothing is fetched from the
+network.
+
+- Follows form a power-law graph: a few users have most of the followers.
+- Message counts per user are power-law too. Message and follow times are
+  skewed towards the end of the time span.
+- Each message gets a geometrically distributed number of likes, from
+  users drawn by popularity; nobody likes a message twice, or their own.
+
+Users get ids in file order when loaded, which the other files rely on.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from random import Random
+
+from helpers import (CITIES, DOMAINS, WORDS, geometric, scrambler, sentence,
+                     skewed_datetime, zipf_rank)
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio',
+                     'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
-FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id', 'timestamp']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
+NUM_LIKES = 500
 
-fake = Faker()
+CHUNK_SIZE = 100_000
 
-# Generate random profile image URLs to use for users
+# Every user's password is "password".
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-image_urls = [
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+HEADER_IMAGE_URLS = ['/static/images/warbler-hero.jpg']
+
+# Salts for scrambler(): who's popular, and who posts a lot.
+POPULAR, PROLIFIC = 1, 2
+
+
+def chunk_rng(seed, table, chunk):
+    return Random(f"{seed}:{table}:{chunk}")
+
+
+def users_chunk(args, chunk, start, count, writer):
+    rng = chunk_rng(args.seed, 'users', chunk)
+
+    for user_id in range(start, start + count):
+        username = f"{rng.choice(WORDS)}_{rng.choice(WORDS)}{user_id}"
+
+        writer.writerow([
+            f"{username}@{rng.choice(DOMAINS)}",
+            username,
+            rng.choice(IMAGE_URLS),
+            PASSWORD_HASH,
+            sentence(rng, MAX_WARBLER_LENGTH),
+            rng.choice(HEADER_IMAGE_URLS),
+            rng.choice(CITIES),
+        ])
+
+
+def follows_chunk(args, chunk, start, count, writer):
+    """Edges for followers start..start+count-1; whom they follow is
+    Zipf-distributed, so in-degrees follow a power law."""
+
+    rng = chunk_rng(args.seed, 'follows', chunk)
+    popular = scrambler(args.users, POPULAR)
+    mean = args.follows / args.users
+
+    for follower in range(start, start + count):
+        degree = min(geometric(rng, mean), args.users - 1)
+        followed = set()
+
+        # Popular users are drawn over and over; give up on the rare
+        # follower whose degree nears the whole user count.
+        for _ in range(10 * degree):
+            if len(followed) == degree:
+                break
+
+            user_id = popular(zipf_rank(rng, args.users, args.alpha))
+            if user_id != follower and user_id not in followed:
+                followed.add(user_id)
+                writer.writerow([user_id, follower,
+                                 skewed_datetime(rng, args.end, args.days, args.skew)])
+
+
+def messages_chunk(args, chunk, start, count, writer, likes_writer):
+    """Messages start..start+count-1, and the likes they get."""
+
+    rng = chunk_rng(args.seed, 'messages', chunk)
+    prolific = scrambler(args.users, PROLIFIC)
+    popular = scrambler(args.users, POPULAR)
+    mean_likes = args.likes / args.messages if args.messages else 0
+
+    for message_id in range(start, start + count):
+        author = prolific(zipf_rank(rng, args.users, args.alpha))
+        timestamp = skewed_datetime(rng, args.end, args.days, args.skew)
+
+        writer.writerow([sentence(rng, MAX_WARBLER_LENGTH), timestamp, author])
+
+        wanted = min(geometric(rng, mean_likes), args.users - 1)
+        likers = set()
+
+        for _ in range(10 * wanted):
+            if len(likers) == wanted:
+                break
+
+            liker = popular(zipf_rank(rng, args.users, args.alpha))
+            if liker != author and liker not in likers:
+                likers.add(liker)
+                likes_writer.writerow([liker, message_id])
+
+
+def part_path(args, table, chunk):
+    return os.path.join(args.out, 'parts', f"{table}.{chunk:06d}.csv")
+
+
+def write_chunk(args, table, chunk, start, count):
+    """Write one chunk of `table` to its part file(s) (runs in a worker)."""
+
+    with open(part_path(args, table, chunk), 'w', newline='') as f:
+        writer = csv.writer(f)
+
+        if table == 'messages':
+            with open(part_path(args, 'likes', chunk), 'w', newline='') as likes:
+                messages_chunk(args, chunk, start, count, writer, csv.writer(likes))
+        elif table == 'users':
+            users_chunk(args, chunk, start, count, writer)
+        else:
+            follows_chunk(args, chunk, start, count, writer)
+
+
+def chunks(total, size):
+    """(chunk number, first id, count) covering ids 1..total."""
+
+    return [(i, start, min(size, total - start + 1))
+            for i, start in enumerate(range(1, total + 1, size))]
+
+
+def join_parts(args, table, headers, count):
+    """Concatenate a table's part files, in chunk order, under its header."""
+
+    with open(os.path.join(args.out, f"{table}.csv"), 'w', newline='') as out:
+        csv.writer(out).writerow(headers)
+
+        for chunk in range(count):
+            path = part_path(args, table, chunk)
+            with open(path, newline='') as part:
+                shutil.copyfileobj(part, out)
+            os.remove(path)
+
+
+def generate(args):
+    os.makedirs(os.path.join(args.out, 'parts'), exist_ok=True)
+
+    jobs = {
+        'users': chunks(args.users, args.chunk_size),
+        'follows': chunks(args.users,
+                          max(1, args.chunk_size * args.users // max(args.follows, 1))),
+        'messages': chunks(args.messages, args.chunk_size),
+    }
+
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = [pool.submit(write_chunk, args, table, *job)
+                   for table, table_jobs in jobs.items() for job in table_jobs]
+        for future in futures:
+            future.result()
+
+    join_parts(args, 'users', USERS_CSV_HEADERS, len(jobs['users']))
+    join_parts(args, 'follows', FOLLOWS_CSV_HEADERS, len(jobs['follows']))
+    join_parts(args, 'messages', MESSAGES_CSV_HEADERS, len(jobs['messages']))
+    join_parts(args, 'likes', LIKES_CSV_HEADERS, len(jobs['messages']))
+
+    os.rmdir(os.path.join(args.out, 'parts'))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate Warbler CSVs.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS,
+                        help="about how many follows to make")
+    parser.add_argument('--likes', type=int, default=NUM_LIKES,
+                        help="about how many likes to make")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help="rows per part file")
+    parser.add_argument('--alpha', type=float, default=1.0,
+                        help="power-law exponent for popularity and activity")
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=datetime(2024, 1, 1),
+                        help="latest message time (fixed, so output is repeatable)")
+    parser.add_argument('--days', type=float, default=2 * 365,
+                        help="how far back messages go")
+    parser.add_argument('--skew', type=float, default=2.0,
+                        help="above 1, messages bunch up towards --end")
+    parser.add_argument('--out', default=os.path.dirname(os.path.abspath(__file__)))
+    return parser.parse_args()
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == '__main__':
+    generate(parse_args())
@@ -1,14 +1,104 @@
 """Support functions for CSV generation."""
 
-from datetime import datetime
-from random import uniform
+from datetime import timedelta
+from math import gcd, log
 
+WORDS = """
+    about above across after again air all almost along also always among and
+    animal answer any area around ask away back ball base bear beautiful became
+    because become bed been before began begin behind being below best better
+    between big bird black blue boat body book both box boy bring brought build
+    built busy call came can car care carry cat center certain change check
+    child children city class clear close cold color come common complete could
+    country course cover cross cry dark day deep did different direction does
+    dog done door down draw dream drive dry during each early earth east easy
+    eat edge end enough even ever every example eye face fact fall family far
+    farm fast father feel feet few field figure fill final find fine fire first
+    fish five fly follow food foot for force form found four free friend from
+    front full game gave get girl give glass go gold good got great green
+    ground group grow had half hand happen happy hard has have head hear heard
+    heart heat heavy help her here high hill him his hold home hope horse hot
+    hour house how hundred idea important inch island just keep kept kind king
+    knew know land language large last late laugh lay lead learn leave left
+    less let letter life light like line list listen little live long look
+    lost love low machine made main make man many map mark may mean measure
+    men might mile mind minute miss money moon more morning most mother mountain
+    move much music must name near need never new next night north note nothing
+    notice now number object ocean off often old once one only open order other
+    our out over own page paper part pass past pattern people perhaps person
+    picture piece place plan plant play point pole poor port power press
+    problem product pull put question quick quiet rain ran reach read ready real
+    record red remember rest right river road rock room round rule run said same
+    saw say school science sea second see seem self sentence serve set several
+    shape ship short should show side simple since sing sit six size sleep slow
+    small snow some song soon sound south space special spell stand star start
+    state stay step still stood stop story street strong study such sun sure
+    surface table tail take talk teach tell ten test than that the their them
+    then there these they thing think this those though thought three through
+    time tire together told too took top toward town travel tree true try turn
+    two under unit until upon usual very voice vowel wait walk wall want war
+    warm was watch water wave way week weight well went were west what wheel
+    when where which while white who whole why wide wild will wind winter wish
+    with without wonder wood word work world would write year yes yet you young
+""".split()
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+CITIES = """
+    Springfield Riverside Fairview Franklin Greenville Bristol Clinton Salem
+    Madison Georgetown Arlington Ashland Dover Oxford Jackson Burlington
+    Manchester Milton Newport Auburn Dayton Lexington Milford Winchester
+""".split()
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+DOMAINS = ['example.com', 'example.net', 'example.org', 'mail.test']
 
-    return datetime.fromtimestamp(random_timestamp)
+
+def zipf_rank(rng, n, alpha=1.0):
+    """A rank in [1, n], where rank r comes up about as often as 1 / r**alpha.
+
+    Inverse-CDF sampling of the continuous power law, so it takes constant
+    time and memory however large `n` is.
+    """
+
+    u = rng.random()
+
+    if alpha == 1.0:
+        x = (n + 1) ** u
+    else:
+        x = ((((n + 1) ** (1 - alpha)) - 1) * u + 1) ** (1 / (1 - alpha))
+
+    return min(int(x), n)
+
+
+def geometric(rng, mean):
+    """A count (0, 1, 2...) with the given mean, smaller counts likelier."""
+
+    if mean <= 0:
+        return 0
+
+    return int(log(1 - rng.random()) / log(mean / (mean + 1)))
+
+
+def scrambler(n, salt=1):
+    """A bijection of [1, n] onto itself, so that the most popular ranks
+    aren't simply the lowest ids. Different salts give different orders."""
+
+    step = 7919 * salt + 1_000_003
+
+    while gcd(step, n) != 1:
+        step += 1
+
+    return lambda rank: (rank - 1) * step % n + 1
+
+
+def skewed_datetime(rng, end, span_days, skew=2.0):
+    """A time in the `span_days` before `end`, recent times more likely."""
+
+    return end - timedelta(days=span_days * rng.random() ** skew)
+
+
+def sentence(rng, max_length):
+    """Some random words, capitalized, at most `max_length` characters."""
+
+    words = rng.choices(WORDS, k=rng.randint(4, 24))
+    text = ' '.join(words).capitalize()[:max_length - 1].rstrip()
+
+    return text + '.'
@@ -0,0 +1,136 @@
+"""Resolving the logged-in user cheaply.
+
+`g.user` is looked up only when a view or template first reads it, so
+static files and pages that never touch it cost no query. Lookups go
+through a small process-local cache of the user's profile columns with a
+TTL; a hit rebuilds the `User` in the session without a round trip.
+
+The cache is per process: `invalidate()` only clears the local copy, so
+other workers may serve a stale profile for up to USER_CACHE_TTL seconds.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from flask.ctx import _AppCtxGlobals
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 30
+
+# Only columns that change through edit_profile(). Counters and the
+# password hash are left unloaded and fetched on first access.
+CACHED_COLUMNS = ('id', 'username', 'email', 'image_url',
+                  'header_image_url', 'bio', 'location')
+
+
+class LazyGlobals(_AppCtxGlobals):
+    """Flask `g` that can compute an attribute the first time it's read."""
+
+    def set_lazy(self, name, loader):
+        """Make `g.<name>` call `loader()` on first access."""
+
+        self.__dict__.pop(name, None)
+        self.__dict__.setdefault('_lazy', {})[name] = loader
+
+    def __getattr__(self, name):
+        loaders = self.__dict__.get('_lazy', {})
+
+        if name not in loaders:
+            raise AttributeError(name)
+
+        value = loaders.pop(name)()
+        setattr(self, name, value)
+        return value
+
+    # _AppCtxGlobals reads __dict__ directly here, so route through the loader.
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __contains__(self, name):
+        return name in self.__dict__ or name in self.__dict__.get('_lazy', {})
+
+
+class IdentityCache:
+    """Bounded LRU of {user id: profile column values}, with expiry."""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, user_id):
+        """Cached column values for `user_id`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+
+            if entry is None:
+                return None
+
+            expires, values = entry
+            if expires < monotonic():
+                del self._entries[user_id]
+                return None
+
+            self._entries.move_to_end(user_id)
+            return values
+
+    def set(self, user_id, values):
+        with self._lock:
+            self._entries[user_id] = (monotonic() + self.ttl, values)
+            self._entries.move_to_end(user_id)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = IdentityCache()
+
+
+def init_app(app):
+    """Use lazy `g` attributes and size the user cache from config."""
+
+    app.app_ctx_globals_class = LazyGlobals
+    user_cache.maxsize = app.config.get('USER_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+    user_cache.ttl = app.config.get('USER_CACHE_TTL', DEFAULT_CACHE_TTL)
+
+
+def load_user(user_id):
+    """The `User` with this id, from the cache when possible."""
+
+    values = user_cache.get(user_id)
+
+    if values is None:
+        user = User.query.get(user_id)
+
+        if user is not None and user.deleted_at is not None:
+            return None
+
+        if user is not None:
+            user_cache.set(user_id, {column: getattr(user, column)
+                                     for column in CACHED_COLUMNS})
+        return user
+
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def invalidate(user_id):
+    """Forget a user's cached profile after it changes."""
+
+    user_cache.invalidate(user_id)
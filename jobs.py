@@ -0,0 +1,321 @@
+"""Background jobs, queued in the database.
+
+    @jobs.handler
+    def fan_out(message_id): ...
+
+    jobs.enqueue(fan_out, msg.id)
+
+`enqueue` adds a row to the jobs table in the caller's transaction, so a
+job exists exactly when the change that needed it commits. Workers claim
+the job that has been due longest: on Postgres with `FOR UPDATE SKIP
+LOCKED`, so any number of workers share the queue without blocking on or
+double-claiming a job; elsewhere with a compare-and-set UPDATE.
+
+Claiming a job pushes its run_at JOB_LEASE seconds ahead, so if a worker
+dies mid-job another picks it up once the lease runs out. A job that
+raises is retried after JOB_RETRY_DELAY * 2**(attempts - 1) seconds, up to
+JOB_MAX_ATTEMPTS times; after that it stays in the table with failed_at
+set. Handlers should therefore be safe to run twice.
+
+Jobs are run by `flask worker --concurrency N`. Web processes can opt in
+to running them too with JOB_WORKERS threads, started by the first
+enqueue; those share the process's connection pool and are killed
+mid-job when it exits (the job is picked up again after its lease). With
+JOBS_INLINE, enqueue runs the handler at once instead (for development
+and tests). `flask jobs` shows
+queue depth, wait times and failures; workers keep per-job latency in
+`stats`.
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from time import perf_counter
+
+from flask import current_app
+from sqlalchemy import and_, func, select
+
+from models import db, is_postgres, Job
+
+log = logging.getLogger('warbler.jobs')
+
+DEFAULT_LEASE = 3600
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 5
+MAX_RETRY_DELAY = 3600
+DEFAULT_POLL_INTERVAL = 1.0
+
+jobs = Job.__table__
+
+HANDLERS = {}
+
+
+def handler(fn):
+    """Register `fn` as a job handler, by module and function name."""
+
+    HANDLERS[f"{fn.__module__}.{fn.__name__}"] = fn
+    return fn
+
+
+def handler_name(fn):
+    name = f"{fn.__module__}.{fn.__name__}"
+
+    if HANDLERS.get(name) is not fn:
+        raise ValueError(f"{name} isn't a registered job handler")
+
+    return name
+
+
+def config(name, default):
+    return current_app.config.get(name, default)
+
+
+def enqueue(fn, *args):
+    """Run `fn(*args)` in the background once the current transaction
+    commits. `args` must be JSON-serializable."""
+
+    name = handler_name(fn)
+
+    if config('JOBS_INLINE', False):
+        return fn(*args)
+
+    db.session.execute(jobs.insert().values(name=name, args=json.dumps(args)))
+
+    if config('JOB_WORKERS', 0):
+        local_workers.start(current_app._get_current_object(),
+                            config('JOB_WORKERS', 0))
+
+
+##############################################################################
+# Claiming and running
+
+
+def due(now):
+    return and_(jobs.c.failed_at.is_(None), jobs.c.run_at <= now)
+
+
+def claim():
+    """Take the longest-due job, leasing it to this worker, and commit.
+
+    Returns (id, name, args, enqueued_at, attempts), or None if nothing's due.
+    """
+
+    now = datetime.utcnow()
+    lease = {'run_at': now + timedelta(seconds=config('JOB_LEASE', DEFAULT_LEASE)),
+             'attempts': jobs.c.attempts + 1}
+    columns = [jobs.c.id, jobs.c.name, jobs.c.args, jobs.c.enqueued_at, jobs.c.attempts]
+
+    if is_postgres():
+        next_id = (select([jobs.c.id])
+                   .where(due(now))
+                   .order_by(jobs.c.run_at, jobs.c.id)
+                   .limit(1)
+                   .with_for_update(skip_locked=True)
+                   .as_scalar())
+        row = db.session.execute(jobs
+                                 .update()
+                                 .where(jobs.c.id == next_id)
+                                 .values(lease)
+                                 .returning(*columns)).first()
+    else:
+        row = None
+        while row is None:
+            candidate = db.session.execute(select([jobs.c.id, jobs.c.run_at])
+                                           .where(due(now))
+                                           .order_by(jobs.c.run_at, jobs.c.id)
+                                           .limit(1)).first()
+            if candidate is None:
+                break
+
+            # Someone else may have claimed it since; then try the next.
+            claimed = db.session.execute(jobs
+                                         .update()
+                                         .where(jobs.c.id == candidate.id)
+                                         .where(jobs.c.run_at == candidate.run_at)
+                                         .values(lease)).rowcount
+            if claimed:
+                row = db.session.execute(select(columns)
+                                         .where(jobs.c.id == candidate.id)).first()
+
+    db.session.commit()
+    return tuple(row) if row is not None else None
+
+
+def retry_delay(attempts):
+    delay = config('JOB_RETRY_DELAY', DEFAULT_RETRY_DELAY) * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, MAX_RETRY_DELAY))
+
+
+def execute(job):
+    """Run a claimed job; on success it's deleted in the same transaction,
+    on failure it's rescheduled or marked failed. Returns whether it
+    succeeded."""
+
+    job_id, name, args, enqueued_at, attempts = job
+    started = datetime.utcnow()
+    timer = perf_counter()
+
+    try:
+        HANDLERS[name](*json.loads(args))
+        db.session.execute(jobs.delete().where(jobs.c.id == job_id))
+        db.session.commit()
+        ok = True
+
+    except Exception as exc:
+        db.session.rollback()
+        ok = False
+
+        if attempts >= config('JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS):
+            log.exception("Job %s (%s) failed for good after %s attempts",
+                          job_id, name, attempts)
+            values = {'failed_at': datetime.utcnow()}
+        else:
+            log.warning("Job %s (%s) failed (attempt %s), will retry: %r",
+                        job_id, name, attempts, exc)
+            values = {'run_at': datetime.utcnow() + retry_delay(attempts)}
+
+        values['last_error'] = repr(exc)[:1000]
+        db.session.execute(jobs.update().where(jobs.c.id == job_id).values(values))
+        db.session.commit()
+
+    stats.record(name, (started - enqueued_at).total_seconds(),
+                 perf_counter() - timer, ok)
+    return ok
+
+
+def run_pending(limit=None):
+    """Run due jobs in this thread until none are left (or `limit` have
+    run); returns how many ran. Needs an app context."""
+
+    count = 0
+
+    while limit is None or count < limit:
+        job = claim()
+        if job is None:
+            break
+        execute(job)
+        count += 1
+
+    return count
+
+
+##############################################################################
+# Workers
+
+
+class JobStats:
+    """Per-handler totals: jobs run and failed, wait and run seconds."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = Lock()
+
+    def record(self, name, waited, ran, ok):
+        with self._lock:
+            totals = self._jobs.setdefault(
+                name, {'jobs': 0, 'failed': 0, 'wait': 0.0, 'max_wait': 0.0, 'run': 0.0})
+            totals['jobs'] += 1
+            totals['failed'] += not ok
+            totals['wait'] += waited
+            totals['max_wait'] = max(totals['max_wait'], waited)
+            totals['run'] += ran
+
+    def snapshot(self):
+        """{handler: totals}, with average wait and run seconds added."""
+
+        with self._lock:
+            return {name: dict(totals,
+                               avg_wait=totals['wait'] / totals['jobs'],
+                               avg_run=totals['run'] / totals['jobs'])
+                    for name, totals in self._jobs.items()}
+
+    def clear(self):
+        with self._lock:
+            self._jobs.clear()
+
+
+stats = JobStats()
+
+
+class Workers:
+    """Threads that claim and run jobs until stopped."""
+
+    def __init__(self):
+        self.threads = []
+        self.stopping = Event()
+        self._lock = Lock()
+
+    def start(self, app, concurrency):
+        """Start `concurrency` threads, unless they're already running."""
+
+        with self._lock:
+            if self.threads:
+                return
+
+            self.stopping.clear()
+            self.threads = [Thread(target=self.work, args=(app,),
+                                   name=f"job-worker-{i}", daemon=True)
+                            for i in range(concurrency)]
+            for thread in self.threads:
+                thread.start()
+
+    def work(self, app):
+        poll = app.config.get('JOB_POLL_INTERVAL', DEFAULT_POLL_INTERVAL)
+
+        while not self.stopping.is_set():
+            with app.app_context():
+                try:
+                    ran = run_pending(limit=100)
+                except Exception:
+                    log.exception("Job worker error")
+                    db.session.rollback()
+                    ran = 0
+                finally:
+                    db.session.remove()
+
+            if not ran:
+                self.stopping.wait(poll)
+
+    def stop(self):
+        self.stopping.set()
+
+        for thread in self.threads:
+            thread.join()
+
+        with self._lock:
+            self.threads = []
+
+
+# Opt-in threads inside a web process (JOB_WORKERS), started by the first enqueue.
+local_workers = Workers()
+
+
+##############################################################################
+# Visibility
+
+
+def queue_stats():
+    """Jobs due now, scheduled later (retries, leased) and failed, and how
+    long the longest-due job has waited, in seconds."""
+
+    now = datetime.utcnow()
+    is_due = due(now)
+    is_later = and_(jobs.c.failed_at.is_(None), jobs.c.run_at > now)
+
+    def count(where):
+        return select([func.count()]).where(where).as_scalar()
+
+    due_count, later, failed, oldest = db.session.query(
+        count(is_due),
+        count(is_later),
+        count(jobs.c.failed_at.isnot(None)),
+        select([func.min(jobs.c.run_at)]).where(is_due).as_scalar(),
+    ).one()
+
+    return {
+        'due': due_count,
+        'scheduled': later,
+        'failed': failed,
+        'oldest_wait': (now - oldest).total_seconds() if oldest else 0.0,
+    }
@@ -0,0 +1,175 @@
+"""Liking and unliking messages.
+
+Each change to a like also moves the liker's likes_count and bumps their
+likes_version (which pages' ETags use). On Postgres the
+two happen in one statement (data-modifying CTEs), so a double click
+can't slip between a read and a write; concurrent toggles serialize on
+the like's primary key. Other databases run a couple of statements in the
+request's transaction.
+
+Likes are inserted by selecting the message, and only if someone else
+wrote it, so users can't like their own messages however the request
+races. Liking a message that doesn't exist raises NoSuchMessage, and
+liking one's own raises OwnMessage. (A message deleted mid-request can
+still surface as IntegrityError, from the foreign key.)
+"""
+
+from sqlalchemy import and_, literal, select, text
+
+import counters
+from models import db, is_postgres, Likes, Message
+
+likes = Likes.__table__
+messages = Message.__table__
+
+
+class NoSuchMessage(Exception):
+    """The message to like doesn't exist."""
+
+
+class OwnMessage(Exception):
+    """Users can't like their own messages."""
+
+
+TOGGLE_SQL = text("""
+    WITH target AS (
+        SELECT user_id AS author_id FROM messages WHERE id = :message_id
+    ), deleted AS (
+        DELETE FROM likes
+        WHERE user_id = :user_id AND message_id = :message_id
+        RETURNING 1
+    ), inserted AS (
+        INSERT INTO likes (user_id, message_id)
+        SELECT :user_id, :message_id
+        FROM messages
+        WHERE id = :message_id AND user_id <> :user_id
+          AND NOT EXISTS (SELECT 1 FROM deleted)
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    ), counted AS (
+        UPDATE users
+        SET likes_count = likes_count + (SELECT count(*) FROM inserted)
+                                      - (SELECT count(*) FROM deleted),
+            likes_version = likes_version + 1
+        WHERE id = :user_id
+          AND (EXISTS (SELECT 1 FROM inserted) OR EXISTS (SELECT 1 FROM deleted))
+    )
+    SELECT (SELECT author_id FROM target),
+           EXISTS (SELECT 1 FROM deleted),
+           EXISTS (SELECT 1 FROM inserted)
+""")
+
+LIKE_SQL = text("""
+    WITH target AS (
+        SELECT user_id AS author_id FROM messages WHERE id = :message_id
+    ), inserted AS (
+        INSERT INTO likes (user_id, message_id)
+        SELECT :user_id, :message_id
+        FROM messages
+        WHERE id = :message_id AND user_id <> :user_id
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    ), counted AS (
+        UPDATE users
+        SET likes_count = likes_count + 1, likes_version = likes_version + 1
+        WHERE id = :user_id AND EXISTS (SELECT 1 FROM inserted)
+    )
+    SELECT (SELECT author_id FROM target),
+           EXISTS (SELECT 1 FROM inserted)
+""")
+
+UNLIKE_SQL = text("""
+    WITH deleted AS (
+        DELETE FROM likes
+        WHERE user_id = :user_id AND message_id = :message_id
+        RETURNING 1
+    ), counted AS (
+        UPDATE users
+        SET likes_count = likes_count - 1, likes_version = likes_version + 1
+        WHERE id = :user_id AND EXISTS (SELECT 1 FROM deleted)
+    )
+    SELECT EXISTS (SELECT 1 FROM deleted)
+""")
+
+
+def _delete(user_id, message_id):
+    deleted = db.session.execute(likes.delete().where(and_(
+        likes.c.user_id == user_id, likes.c.message_id == message_id))).rowcount
+
+    if deleted:
+        counters.liked(user_id, -1)
+    return bool(deleted)
+
+
+def _insert(user_id, message_id):
+    likeable = (select([literal(user_id), messages.c.id])
+                .where(messages.c.id == message_id)
+                .where(messages.c.user_id != user_id))
+    inserted = db.session.execute(likes.insert()
+                                  .prefix_with('OR IGNORE', dialect='sqlite')
+                                  .from_select(['user_id', 'message_id'],
+                                               likeable)).rowcount
+
+    if inserted:
+        counters.liked(user_id)
+    else:
+        check_likeable(user_id, author_id(message_id))
+    return bool(inserted)
+
+
+def author_id(message_id):
+    return (db.session
+            .query(Message.user_id)
+            .filter(Message.id == message_id)
+            .scalar())
+
+
+def check_likeable(user_id, author_id):
+    """Raise if `user_id` may not like a message by `author_id` (None if
+    the message doesn't exist)."""
+
+    if author_id is None:
+        raise NoSuchMessage()
+    if author_id == user_id:
+        raise OwnMessage()
+
+
+def toggle_like(user_id, message_id):
+    """Like the message if the user hasn't, unlike it if they have.
+
+    Returns whether the user likes it now.
+    """
+
+    params = dict(user_id=user_id, message_id=message_id)
+
+    if is_postgres():
+        author, deleted, inserted = db.session.execute(TOGGLE_SQL, params).first()
+        if not (deleted or inserted):
+            check_likeable(user_id, author)
+        return inserted
+
+    if _delete(user_id, message_id):
+        return False
+
+    _insert(user_id, message_id)
+    return True
+
+
+def set_like(user_id, message_id, liked=True):
+    """Like (or unlike) a message; repeating it changes nothing.
+
+    Returns whether anything changed.
+    """
+
+    params = dict(user_id=user_id, message_id=message_id)
+
+    if is_postgres():
+        if not liked:
+            return db.session.execute(UNLIKE_SQL, params).scalar()
+
+        author, inserted = db.session.execute(LIKE_SQL, params).first()
+        if not inserted:
+            check_likeable(user_id, author)
+        return inserted
+
+    return (_insert if liked else _delete)(user_id, message_id)
@@ -0,0 +1,306 @@
+"""Bulk-load the CSVs in generator/ into a fresh database.
+
+    python loader.py [--dir generator] [--jobs 4] [--skip-derived]
+
+On Postgres every CSV is streamed to the server with COPY, one table per
+connection in parallel. Secondary indexes, unique and foreign key
+constraints are dropped first and rebuilt once the rows are in, and id
+sequences are moved past the loaded ids. Other databases get chunked
+executemany INSERTs, one table at a time.
+
+Afterwards user counters and home timelines are recomputed (unless
+--skip-derived), timelines set-based and a batch of users per
+transaction. Run the SQL files in migrations/ after a load to add the
+search indexes.
+"""
+
+import argparse
+import csv
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from time import perf_counter
+
+from sqlalchemy import DateTime, Integer, text
+
+from app import app
+from counters import reconcile_counters
+from models import db, is_postgres
+from timelines import pull_popular_authors, rebuild_all_timelines
+
+# Parents first, for databases that load one table at a time.
+TABLES = [
+    ('users', 'users.csv'),
+    ('messages', 'messages.csv'),
+    ('follows', 'follows.csv'),
+    ('likes', 'likes.csv'),
+]
+
+OPTIONAL = {'likes'}
+
+CHUNK_SIZE = 5000
+
+
+def csv_columns(table, path):
+    """The CSV's header, checked against the table's columns."""
+
+    with open(path, newline='') as f:
+        header = next(csv.reader(f))
+
+    unknown = set(header) - set(table.c.keys())
+    if unknown:
+        raise ValueError(f"{path}: no such columns in {table.name}: {sorted(unknown)}")
+
+    return header
+
+
+def report(name, rows, seconds):
+    rate = rows / seconds if seconds else 0
+    print(f"{name:>10}: {rows:>12,} rows in {seconds:8.2f}s ({rate:,.0f} rows/s)")
+
+
+##############################################################################
+# Postgres: COPY with deferred indexes and constraints
+
+
+def deferred_ddl(conn, table):
+    """(drop, create) statements for `table`'s secondary indexes, unique
+    constraints and foreign keys. The primary key stays."""
+
+    constraints = conn.execute(text("""
+        SELECT conname, contype, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = CAST(:table AS regclass) AND contype IN ('u', 'f')
+        ORDER BY contype DESC, conname
+    """), table=table).fetchall()
+
+    indexes = conn.execute(text("""
+        SELECT indexname, indexdef
+        FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = :table
+          AND indexname NOT IN (SELECT conname FROM pg_constraint
+                                WHERE conrelid = CAST(:table AS regclass))
+        ORDER BY indexname
+    """), table=table).fetchall()
+
+    drops = ([f'DROP INDEX "{name}"' for name, _ in indexes]
+             + [f'ALTER TABLE "{table}" DROP CONSTRAINT "{name}"'
+                for name, _, _ in reversed(constraints)])
+
+    # Unique constraints ('u') sort before foreign keys ('f').
+    creates = ([definition for _, definition in indexes]
+               + [f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {definition}'
+                  for name, _, definition in constraints])
+
+    return drops, creates
+
+
+def copy_table(engine, table, path):
+    """Stream one CSV into `table` with COPY; return the row count."""
+
+    columns = ', '.join(f'"{column}"' for column in csv_columns(table, path))
+    conn = engine.raw_connection()
+
+    try:
+        with open(path, newline='') as f:
+            cursor = conn.cursor()
+            cursor.copy_expert(f'COPY "{table.name}" ({columns}) '
+                               'FROM STDIN WITH (FORMAT csv, HEADER true)', f)
+            rows = cursor.rowcount
+        conn.commit()
+    finally:
+        conn.close()
+
+    return rows
+
+
+def run_ddl(engine, statements):
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+
+
+def reset_sequences(engine, tables):
+    """Move serial id sequences past the ids COPY loaded."""
+
+    with engine.begin() as conn:
+        for table in tables:
+            if 'id' in table.c and isinstance(table.c.id.type, Integer):
+                conn.execute(text(f"""
+                    SELECT setval(pg_get_serial_sequence('"{table.name}"', 'id'),
+                                  COALESCE(MAX(id), 0) + 1, false)
+                    FROM "{table.name}"
+                """))
+
+
+def load_postgres(engine, sources, jobs):
+    tables = [table for table, _ in sources]
+
+    with engine.connect() as conn:
+        ddl = {table.name: deferred_ddl(conn, table.name) for table in tables}
+
+    # Foreign keys point across tables, so drop them all before any index.
+    run_ddl(engine, [drop for table in tables for drop in ddl[table.name][0]
+                     if 'CONSTRAINT' in drop])
+    run_ddl(engine, [drop for table in tables for drop in ddl[table.name][0]
+                     if 'CONSTRAINT' not in drop])
+
+    def load(source):
+        table, path = source
+        started = perf_counter()
+        rows = copy_table(engine, table, path)
+        report(table.name, rows, perf_counter() - started)
+        return rows
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        total = sum(pool.map(load, sources))
+
+    started = perf_counter()
+
+    def rebuild(table):
+        run_ddl(engine, [create for create in ddl[table.name][1]
+                         if 'FOREIGN KEY' not in create])
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(rebuild, tables))
+
+    run_ddl(engine, [create for table in tables for create in ddl[table.name][1]
+                     if 'FOREIGN KEY' in create])
+    print(f"Rebuilt indexes and constraints in {perf_counter() - started:.2f}s")
+
+    reset_sequences(engine, tables)
+    run_ddl(engine, [f'ANALYZE "{table.name}"' for table in tables])
+
+    return total
+
+
+##############################################################################
+# Other databases: chunked executemany
+
+
+def coerce(table, columns):
+    """Turn CSV strings into values for `columns` ('' is NULL, as in COPY)."""
+
+    def parse(column):
+        kind = table.c[column].type
+        if isinstance(kind, DateTime):
+            return datetime.fromisoformat
+        if isinstance(kind, Integer):
+            return int
+        return str
+
+    parsers = {column: parse(column) for column in columns}
+
+    def convert(row):
+        return {column: parsers[column](value) if value != '' else None
+                for column, value in row.items()}
+
+    return convert
+
+
+def insert_table(engine, table, path):
+    """Insert one CSV into `table` CHUNK_SIZE rows at a time."""
+
+    rows = 0
+
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        convert = coerce(table, csv_columns(table, path))
+
+        with engine.begin() as conn:
+            while True:
+                chunk = [convert(row) for row in islice(reader, CHUNK_SIZE)]
+                if not chunk:
+                    break
+                conn.execute(table.insert(), chunk)
+                rows += len(chunk)
+
+    return rows
+
+
+def load_other(engine, sources):
+    indexes = [index for table, _ in sources for index in table.indexes]
+
+    for index in indexes:
+        index.drop(engine)
+
+    total = 0
+
+    for table, path in sources:
+        started = perf_counter()
+        rows = insert_table(engine, table, path)
+        report(table.name, rows, perf_counter() - started)
+        total += rows
+
+    for index in indexes:
+        index.create(engine)
+
+    return total
+
+
+##############################################################################
+# Main
+
+
+def rebuild_derived():
+    """Recompute counters and home timelines from the loaded rows."""
+
+    started = perf_counter()
+
+    with app.app_context():
+        reconcile_counters()
+        pull_popular_authors()
+        db.session.commit()
+
+        rebuild_all_timelines()
+
+    print(f"Rebuilt counters and timelines in {perf_counter() - started:.2f}s")
+
+
+def load(directory='generator', jobs=4, derived=True):
+    """Recreate the schema and load every CSV found in `directory`."""
+
+    engine = db.engine
+    tables = db.metadata.tables
+    sources = []
+
+    for name, filename in TABLES:
+        path = os.path.join(directory, filename)
+
+        if os.path.exists(path):
+            sources.append((tables[name], path))
+        elif name not in OPTIONAL:
+            raise FileNotFoundError(path)
+
+    db.drop_all()
+    db.create_all()
+
+    started = perf_counter()
+
+    if is_postgres(engine):
+        total = load_postgres(engine, sources, jobs)
+    else:
+        total = load_other(engine, sources)
+
+    report('total', total, perf_counter() - started)
+
+    if derived:
+        rebuild_derived()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default='generator',
+                        help="directory holding users.csv, messages.csv, ...")
+    parser.add_argument('--jobs', type=int, default=4,
+                        help="tables loaded (and indexed) at once on Postgres")
+    parser.add_argument('--skip-derived', action='store_true',
+                        help="don't recompute counters and timelines")
+    args = parser.parse_args()
+
+    load(args.dir, args.jobs, derived=not args.skip_derived)
+
+
+if __name__ == '__main__':
+    main()
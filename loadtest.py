@@ -0,0 +1,327 @@
+"""HTTP load generator for a running Warbler server.
+
+    SQL_STATEMENTS_HEADER=1 flask run --no-reload   # in one shell
+    python loadtest.py --scenario browse --duration 60 --concurrency 20
+
+Each virtual user logs in as a different seeded user (from
+generator/users.csv, password "password") and then picks actions from the
+scenario's weighted mix as fast as the server answers, plus optional think
+time. Afterwards throughput, latency percentiles, error rates and SQL
+statements per request (from the X-SQL-Statements header, when the server
+sends it) are reported for each action.
+
+A scenario is one of SCENARIOS below, or a JSON file of the same shape:
+
+    {"mix": {"homepage": 5, "users_show": 2, "like_page": 1},
+     "think_time": 0.1}
+
+Only the standard library is used, so this runs from any checkout.
+"""
+
+import argparse
+import csv
+import json
+import re
+import sys
+import threading
+from http.client import HTTPConnection
+from http.cookies import SimpleCookie
+from random import Random
+from time import perf_counter, sleep
+from urllib.parse import urlencode, urlsplit
+
+SCENARIOS = {
+    'browse': {
+        'mix': {'homepage': 40, 'users_show': 25, 'list_users': 15,
+                'like_page': 10, 'add_follow': 5, 'messages_add': 5},
+        'think_time': 0,
+    },
+    'read-only': {
+        'mix': {'homepage': 60, 'users_show': 30, 'list_users': 10},
+        'think_time': 0,
+    },
+    'write-heavy': {
+        'mix': {'homepage': 20, 'like_page': 30, 'add_follow': 20,
+                'messages_add': 30},
+        'think_time': 0,
+    },
+}
+
+PASSWORD = 'password'
+
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+SQL_STATEMENTS_HEADER = 'X-SQL-Statements'
+
+
+class Client:
+    """One keep-alive connection with a cookie jar; redirects aren't followed."""
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.cookies = SimpleCookie()
+        self.conn = None
+
+    def request(self, method, path, form=None):
+        """Send a request; return (status, headers, body)."""
+
+        headers = {'Accept-Encoding': 'identity'}
+        body = None
+
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f"{k}={v.value}" for k, v in self.cookies.items())
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body, headers)
+                resp = self.conn.getresponse()
+                data = resp.read()
+                break
+            except (ConnectionError, OSError):
+                # The server may have closed an idle keep-alive connection.
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+        for cookie in resp.headers.get_all('Set-Cookie') or []:
+            self.cookies.load(cookie)
+
+        return resp.status, resp.headers, data
+
+
+class VirtualUser:
+    """A logged-in seeded user, and whom they follow."""
+
+    def __init__(self, client, user_id, username, num_users, num_messages, rng):
+        self.client = client
+        self.user_id = user_id
+        self.username = username
+        self.num_users = num_users
+        self.num_messages = num_messages
+        self.rng = rng
+        self.following = set()
+        self.csrf_token = None
+
+    def login(self):
+        status, headers, body = self.client.request('GET', '/login')
+        self.csrf_token = CSRF_TOKEN.search(body.decode()).group(1)
+
+        status, headers, body = self.client.request(
+            'POST', '/login', {'username': self.username, 'password': PASSWORD,
+                               'csrf_token': self.csrf_token})
+        if status != 302:
+            raise RuntimeError(f"couldn't log in as {self.username} ({status})")
+
+    def random_user(self):
+        return self.rng.randint(1, self.num_users)
+
+    # Actions: each makes one request and returns (status, headers, body).
+
+    def homepage(self):
+        return self.client.request('GET', '/')
+
+    def users_show(self):
+        return self.client.request('GET', f"/users/{self.random_user()}")
+
+    def list_users(self):
+        query = ''.join(self.rng.choices('abcdefghijklmnopqrstuvwxyz', k=2))
+        return self.client.request('GET', f"/users?q={query}")
+
+    def like_page(self):
+        message_id = self.rng.randint(1, self.num_messages)
+        return self.client.request('POST', f"/users/add_like/{message_id}",
+                                   {'csrf_token': self.csrf_token})
+
+    def add_follow(self):
+        """Follow someone new, or (if we already do) unfollow them."""
+
+        user_id = self.random_user()
+
+        if user_id == self.user_id:
+            user_id = user_id % self.num_users + 1
+
+        if user_id in self.following:
+            self.following.discard(user_id)
+            return self.client.request('POST', f"/users/stop-following/{user_id}")
+
+        self.following.add(user_id)
+        return self.client.request('POST', f"/users/follow/{user_id}")
+
+    def messages_add(self):
+        words = self.rng.choices(['load', 'test', 'warble', 'hello', 'world'], k=8)
+        return self.client.request('POST', '/messages/new',
+                                   {'text': ' '.join(words),
+                                    'csrf_token': self.csrf_token})
+
+
+class Results:
+    """Latencies, errors and SQL statement counts per action."""
+
+    def __init__(self):
+        self.actions = {}
+        self.lock = threading.Lock()
+
+    def record(self, action, seconds, ok, statements):
+        with self.lock:
+            stats = self.actions.setdefault(
+                action, {'latencies': [], 'errors': 0, 'statements': []})
+            stats['latencies'].append(seconds)
+            stats['errors'] += not ok
+            if statements is not None:
+                stats['statements'].append(statements)
+
+    def report(self, elapsed, out=sys.stdout):
+        total = sum(len(s['latencies']) for s in self.actions.values())
+        errors = sum(s['errors'] for s in self.actions.values())
+
+        print(f"\n{total:,} requests in {elapsed:.1f}s: {total / elapsed:,.1f} req/s, "
+              f"{100 * errors / max(total, 1):.2f}% errors\n", file=out)
+        print(f"{'action':<14}{'count':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+              f"{'p99 ms':>9}{'errors':>8}{'sql avg':>9}{'sql max':>9}", file=out)
+
+        for action, stats in sorted(self.actions.items()):
+            latencies = sorted(stats['latencies'])
+            statements = stats['statements']
+            count = len(latencies)
+
+            sql_avg = f"{sum(statements) / len(statements):.1f}" if statements else '-'
+            sql_max = max(statements) if statements else '-'
+
+            print(f"{action:<14}{count:>8}{count / elapsed:>9.1f}"
+                  f"{percentile(latencies, 50):>9.1f}{percentile(latencies, 95):>9.1f}"
+                  f"{percentile(latencies, 99):>9.1f}"
+                  f"{100 * stats['errors'] / count:>7.1f}%{sql_avg:>9}{sql_max:>9}",
+                  file=out)
+
+
+def percentile(sorted_seconds, pct):
+    """Nearest-rank percentile of sorted latencies, in milliseconds."""
+
+    if not sorted_seconds:
+        return 0.0
+
+    rank = max(0, -(-len(sorted_seconds) * pct // 100) - 1)
+    return sorted_seconds[int(rank)] * 1000
+
+
+def load_scenario(name):
+    if name in SCENARIOS:
+        return SCENARIOS[name]
+
+    with open(name) as f:
+        return json.load(f)
+
+
+def seeded_users(path, count, rng):
+    """`count` (id, username) pairs from the seed CSV; ids are row numbers."""
+
+    with open(path, newline='') as f:
+        users = [(i, row['username']) for i, row in enumerate(csv.DictReader(f), 1)]
+
+    return users, rng.sample(users, min(count, len(users)))
+
+
+def seeded_follows(path, user_ids):
+    """{follower id: ids they follow} for `user_ids`, from the seed CSV."""
+
+    following = {user_id: set() for user_id in user_ids}
+
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            follower = int(row['user_following_id'])
+            if follower in following:
+                following[follower].add(int(row['user_being_followed_id']))
+
+    return following
+
+
+def count_rows(path):
+    with open(path, newline='') as f:
+        return sum(1 for _ in f) - 1
+
+
+def run(args):
+    scenario = load_scenario(args.scenario)
+    actions, weights = zip(*scenario['mix'].items())
+    think_time = scenario.get('think_time', 0)
+
+    rng = Random(args.seed)
+    users, chosen = seeded_users(f"{args.data}/users.csv", args.concurrency, rng)
+    num_messages = count_rows(f"{args.data}/messages.csv")
+    following = seeded_follows(f"{args.data}/follows.csv",
+                               [user_id for user_id, _ in chosen])
+
+    results = Results()
+    stop = threading.Event()
+    deadline = perf_counter() + args.duration
+
+    virtual_users = []
+    for i, (user_id, username) in enumerate(chosen):
+        vu = VirtualUser(Client(args.url), user_id, username, len(users),
+                         num_messages, Random(f"{args.seed}:{i}"))
+        vu.following = following[user_id]
+        vu.login()
+        virtual_users.append(vu)
+
+    print(f"{len(virtual_users)} users logged in; running '{args.scenario}' "
+          f"for {args.duration}s against {args.url}")
+
+    def work(vu):
+        while not stop.is_set() and perf_counter() < deadline:
+            action = vu.rng.choices(actions, weights)[0]
+            started = perf_counter()
+
+            try:
+                status, headers, body = getattr(vu, action)()
+                ok = status < 400
+                statements = headers.get(SQL_STATEMENTS_HEADER)
+            except Exception:
+                ok, statements = False, None
+
+            results.record(action, perf_counter() - started, ok,
+                           int(statements) if statements else None)
+            if think_time:
+                sleep(think_time)
+
+    threads = [threading.Thread(target=work, args=(vu,)) for vu in virtual_users]
+    started = perf_counter()
+
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    results.report(perf_counter() - started)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--scenario', default='browse',
+                        help=f"one of {', '.join(SCENARIOS)}, or a JSON file")
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help="virtual users, each a different seeded user")
+    parser.add_argument('--duration', type=float, default=30, help="seconds")
+    parser.add_argument('--data', default='generator',
+                        help="directory with the CSVs the database was loaded from")
+    parser.add_argument('--seed', type=int, default=0)
+
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
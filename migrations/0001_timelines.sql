@@ -0,0 +1,23 @@
+-- Materialized home timelines.
+--
+-- Apply with:   psql warbler < migrations/0001_timelines.sql
+-- then backfill: FLASK_APP=app.py flask rebuild-timelines
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS timelines (
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    author_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    PRIMARY KEY (user_id, message_id)
+);
+
+CREATE INDEX IF NOT EXISTS ix_timelines_user_timestamp
+    ON timelines (user_id, timestamp, message_id);
+CREATE INDEX IF NOT EXISTS ix_timelines_user_author
+    ON timelines (user_id, author_id);
+CREATE INDEX IF NOT EXISTS ix_timelines_message
+    ON timelines (message_id);
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- Denormalized per-user counters.
+--
+-- Apply with:   psql warbler < migrations/0002_user_counters.sql
+-- then fill in: FLASK_APP=app.py flask reconcile-counters
+
+BEGIN;
+
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS messages_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS following_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS followers_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS likes_count INTEGER NOT NULL DEFAULT 0;
+
+COMMIT;
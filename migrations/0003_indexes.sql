@@ -0,0 +1,23 @@
+-- Indexes for the queries the routes actually run.
+--
+-- Built CONCURRENTLY so writes aren't blocked, which means this file must
+-- not run inside a transaction:
+--
+--     psql warbler < migrations/0003_indexes.sql
+
+-- users_show(), and timeline backfill: one author's messages, newest first.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_user_timestamp
+    ON messages (user_id, timestamp, id);
+
+-- show_following(), home timeline: who does X follow.
+-- (users_followers() is served by the (user_being_followed_id, ...) primary key.)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_following
+    ON follows (user_following_id, user_being_followed_id);
+
+-- show_likes(), homepage() liked flags: what did X like.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_likes_user
+    ON likes (user_id, message_id);
+
+ANALYZE messages;
+ANALYZE follows;
+ANALYZE likes;
@@ -0,0 +1,10 @@
+-- Trigram index for substring search on usernames (list_users()).
+--
+-- Built CONCURRENTLY, so run outside a transaction:
+--
+--     psql warbler < migrations/0004_username_trigram.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username_trgm
+    ON users USING gin (username gin_trgm_ops);
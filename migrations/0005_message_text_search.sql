@@ -0,0 +1,9 @@
+-- Full-text index for /messages/search.
+--
+-- The expression must match search.search_messages() exactly.
+-- Built CONCURRENTLY, so run outside a transaction:
+--
+--     psql warbler < migrations/0005_message_text_search.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_text_search
+    ON messages USING gin (to_tsvector('english', text));
@@ -0,0 +1,27 @@
+-- Key likes on (user_id, message_id), so any number of users can like a
+-- message (it used to be UNIQUE (message_id)) and nobody twice.
+--
+-- Apply with:   psql warbler < migrations/0006_likes_primary_key.sql
+-- then fix up:  FLASK_APP=app.py flask reconcile-counters
+
+BEGIN;
+
+-- Rows the new key can't hold.
+DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL;
+
+DELETE FROM likes a
+    USING likes b
+    WHERE a.user_id = b.user_id AND a.message_id = b.message_id AND a.id > b.id;
+
+ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key;
+ALTER TABLE likes DROP CONSTRAINT likes_pkey;
+ALTER TABLE likes DROP COLUMN id;
+ALTER TABLE likes ADD PRIMARY KEY (user_id, message_id);
+
+-- The primary key now covers "what did X like"; this covers "who liked M".
+DROP INDEX IF EXISTS ix_likes_user;
+CREATE INDEX ix_likes_message ON likes (message_id);
+
+ANALYZE likes;
+
+COMMIT;
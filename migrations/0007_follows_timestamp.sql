@@ -0,0 +1,31 @@
+-- When each follow happened, so follower/following lists can be paged
+-- newest first.
+--
+-- Existing follows get the time this runs (ties are broken by user id),
+-- in UTC like the datetime.utcnow() the app writes, so backfilled and new
+-- edges sort consistently whatever the server's time zone.
+-- Adding a column with a constant default doesn't rewrite the table on
+-- Postgres 11+. The indexes are built CONCURRENTLY, so run outside a
+-- transaction:
+--
+--     psql warbler < migrations/0007_follows_timestamp.sql
+
+ALTER TABLE follows
+    ADD COLUMN IF NOT EXISTS timestamp timestamp without time zone
+    NOT NULL DEFAULT timezone('utc', now());
+
+-- For databases that ran this with a local-time default.
+ALTER TABLE follows ALTER COLUMN timestamp SET DEFAULT timezone('utc', now());
+
+-- users_followers(): who follows X, newest first.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_followed_timestamp
+    ON follows (user_being_followed_id, timestamp, user_following_id);
+
+-- show_following(), home timeline: who does X follow.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_follows_following_timestamp
+    ON follows (user_following_id, timestamp, user_being_followed_id);
+
+-- The index above leads with the same column.
+DROP INDEX CONCURRENTLY IF EXISTS ix_follows_following;
+
+ANALYZE follows;
@@ -0,0 +1,13 @@
+-- Account deletion tombstones users (deleted_at) and purges their rows
+-- in the background; see accounts.py. The purge relies on the ON DELETE
+-- CASCADE foreign keys already on messages, likes, follows and timelines.
+--
+-- The index is built CONCURRENTLY, so run outside a transaction:
+--
+--     psql warbler < migrations/0008_user_tombstones.sql
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS deleted_at timestamp without time zone;
+
+-- Only tombstones are indexed, so this stays tiny.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_deleted_at
+    ON users (deleted_at) WHERE deleted_at IS NOT NULL;
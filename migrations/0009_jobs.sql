@@ -0,0 +1,23 @@
+-- Queue table for background jobs; see jobs.py. Workers claim due jobs
+-- with SELECT ... FOR UPDATE SKIP LOCKED, in run_at order.
+--
+--     psql warbler < migrations/0009_jobs.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id serial PRIMARY KEY,
+    name text NOT NULL,
+    args text NOT NULL,
+    enqueued_at timestamp without time zone NOT NULL,
+    run_at timestamp without time zone NOT NULL,
+    attempts integer NOT NULL DEFAULT 0,
+    last_error text,
+    failed_at timestamp without time zone
+);
+
+-- Failed jobs are never claimed again, so they're left out.
+CREATE INDEX IF NOT EXISTS ix_jobs_run_at
+    ON jobs (run_at, id) WHERE failed_at IS NULL;
+
+COMMIT;
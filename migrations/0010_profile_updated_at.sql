@@ -0,0 +1,18 @@
+-- Users record when they last edited their profile, so the home feed's
+-- ETag changes when an author on it changes their name or picture; see
+-- caching.timeline_validator.
+--
+-- Values are naive UTC, like the datetime.utcnow() the app writes, so an
+-- edit always sorts after the backfill whatever the server's time zone.
+--
+--     psql warbler < migrations/0010_profile_updated_at.sql
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_updated_at timestamp without time zone
+    NOT NULL DEFAULT timezone('utc', now());
+
+-- For databases that ran an earlier version of this file with a local-time
+-- default: fix the default, and pull back backfilled values ahead of UTC.
+ALTER TABLE users ALTER COLUMN profile_updated_at SET DEFAULT timezone('utc', now());
+
+UPDATE users SET profile_updated_at = timezone('utc', now())
+    WHERE profile_updated_at > timezone('utc', now());
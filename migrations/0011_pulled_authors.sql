@@ -0,0 +1,18 @@
+-- Authors merged into home feeds at read time, instead of being fanned
+-- out on write; see timelines.py. Users who already have the default
+-- TIMELINE_FANOUT_LIMIT (10000) followers start out pulled.
+--
+--     psql warbler < migrations/0011_pulled_authors.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS pulled_authors (
+    user_id integer PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+    demoting boolean NOT NULL DEFAULT false
+);
+
+INSERT INTO pulled_authors (user_id)
+    SELECT id FROM users WHERE followers_count >= 10000
+    ON CONFLICT DO NOTHING;
+
+COMMIT;
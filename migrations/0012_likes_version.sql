@@ -0,0 +1,8 @@
+-- Users carry a likes_version, bumped on every like and unlike, which the
+-- profile and home pages put in their ETags; see likes.py and caching.py.
+-- Adding a column with a constant default doesn't rewrite the table on
+-- Postgres 11+.
+--
+--     psql warbler < migrations/0012_likes_version.sql
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS likes_version integer NOT NULL DEFAULT 0;
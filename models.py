@@ -2,13 +2,42 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, or_
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from passwords import check_password, hash_password, needs_rehash
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
 
+def is_postgres(bind=None):
+    """Is `bind` (by default, the session's database) Postgres? Callers
+    pick Postgres-only SQL with this, and fall back to portable SQL."""
+
+    bind = bind if bind is not None else db.session.get_bind()
+    return bind.dialect.name == 'postgresql'
+
+
+class utcnow(FunctionElement):
+    """Server-side default for the current time in UTC, naive like the
+    datetime.utcnow() values the app writes."""
+
+    type = db.DateTime()
+
+
+@compiles(utcnow, 'postgresql')
+def pg_utcnow(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+
+@compiles(utcnow)
+def default_utcnow(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is already UTC.
+    return "CURRENT_TIMESTAMP"
+
+
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
 
@@ -26,26 +55,43 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=utcnow(),
+    )
+
+    # Follower and following lists page through one user's edges, newest
+    # first. The primary key still answers "does A follow B".
+    __table_args__ = (
+        db.Index('ix_follows_followed_timestamp',
+                 'user_being_followed_id', 'timestamp', 'user_following_id'),
+        db.Index('ix_follows_following_timestamp',
+                 'user_following_id', 'timestamp', 'user_being_followed_id'),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
 
-    id = db.Column(
-        db.Integer,
-        primary_key=True
-    )
-
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+    )
+
+    # The primary key covers "what did X like"; this covers "who liked M".
+    __table_args__ = (
+        db.Index('ix_likes_message', 'message_id'),
     )
 
 
@@ -94,50 +140,188 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # Denormalized counts, kept in sync by the routes that change them
+    # (see counters.py); `flask reconcile-counters` recomputes them.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped on every like and unlike, so pages showing the user's like
+    # buttons can tell their likes changed even when the count didn't.
+    likes_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # When the user last edited their profile; pages showing their name
+    # or picture alongside others' (the home feed) use it in their ETag.
+    profile_updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=utcnow(),
+    )
+
+    # Set when the account is deleted. The user is hidden from then on,
+    # and their rows are purged in the background (see accounts.py).
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    # Rows hanging off a user are removed by the database's ON DELETE
+    # CASCADE, not loaded and deleted one by one.
+
+    messages = db.relationship('Message', passive_deletes=True)
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True,
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True,
     )
 
     likes = db.relationship(
         'Message',
-        secondary="likes"
+        secondary="likes",
+        passive_deletes=True,
+    )
+
+    # The purge looks for tombstones; there are only ever a few.
+    __table_args__ = (
+        db.Index('ix_users_deleted_at', 'deleted_at',
+                 postgresql_where=deleted_at.isnot(None)),
     )
 
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    def serialize(self):
+        """JSON-friendly dict of this user's public profile."""
+
+        return {
+            'id': self.id,
+            'username': self.username,
+            'image_url': self.image_url,
+            'header_image_url': self.header_image_url,
+            'bio': self.bio,
+            'location': self.location,
+            'messages_count': self.messages_count,
+            'following_count': self.following_count,
+            'followers_count': self.followers_count,
+            'likes_count': self.likes_count,
+        }
+
+    def load_follow_state(self, users):
+        """Fetch follow edges between this user and `users` in one query.
+
+        Afterwards `is_following` / `is_followed_by` answer from memory for
+        any of `users`. Call this before rendering a list of users.
+        """
+
+        ids = {user.id for user in users} - self._follow_state.keys()
+
+        if not ids:
+            return
+
+        edges = (Follows
+                 .query
+                 .filter(or_(
+                     and_(Follows.user_following_id == self.id,
+                          Follows.user_being_followed_id.in_(ids)),
+                     and_(Follows.user_being_followed_id == self.id,
+                          Follows.user_following_id.in_(ids))))
+                 .all())
+
+        following = {edge.user_being_followed_id for edge in edges
+                     if edge.user_following_id == self.id}
+        followers = {edge.user_following_id for edge in edges
+                     if edge.user_being_followed_id == self.id}
+
+        for user_id in ids:
+            self._follow_state[user_id] = (user_id in following,
+                                           user_id in followers)
+
+    @property
+    def _follow_state(self):
+        """{user id: (self follows them, they follow self)} loaded so far."""
+
+        if '_follow_state_cache' not in self.__dict__:
+            self.__dict__['_follow_state_cache'] = {}
+        return self.__dict__['_follow_state_cache']
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        if other_user.id in self._follow_state:
+            return self._follow_state[other_user.id][1]
+
+        return db.session.query(Follows.query.filter_by(
+            user_being_followed_id=self.id,
+            user_following_id=other_user.id).exists()).scalar()
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        if other_user.id in self._follow_state:
+            return self._follow_state[other_user.id][0]
+
+        return db.session.query(Follows.query.filter_by(
+            user_being_followed_id=other_user.id,
+            user_following_id=self.id).exists()).scalar()
+
+    @classmethod
+    def get_active_or_404(cls, user_id):
+        """The user with this id, or 404 if there's none or it was deleted."""
+
+        return (cls.query
+                .filter(cls.id == user_id, cls.deleted_at.is_(None))
+                .first_or_404())
 
     @classmethod
     def signup(cls, username, email, password, image_url):
         """Sign up user.
 
-        Hashes password and adds user to system.
+        Hashes password and adds user to system. Raises
+        `PasswordWorkUnavailable` if hashing is overloaded.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hash_password(password)
 
         user = User(
             username=username,
@@ -158,13 +342,19 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash used a different bcrypt cost than is configured
+        now, it is replaced (the caller commits). Raises
+        `PasswordWorkUnavailable` if hashing is overloaded.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = check_password(user.password, password)
             if is_auth:
+                if needs_rehash(user.password):
+                    user.password = hash_password(password)
                 return user
 
         return False
@@ -188,7 +378,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -199,6 +389,147 @@ class Message(db.Model):
 
     user = db.relationship('User')
 
+    # Profile feeds page through one user's messages newest first.
+    __table_args__ = (
+        db.Index('ix_messages_user_timestamp', 'user_id', 'timestamp', 'id'),
+    )
+
+    def serialize(self):
+        """JSON-friendly dict of this message."""
+
+        return {
+            'id': self.id,
+            'text': self.text,
+            'timestamp': self.timestamp.isoformat(),
+            'user_id': self.user_id,
+        }
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into one user's home timeline.
+
+    Rows are written when a message is posted (fan-out on write), so the
+    home feed is a single range read on (user_id, timestamp).
+    """
+
+    __tablename__ = 'timelines'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timelines_user_timestamp', 'user_id', 'timestamp', 'message_id'),
+        db.Index('ix_timelines_user_author', 'user_id', 'author_id'),
+        db.Index('ix_timelines_message', 'message_id'),
+    )
+
+
+class PulledAuthor(db.Model):
+    """An author whose messages are merged into feeds at read time instead
+    of being fanned out (see timelines.py).
+
+    There are only ever a few, so a feed finds the ones its reader follows
+    with one primary key probe of `follows` each, however many users the
+    reader follows.
+    """
+
+    __tablename__ = 'pulled_authors'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    # Set while the author's recent messages are copied to their followers'
+    # timelines on the way back to fan-out on write; new messages are
+    # fanned out again, and reads still merge the author meanwhile.
+    demoting = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default='false',
+    )
+
+
+class Job(db.Model):
+    """A unit of background work waiting to run (see jobs.py)."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # Registered handler name and its JSON-encoded positional arguments.
+    name = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    args = db.Column(
+        db.Text,
+        nullable=False,
+        default='[]',
+    )
+
+    enqueued_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    # Not claimable before this; pushed ahead while a worker holds the job
+    # and after each failure.
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    # Set once a job has used up its attempts; it then stays for inspection.
+    failed_at = db.Column(
+        db.DateTime,
+    )
+
+    # Workers take the job that's been due longest.
+    __table_args__ = (
+        db.Index('ix_jobs_run_at', 'run_at', 'id',
+                 postgresql_where=failed_at.is_(None)),
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,167 @@
+"""Keyset (cursor) pagination for Warbler feeds.
+
+Feeds are ordered newest first by (timestamp, id). Instead of OFFSET we
+hand out opaque cursors holding the (timestamp, id) of the boundary row and
+filter with a row comparison, so every page is an index range read no
+matter how deep it is.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from flask import abort, request, url_for
+from sqlalchemy import tuple_
+
+FEED_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 200
+
+CURSOR_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# Query string arguments that links to other pages keep.
+KEPT_ARGS = ('q', 'limit', 'format')
+
+
+def encode_cursor(key):
+    """Turn a (timestamp, id) key into an opaque URL-safe string."""
+
+    timestamp, id_ = key
+    raw = f"{timestamp.strftime(CURSOR_TIMESTAMP_FORMAT)}|{id_}"
+    return urlsafe_b64encode(raw.encode('UTF-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into a (timestamp, id) key; 400 if it is garbage."""
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, id_ = urlsafe_b64decode(padded).decode('UTF-8').split('|')
+        return datetime.strptime(timestamp, CURSOR_TIMESTAMP_FORMAT), int(id_)
+    except (ValueError, UnicodeDecodeError):
+        abort(400)
+
+
+def message_key(msg):
+    """Sort key of a message in a feed."""
+
+    return msg.timestamp, msg.id
+
+
+class Page:
+    """One page of a feed, plus cursors to the neighbouring pages."""
+
+    def __init__(self, items, older=None, newer=None):
+        self.items = items
+        self.older = older
+        self.newer = newer
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def older_url(self, **params):
+        """URL of the next (older) page of the current endpoint, if any."""
+
+        if self.older:
+            return page_url(before=self.older, **params)
+
+    def newer_url(self, **params):
+        """URL of the previous (newer) page of the current endpoint, if any."""
+
+        if self.newer:
+            return page_url(after=self.newer, **params)
+
+    def serialize(self, serialize_item):
+        """JSON-friendly dict of this page."""
+
+        return {
+            'items': [serialize_item(item) for item in self.items],
+            'older': self.older_url(format='json'),
+            'newer': self.newer_url(format='json'),
+        }
+
+
+def page_url(**params):
+    """URL of the current endpoint with a different cursor (or page).
+
+    Only the KEPT_ARGS of the query string are carried over: anything else
+    could collide with the view's arguments or url_for's own (_external,
+    _scheme...) and make the link point somewhere else.
+    """
+
+    args = {key: request.args[key] for key in KEPT_ARGS if key in request.args}
+    args.update(params)
+    return url_for(request.endpoint, **request.view_args, **args)
+
+
+def limit_arg(maximum=MAX_PAGE_SIZE):
+    """Read the page size from the query string, clamped to `maximum`."""
+
+    limit = request.args.get('limit', FEED_PAGE_SIZE, type=int)
+    return max(1, min(limit, maximum))
+
+
+def page_args(maximum=MAX_PAGE_SIZE):
+    """Read `before`, `after` and `limit` from the query string."""
+
+    before = request.args.get('before')
+    after = request.args.get('after')
+
+    return dict(
+        before=decode_cursor(before) if before else None,
+        after=decode_cursor(after) if after else None,
+        limit=limit_arg(maximum),
+    )
+
+
+def keyset_query(query, timestamp, id_, before=None, after=None,
+                 limit=FEED_PAGE_SIZE):
+    """Restrict `query` to one page past a cursor.
+
+    Fetches one extra row so `build_page` can tell whether more exist.
+    Rows come back newest first, except when paging `after` a cursor,
+    where they come back oldest first.
+    """
+
+    if after is not None:
+        query = (query
+                 .filter(tuple_(timestamp, id_) > tuple_(*after))
+                 .order_by(timestamp.asc(), id_.asc()))
+    else:
+        if before is not None:
+            query = query.filter(tuple_(timestamp, id_) < tuple_(*before))
+        query = query.order_by(timestamp.desc(), id_.desc())
+
+    return query.limit(limit + 1)
+
+
+def build_page(rows, before=None, after=None, limit=FEED_PAGE_SIZE,
+               key=message_key):
+    """Make a newest-first `Page` from rows fetched by `keyset_query`."""
+
+    has_more = len(rows) > limit
+    rows = list(rows[:limit])
+
+    if after is not None:
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = before is not None, has_more
+
+    if not rows:
+        return Page([],
+                    older=encode_cursor(after) if after else None,
+                    newer=encode_cursor(before) if before else None)
+
+    return Page(rows,
+                older=encode_cursor(key(rows[-1])) if has_older else None,
+                newer=encode_cursor(key(rows[0])) if has_newer else None)
+
+
+def paginate(query, timestamp, id_, before=None, after=None,
+             limit=FEED_PAGE_SIZE, key=message_key):
+    """Run `query` for one keyset page and wrap it in a `Page`."""
+
+    rows = keyset_query(query, timestamp, id_, before, after, limit).all()
+    return build_page(rows, before, after, limit, key)
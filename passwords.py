@@ -0,0 +1,127 @@
+"""Password hashing off the request thread.
+
+bcrypt is deliberately slow, so signups and logins run it on a bounded
+process pool instead of the worker handling the request. If too many
+hashes are already queued, or one takes longer than the timeout, we give
+up with `PasswordWorkUnavailable` rather than pile up requests.
+
+The work factor comes from BCRYPT_LOG_ROUNDS; hashes made with a
+different cost are upgraded the next time their owner logs in.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_TIMEOUT = 5
+
+
+class PasswordWorkUnavailable(Exception):
+    """Hashing is overloaded or timed out; the client should retry later."""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'),
+                         bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('UTF-8'), hashed.encode('UTF-8'))
+
+
+class PasswordPool:
+    """Runs bcrypt in worker processes, with a cap on queued work.
+
+    With `size` 0, work runs inline on the calling thread (handy in tests).
+    """
+
+    def __init__(self, size=0, queue_depth=None, timeout=DEFAULT_TIMEOUT,
+                 log_rounds=DEFAULT_LOG_ROUNDS):
+        self.configure(size, queue_depth, timeout, log_rounds)
+
+    def configure(self, size, queue_depth=None, timeout=DEFAULT_TIMEOUT,
+                  log_rounds=DEFAULT_LOG_ROUNDS):
+        self.size = size
+        self.queue_depth = queue_depth or max(size, 1) * 4
+        self.timeout = timeout
+        self.log_rounds = log_rounds
+        self._slots = BoundedSemaphore(self.queue_depth)
+        self._executor = None
+        self._lock = Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.size)
+            return self._executor
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` in the pool and wait for its result."""
+
+        if not self.size:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise PasswordWorkUnavailable("too many password checks queued")
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda future: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PasswordWorkUnavailable("password check timed out")
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+password_pool = PasswordPool()
+
+
+def init_app(app):
+    """Size the pool and pick the work factor from config."""
+
+    password_pool.shutdown()
+    password_pool.configure(
+        size=app.config.get('PASSWORD_POOL_SIZE', os.cpu_count() or 1),
+        queue_depth=app.config.get('PASSWORD_QUEUE_DEPTH'),
+        timeout=app.config.get('PASSWORD_TIMEOUT', DEFAULT_TIMEOUT),
+        log_rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS),
+    )
+
+
+def hash_password(password):
+    """bcrypt hash of `password` at the configured cost."""
+
+    return password_pool.run(_hash, password, password_pool.log_rounds)
+
+
+def check_password(hashed, password):
+    """Does `password` match the bcrypt hash `hashed`?"""
+
+    try:
+        return password_pool.run(_check, hashed, password)
+    except ValueError:
+        # Not a bcrypt hash at all.
+        return False
+
+
+def needs_rehash(hashed):
+    """Was `hashed` made with a different cost than the configured one?"""
+
+    try:
+        return int(hashed.split('$')[2]) != password_pool.log_rounds
+    except (IndexError, ValueError):
+        return True
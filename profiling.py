@@ -0,0 +1,170 @@
+"""SQL instrumentation for Warbler.
+
+Hooks on SQLAlchemy engine events that let requests and tests see which
+statements were issued and how the database plans to run them.
+
+Every request counts its statements. A sample of requests
+(SQL_PROFILE_SAMPLE_RATE, 0 to 1) also times them: the total goes out in a
+`Server-Timing: db;dur=...` header, and any statement slower than
+SLOW_QUERY_MS is logged to the 'warbler.sql' logger with its route and the
+shape (not the values) of its parameters.
+
+Server-Timing only covers statements run before the response headers go
+out. Streamed API responses run most of their queries while the body is
+sent, after the header is written, so their `db` time leaves those out
+(slow statements among them are still logged).
+"""
+
+import json
+import logging
+from contextlib import contextmanager
+from random import random
+from time import perf_counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SQL_STATEMENTS_HEADER = 'X-SQL-Statements'
+
+DEFAULT_SAMPLE_RATE = 0.1
+DEFAULT_SLOW_QUERY_MS = 100
+
+slow_query_log = logging.getLogger('warbler.sql')
+
+
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    """Engine hook: count statements run while handling a request."""
+
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+
+        if g.get('sql_profiled') and context is not None:
+            context.profiling_started = perf_counter()
+
+
+def time_statement(conn, cursor, statement, parameters, context, executemany):
+    """Engine hook: add a sampled request's statement time to `g.sql_time`,
+    and log the statement if it was slow."""
+
+    if not (has_request_context() and g.get('sql_profiled')):
+        return
+
+    started = getattr(context, 'profiling_started', None)
+    if started is None:
+        return
+
+    elapsed = perf_counter() - started
+    g.sql_time = g.get('sql_time', 0.0) + elapsed
+
+    if elapsed * 1000 >= g.slow_query_ms:
+        slow_query_log.warning(
+            "slow query: %.1fms in %s %s (%s) params=%s: %s",
+            elapsed * 1000, request.method, request.path, request.endpoint,
+            parameter_shape(parameters, executemany), ' '.join(statement.split()))
+
+
+def parameter_shape(parameters, executemany=False):
+    """The types of bound parameters, without their values."""
+
+    if executemany:
+        return f"{len(parameters)} x {parameter_shape(parameters[0])}" if parameters else '[]'
+
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f"{key}: {type(value).__name__}"
+                               for key, value in parameters.items()) + '}'
+
+    if isinstance(parameters, (list, tuple)):
+        return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+
+    return type(parameters).__name__
+
+
+def add_server_timing(response, name, seconds, description=None):
+    """Add a metric to the response's Server-Timing header."""
+
+    metric = f"{name};dur={seconds * 1000:.2f}"
+    if description:
+        metric += f';desc="{description}"'
+
+    existing = response.headers.get('Server-Timing')
+    response.headers['Server-Timing'] = f"{existing}, {metric}" if existing else metric
+
+
+def init_app(app):
+    """Count SQL statements per request in `g.sql_statements`, and time
+    them on sampled requests.
+
+    With SQL_STATEMENTS_HEADER set in the config, the count is also sent
+    back as an X-SQL-Statements response header, which tests use to put
+    an upper bound on the queries a route may run.
+    """
+
+    if not event.contains(Engine, 'before_cursor_execute', count_statement):
+        event.listen(Engine, 'before_cursor_execute', count_statement)
+        event.listen(Engine, 'after_cursor_execute', time_statement)
+
+    @app.before_request
+    def reset_statement_count():
+        g.sql_statements = 0
+        g.sql_time = 0.0
+        g.sql_profiled = random() < app.config.get('SQL_PROFILE_SAMPLE_RATE',
+                                                   DEFAULT_SAMPLE_RATE)
+        g.slow_query_ms = app.config.get('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+
+    @app.after_request
+    def add_statement_count_header(response):
+        if app.config.get('SQL_STATEMENTS_HEADER'):
+            response.headers[SQL_STATEMENTS_HEADER] = str(g.get('sql_statements', 0))
+
+        if g.get('sql_profiled'):
+            add_server_timing(response, 'db', g.sql_time,
+                              f"{g.sql_statements} queries")
+        return response
+
+
+@contextmanager
+def capture_queries(engine):
+    """Collect (statement, parameters) for everything run on `engine`."""
+
+    queries = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        queries.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def explain(engine, statement, parameters):
+    """Postgres plan for a captured statement, as the root plan node dict."""
+
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+        (plan,) = cursor.fetchone()
+    finally:
+        conn.close()
+
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    return plan[0]['Plan']
+
+
+def sequential_scans(plan):
+    """Names of the relations a plan reads with a sequential scan."""
+
+    found = []
+
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+
+    for child in plan.get('Plans', []):
+        found.extend(sequential_scans(child))
+
+    return found
@@ -0,0 +1,409 @@
+"""Search for Warbler.
+
+User search matches substrings of usernames. On Postgres it is served by
+a pg_trgm GIN index (see migrations/0004_username_trigram.sql) and ranked
+by trigram similarity. Other databases (tests) use an in-process trigram
+index built from the users table on first use and kept up to date by the
+routes that create, rename and delete users.
+
+Message search is full-text: Postgres matches `to_tsvector` against a GIN
+index (migrations/0005_message_text_search.sql) and ranks with ts_rank;
+elsewhere an in-process inverted index stands in, updated as messages are
+posted and deleted. Results are paged with (rank, id) cursors.
+"""
+
+import re
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from math import log
+from threading import Lock
+
+from flask import abort, request
+from sqlalchemy import Float, func, literal_column, text, tuple_
+from sqlalchemy.orm import joinedload
+
+from models import db, is_postgres, Message, User
+from pagination import FEED_PAGE_SIZE, Page, page_url
+
+USERS_PER_PAGE = 30
+MAX_PAGE = 50
+
+
+def trigrams(value, padded=True):
+    """Set of lowercase 3-grams of `value`, padded the way pg_trgm pads words."""
+
+    value = value.lower()
+    if padded:
+        value = f"  {value} "
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def similarity(a, b):
+    """Share of trigrams two strings have in common (like pg_trgm's similarity())."""
+
+    a, b = trigrams(a), trigrams(b)
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def escape_like(value):
+    """Escape LIKE wildcards so user input only matches literally."""
+
+    return (value
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+class Results:
+    """One page of ranked search results."""
+
+    def __init__(self, items, page, has_next):
+        self.items = items
+        self.page = page
+        self.has_next = has_next
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def next_url(self):
+        if self.has_next:
+            return page_url(page=self.page + 1)
+
+    def prev_url(self):
+        if self.page > 1:
+            return page_url(page=self.page - 1)
+
+
+def page_arg():
+    """The requested results page, clamped to 1..MAX_PAGE."""
+
+    return max(1, min(request.args.get('page', 1, type=int), MAX_PAGE))
+
+
+##############################################################################
+# In-process fallback
+
+
+class NgramIndex:
+    """Trigram -> ids posting lists over a set of short strings."""
+
+    def __init__(self):
+        self.values = {}
+        self.postings = {}
+        self.lock = Lock()
+
+    def add(self, id_, value):
+        with self.lock:
+            self._remove(id_)
+            self.values[id_] = value
+            for gram in trigrams(value):
+                self.postings.setdefault(gram, set()).add(id_)
+
+    def remove(self, id_):
+        with self.lock:
+            self._remove(id_)
+
+    def _remove(self, id_):
+        value = self.values.pop(id_, None)
+        if value is None:
+            return
+        for gram in trigrams(value):
+            ids = self.postings.get(gram)
+            if ids is not None:
+                ids.discard(id_)
+                if not ids:
+                    del self.postings[gram]
+
+    def search(self, query):
+        """Ids whose value contains `query`, best match first."""
+
+        query = query.lower()
+        grams = trigrams(query, padded=False)
+
+        with self.lock:
+            if grams:
+                postings = sorted((self.postings.get(gram, set()) for gram in grams),
+                                  key=len)
+                candidates = set.intersection(*postings)
+            else:
+                candidates = set(self.values)
+
+            matches = [(id_, self.values[id_]) for id_ in candidates
+                       if query in self.values[id_].lower()]
+
+        matches.sort(key=lambda match: (-similarity(query, match[1]), match[1]))
+        return [id_ for id_, value in matches]
+
+
+username_index = None
+username_index_lock = Lock()
+
+
+def get_username_index():
+    """The in-process username index, built on first use."""
+
+    global username_index
+
+    with username_index_lock:
+        if username_index is None:
+            index = NgramIndex()
+            for user_id, username in (db.session
+                                      .query(User.id, User.username)
+                                      .filter(User.deleted_at.is_(None))):
+                index.add(user_id, username)
+            username_index = index
+
+    return username_index
+
+
+def index_user(user):
+    """Add or re-index a user after signup or a username change."""
+
+    if username_index is not None:
+        username_index.add(user.id, user.username)
+
+
+def unindex_user(user_id):
+    """Drop a deleted user from the index."""
+
+    if username_index is not None:
+        username_index.remove(user_id)
+
+
+##############################################################################
+# Queries
+
+
+has_trigram_extension = None
+
+
+def trigram_extension_installed():
+    """Is pg_trgm available? (Checked once per process.)"""
+
+    global has_trigram_extension
+
+    if has_trigram_extension is None:
+        has_trigram_extension = db.session.execute(text(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+
+    return has_trigram_extension
+
+
+def search_users(query, page=1, per_page=USERS_PER_PAGE):
+    """One `Results` page of users whose username contains `query`."""
+
+    offset = (page - 1) * per_page
+
+    if is_postgres():
+        users = User.query.filter(
+            User.username.ilike(f"%{escape_like(query)}%", escape='\\'),
+            User.deleted_at.is_(None))
+
+        if trigram_extension_installed():
+            rank = func.similarity(User.username, query).desc()
+        else:
+            rank = func.length(User.username)
+
+        users = (users
+                 .order_by(rank, User.username)
+                 .offset(offset)
+                 .limit(per_page + 1)
+                 .all())
+
+    else:
+        ids = get_username_index().search(query)[offset:offset + per_page + 1]
+        by_id = {user.id: user for user in User.query.filter(User.id.in_(ids))} if ids else {}
+        users = [by_id[id_] for id_ in ids if id_ in by_id]
+
+    return Results(users[:per_page], page, len(users) > per_page)
+
+
+def list_all_users(page=1, per_page=USERS_PER_PAGE):
+    """One `Results` page of the whole user directory."""
+
+    users = (User
+             .query
+             .filter(User.deleted_at.is_(None))
+             .order_by(User.id)
+             .offset((page - 1) * per_page)
+             .limit(per_page + 1)
+             .all())
+
+    return Results(users[:per_page], page, len(users) > per_page)
+
+
+##############################################################################
+# Message full-text search
+
+
+TEXT_SEARCH_CONFIG = literal_column("'english'")
+
+# Words too common to be worth indexing, roughly Postgres' english list.
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have he her his i in is it its
+    me my no not of on or our she so that the their them they this to was we
+    were what when which who will with you your
+""".split())
+
+
+def tokenize(value):
+    """Lowercase words of `value`, without stop words."""
+
+    return [word for word in re.findall(r"\w+", value.lower())
+            if word not in STOP_WORDS]
+
+
+def encode_rank_cursor(key):
+    """Turn a (rank, id) key into an opaque URL-safe string."""
+
+    rank, id_ = key
+    raw = f"{rank!r}|{id_}"
+    return urlsafe_b64encode(raw.encode('UTF-8')).decode('ascii').rstrip('=')
+
+
+def decode_rank_cursor(cursor):
+    """Turn a cursor back into a (rank, id) key; 400 if it is garbage."""
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        rank, id_ = urlsafe_b64decode(padded).decode('UTF-8').split('|')
+        return float(rank), int(id_)
+    except (ValueError, UnicodeDecodeError):
+        abort(400)
+
+
+class InvertedIndex:
+    """Word -> {message id: term count} postings, scored with tf-idf."""
+
+    def __init__(self):
+        self.postings = {}
+        self.documents = {}
+        self.lock = Lock()
+
+    def add(self, id_, value):
+        words = tokenize(value)
+
+        with self.lock:
+            self._remove(id_)
+            self.documents[id_] = words
+            for word in words:
+                counts = self.postings.setdefault(word, {})
+                counts[id_] = counts.get(id_, 0) + 1
+
+    def remove(self, id_):
+        with self.lock:
+            self._remove(id_)
+
+    def _remove(self, id_):
+        words = self.documents.pop(id_, None)
+        if words is None:
+            return
+        for word in set(words):
+            counts = self.postings.get(word)
+            if counts is not None:
+                counts.pop(id_, None)
+                if not counts:
+                    del self.postings[word]
+
+    def search(self, query):
+        """[(score, id)] of entries containing every word of `query`, best first."""
+
+        words = set(tokenize(query))
+        if not words:
+            return []
+
+        with self.lock:
+            postings = [self.postings.get(word, {}) for word in words]
+            ids = set.intersection(*(set(counts) for counts in postings))
+            total = len(self.documents)
+
+            scored = []
+            for id_ in ids:
+                score = sum(counts[id_] * log(1 + total / len(counts))
+                            for counts in postings)
+                scored.append((score / len(self.documents[id_]), id_))
+
+        scored.sort(reverse=True)
+        return scored
+
+
+message_index = None
+message_index_lock = Lock()
+
+
+def get_message_index():
+    """The in-process message index, built on first use."""
+
+    global message_index
+
+    with message_index_lock:
+        if message_index is None:
+            index = InvertedIndex()
+            for message_id, message_text in db.session.query(Message.id, Message.text):
+                index.add(message_id, message_text)
+            message_index = index
+
+    return message_index
+
+
+def index_message(msg):
+    """Make a newly posted message searchable."""
+
+    if message_index is not None:
+        message_index.add(msg.id, msg.text)
+
+
+def unindex_message(message_id):
+    """Drop a deleted message from the index."""
+
+    if message_index is not None:
+        message_index.remove(message_id)
+
+
+def search_messages(query, before=None, limit=FEED_PAGE_SIZE):
+    """One `Page` of messages matching `query`, best match first.
+
+    `before` is a decoded (rank, id) cursor from a previous page.
+    """
+
+    if is_postgres():
+        document = func.to_tsvector(TEXT_SEARCH_CONFIG, Message.text)
+        tsquery = func.plainto_tsquery(TEXT_SEARCH_CONFIG, query)
+        # ts_rank is a float4; as a float8 it survives the round trip
+        # through the cursor exactly, so `<` doesn't let ties back in.
+        rank = func.ts_rank(document, tsquery).cast(Float)
+
+        rows = (db.session
+                .query(Message, rank)
+                .options(joinedload(Message.user))
+                .filter(document.op('@@')(tsquery)))
+
+        if before is not None:
+            rows = rows.filter(tuple_(rank, Message.id) < tuple_(*before))
+
+        rows = (rows
+                .order_by(rank.desc(), Message.id.desc())
+                .limit(limit + 1)
+                .all())
+
+        keys = [(rank, msg.id) for msg, rank in rows]
+        messages = [msg for msg, rank in rows]
+
+    else:
+        keys = [key for key in get_message_index().search(query)
+                if before is None or key < before][:limit + 1]
+
+        ids = [id_ for rank, id_ in keys]
+        by_id = ({msg.id: msg for msg in (Message
+                                          .query
+                                          .options(joinedload(Message.user))
+                                          .filter(Message.id.in_(ids)))}
+                 if ids else {})
+        messages = [by_id[id_] for id_ in ids]
+
+    has_more = len(messages) > limit
+    return Page(messages[:limit],
+                older=encode_rank_cursor(keys[limit - 1]) if has_more else None)
+
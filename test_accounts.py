@@ -0,0 +1,124 @@
+"""Account deletion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_accounts.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, Likes, TimelineEntry, Job
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import accounts
+import follows
+import jobs
+import likes
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AccountDeletionTestCase(TestCase):
+    """Test tombstoning and purging deleted accounts."""
+
+    def setUp(self):
+        """Create `doomed`, who follows `friend`, is followed by `fan`,
+        posted five messages (two liked by `fan`) and liked one of `friend`'s."""
+
+        Job.query.delete()
+        TimelineEntry.query.delete()
+        Likes.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+        # Queue jobs, and run them only when the test says so.
+        self.saved_config = {key: app.config[key] for key in
+                             ('JOBS_INLINE', 'JOB_WORKERS', 'PURGE_BATCH_SIZE')}
+        app.config.update(JOBS_INLINE=False, JOB_WORKERS=0)
+        self.client = app.test_client()
+
+        doomed, fan, friend = [User(email=f"{name}@test.com", username=name,
+                                    password="HASHED_PASSWORD")
+                               for name in ("doomed", "fan", "friend")]
+        db.session.add_all([doomed, fan, friend])
+        db.session.commit()
+        self.doomed_id, self.fan_id, self.friend_id = doomed.id, fan.id, friend.id
+
+        posts = [Message(text=f"post {i}", user_id=doomed.id) for i in range(5)]
+        theirs = Message(text="friend's post", user_id=friend.id)
+        db.session.add_all(posts + [theirs])
+        db.session.commit()
+
+        follows.follow(fan.id, doomed.id)
+        follows.follow(doomed.id, friend.id)
+        likes.set_like(fan.id, posts[0].id)
+        likes.set_like(fan.id, posts[1].id)
+        likes.set_like(doomed.id, theirs.id)
+        db.session.commit()
+
+    def tearDown(self):
+        """Roll back the transaction to keep the database clean. """
+        db.session.rollback()
+        app.config.update(self.saved_config)
+        self.ctx.pop()
+
+    def test_delete_hides_then_purges(self):
+        """Is a deleted account hidden at once, and gone after the purge
+        with everyone else's counters fixed?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.doomed_id
+
+            resp = c.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+
+            resp = c.get(f"/users/{self.doomed_id}")
+            self.assertEqual(resp.status_code, 404)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.fan_id
+
+            resp = c.get(f"/users/{self.fan_id}/following?format=json")
+            self.assertEqual([], resp.get_json()["items"])
+
+        app.config['PURGE_BATCH_SIZE'] = 2
+        jobs.run_pending()
+
+        self.assertEqual(0, Job.query.count())
+        self.assertIsNone(User.query.get(self.doomed_id))
+        self.assertEqual(0, Message.query.filter_by(user_id=self.doomed_id).count())
+        self.assertEqual(0, Likes.query.count())
+        self.assertEqual(0, Follows.query.count())
+
+        fan = User.query.get(self.fan_id)
+        self.assertEqual((0, 0), (fan.following_count, fan.likes_count))
+        self.assertEqual(0, User.query.get(self.friend_id).followers_count)
+
+    def test_purge_skips_live_accounts(self):
+        """Does the purge leave accounts that weren't deleted alone?"""
+
+        self.assertEqual(0, accounts.purge_user(self.fan_id))
+        self.assertEqual(0, accounts.purge_deleted())
+
+        self.assertIsNotNone(User.query.get(self.fan_id))
@@ -0,0 +1,221 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api.py
+
+
+import json
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Message, User, Follows, Likes, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# Run background jobs (timeline fan-out...) right away, in the request.
+app.config['JOBS_INLINE'] = True
+
+
+class ApiTestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        """Create a user with five messages."""
+
+        Likes.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        self.client = app.test_client()
+
+        u = User(email="test@test.com", username="testuser", password="HASHED_PASSWORD")
+        db.session.add(u)
+        db.session.commit()
+        self.user_id = u.id
+
+        db.session.add_all([Message(text=f"msg {i}", user_id=u.id) for i in range(5)])
+        db.session.commit()
+
+    def tearDown(self):
+        """Roll back the transaction to keep the database clean. """
+        db.session.rollback()
+
+    def test_user_messages_paging(self):
+        """Can all messages be read a page at a time, newest first?"""
+
+        url = f"/api/v1/users/{self.user_id}/messages?limit=2"
+        texts = []
+
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+
+            data = json.loads(resp.data)
+            self.assertLessEqual(len(data["items"]), 2)
+            texts += [item["text"] for item in data["items"]]
+            url = data["next"]
+
+        self.assertEqual(["msg 4", "msg 3", "msg 2", "msg 1", "msg 0"], texts)
+
+    def test_ndjson(self):
+        """Does NDJSON give one item per line plus a links line?"""
+
+        resp = self.client.get(f"/api/v1/users/{self.user_id}/messages?format=ndjson")
+
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        lines = [json.loads(line) for line in resp.data.decode().splitlines()]
+        self.assertEqual(6, len(lines))
+        self.assertEqual({"next": None}, lines[-1])
+
+    def test_timeline_requires_login(self):
+        """Is the timeline refused when logged out, and served when logged in?"""
+
+        resp = self.client.get("/api/v1/timeline")
+        self.assertEqual(resp.status_code, 401)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            resp = c.get("/api/v1/timeline")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("items", json.loads(resp.data))
+
+    def test_followers_paging(self):
+        """Are followers paged newest follow first, with when they followed?"""
+
+        start = datetime(2024, 1, 1)
+
+        for i in range(5):
+            u = User(email=f"f{i}@test.com", username=f"follower{i}", password="HASHED_PASSWORD")
+            db.session.add(u)
+            db.session.flush()
+            db.session.add(Follows(user_being_followed_id=self.user_id,
+                                   user_following_id=u.id,
+                                   timestamp=start + timedelta(days=i % 3)))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            url = f"/api/v1/users/{self.user_id}/followers?limit=2"
+            items = []
+
+            while url:
+                data = json.loads(c.get(url).data)
+                items += data["items"]
+                url = data["next"]
+
+        keys = [(item["followed_at"], item["id"]) for item in items]
+        self.assertEqual(5, len(set(keys)))
+        self.assertEqual(sorted(keys, reverse=True), keys)
+
+    def test_like(self):
+        """Does POST toggle a like, and PUT/DELETE set it idempotently?"""
+
+        author = User(email="author@test.com", username="author", password="HASHED_PASSWORD")
+        db.session.add(author)
+        db.session.commit()
+        msg = Message(text="like me", user_id=author.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        message_id = msg.id
+        url = f"/api/v1/messages/{message_id}/like"
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            states = []
+            for method in (c.post, c.post, c.put, c.put, c.delete, c.delete):
+                resp = method(url)
+                self.assertEqual(resp.status_code, 200)
+                states.append(json.loads(resp.data)["liked"])
+
+            self.assertEqual([True, False, True, True, False, False], states)
+            self.assertEqual(0, Likes.query.count())
+            self.assertEqual(0, User.query.get(self.user_id).likes_count)
+
+            resp = c.post("/api/v1/messages/999999/like")
+            self.assertEqual(resp.status_code, 404)
+
+    def test_like_own_message(self):
+        """Are likes of one's own messages refused, by the API and the page?"""
+
+        message_id = Message.query.filter_by(user_id=self.user_id).first().id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            for method in (c.post, c.put):
+                resp = method(f"/api/v1/messages/{message_id}/like")
+                self.assertEqual(resp.status_code, 403)
+
+            resp = c.post(f"/users/add_like/{message_id}", follow_redirects=True)
+            self.assertIn("can&#39;t like your own", resp.data.decode())
+
+        self.assertEqual(0, Likes.query.count())
+        self.assertEqual(0, User.query.get(self.user_id).likes_count)
+
+    def test_follow_bulk(self):
+        """Are bulk follows idempotent, skipping unknown ids and oneself?"""
+
+        others = [User(email=f"o{i}@test.com", username=f"other{i}", password="HASHED_PASSWORD")
+                  for i in range(3)]
+        db.session.add_all(others)
+        db.session.commit()
+        ids = sorted(u.id for u in others)
+        db.session.add_all([Message(text="hi", user_id=id_) for id_ in ids])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            body = {"follow": ids + [self.user_id, 999999]}
+            resp = c.post("/api/v1/following", json=body)
+            self.assertEqual({"followed": ids, "unfollowed": []}, json.loads(resp.data))
+
+            resp = c.post("/api/v1/following", json=body)
+            self.assertEqual({"followed": [], "unfollowed": []}, json.loads(resp.data))
+
+            resp = c.post("/api/v1/following", json={"unfollow": ids[:2]})
+            self.assertEqual(ids[:2], json.loads(resp.data)["unfollowed"])
+
+            resp = c.delete(f"/api/v1/following/{ids[0]}")
+            self.assertEqual(resp.status_code, 200)
+
+            resp = c.post("/api/v1/following", json={"follow": "everyone"})
+            self.assertEqual(resp.status_code, 400)
+
+        user = User.query.get(self.user_id)
+        self.assertEqual(1, user.following_count)
+        self.assertEqual([ids[2]], [u.id for u in user.following])
+        self.assertEqual(1, User.query.get(ids[2]).followers_count)
+        self.assertEqual(0, User.query.get(ids[0]).followers_count)
+        self.assertEqual({ids[2]}, {entry.author_id for entry in
+                                    TimelineEntry.query.filter_by(user_id=self.user_id)})
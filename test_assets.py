@@ -0,0 +1,82 @@
+"""Static asset build tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from flask import Flask
+
+import assets
+
+
+class AssetsTestCase(TestCase):
+    """Test fingerprinting, compression and serving of static files."""
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        static = os.path.join(self.tmp.name, 'static')
+        os.makedirs(os.path.join(static, 'images'))
+
+        with open(os.path.join(static, 'images', 'logo.png'), 'wb') as f:
+            f.write(b'\x89PNG not really')
+        with open(os.path.join(static, 'style.css'), 'w') as f:
+            f.write('body { background: url("/static/images/logo.png"); }\n' * 20)
+
+        self.app = Flask(__name__, static_folder=static)
+        assets.init_app(self.app)
+
+    def tearDown(self):
+        assets.manifest.clear()
+        self.tmp.cleanup()
+
+    def test_build(self):
+        """Are files hashed, CSS rewritten and text gzipped?"""
+
+        built = assets.build_assets(self.app)
+        dist = assets.dist_folder(self.app)
+
+        self.assertRegex(built['style.css'], r'^style\.[0-9a-f]{10}\.css$')
+        self.assertTrue(os.path.exists(os.path.join(dist, built['style.css'] + '.gz')))
+        self.assertFalse(os.path.exists(os.path.join(dist, built['images/logo.png'] + '.gz')))
+
+        with open(os.path.join(dist, built['style.css'])) as f:
+            self.assertIn(f"/static/dist/{built['images/logo.png']}", f.read())
+
+    def test_static_url(self):
+        """Are built files linked by hash, and others left plain?"""
+
+        with self.app.test_request_context():
+            self.assertEqual('/static/style.css', assets.static_url('style.css'))
+
+            built = assets.build_assets(self.app)
+
+            self.assertEqual(f"/static/dist/{built['style.css']}",
+                             assets.static_url('/static/style.css'))
+            self.assertEqual('http://example.com/a.png',
+                             assets.static_url('http://example.com/a.png'))
+
+    def test_serve(self):
+        """Are hashed files immutable, and gzipped for clients that accept it?"""
+
+        built = assets.build_assets(self.app)
+        url = f"/static/dist/{built['style.css']}"
+
+        with self.app.test_client() as c:
+            resp = c.get(url, headers={'Accept-Encoding': 'gzip'})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual('gzip', resp.headers['Content-Encoding'])
+            self.assertEqual('text/css', resp.mimetype)
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            self.assertIn(b'background', gzip.decompress(resp.data))
+            resp.close()
+
+            resp = c.get(url)
+            self.assertNotIn('Content-Encoding', resp.headers)
+            resp.close()
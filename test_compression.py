@@ -0,0 +1,81 @@
+"""Response compression tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_compression.py
+
+
+import gzip
+from unittest import TestCase
+
+from flask import Flask, Response
+
+import compression
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config['COMPRESS_MIN_SIZE'] = 100
+    compression.init_app(app)
+
+    @app.route('/big')
+    def big():
+        return "<p>warble</p>" * 100
+
+    @app.route('/small')
+    def small():
+        return "<p>warble</p>"
+
+    @app.route('/stream')
+    def stream():
+        return Response((f'{{"n": {i}}}\n' for i in range(1000)),
+                        mimetype='application/x-ndjson')
+
+    @app.route('/image')
+    def image():
+        return Response(b"\x89PNG" * 100, mimetype='image/png')
+
+    return app
+
+
+class CompressionTestCase(TestCase):
+    """Test which responses are gzipped, and how."""
+
+    def setUp(self):
+        compression.stats.clear()
+        self.client = make_app().test_client()
+
+    def get(self, url, encoding='gzip'):
+        return self.client.get(url, headers={'Accept-Encoding': encoding})
+
+    def test_compress(self):
+        """Are large text responses gzipped and counted?"""
+
+        resp = self.get('/big')
+
+        self.assertEqual('gzip', resp.headers['Content-Encoding'])
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual("<p>warble</p>" * 100, gzip.decompress(resp.data).decode())
+
+        totals = compression.stats.snapshot()['big']
+        self.assertEqual(1, totals['responses'])
+        self.assertGreater(totals['saved'], 0)
+
+    def test_skipped(self):
+        """Are small bodies, binary types and identity-only clients left alone?"""
+
+        self.assertNotIn('Content-Encoding', self.get('/small').headers)
+        self.assertNotIn('Content-Encoding', self.get('/image').headers)
+        self.assertNotIn('Content-Encoding', self.get('/big', 'identity').headers)
+
+    def test_stream(self):
+        """Are streamed responses gzipped as a whole?"""
+
+        resp = self.get('/stream')
+
+        self.assertEqual('gzip', resp.headers['Content-Encoding'])
+        self.assertNotIn('Content-Length', resp.headers)
+
+        lines = gzip.decompress(resp.data).decode().splitlines()
+        self.assertEqual(1000, len(lines))
+        self.assertEqual('{"n": 999}', lines[-1])
@@ -0,0 +1,66 @@
+"""Message fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+from unittest import TestCase
+
+from fragments import LRUBackend, SharedBackend
+
+
+class FakeRedis:
+    """Just enough of a Redis client for SharedBackend."""
+
+    def __init__(self):
+        self.data = {}
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test the fragment cache backends."""
+
+    def test_lru_bounded(self):
+        """Is the least recently used fragment dropped when full?"""
+
+        cache = LRUBackend(maxsize=2)
+        cache.set('message:1', 'one')
+        cache.set('message:2', 'two')
+        cache.get_many(['message:1'])
+        cache.set('message:3', 'three')
+
+        self.assertEqual({'message:1': 'one', 'message:3': 'three'},
+                         cache.get_many(['message:1', 'message:2', 'message:3']))
+
+    def test_lru_delete_tag(self):
+        """Are all of an author's fragments dropped together?"""
+
+        cache = LRUBackend()
+        cache.set('message:1', 'one', tag='author:1')
+        cache.set('message:2', 'two', tag='author:1')
+        cache.set('message:3', 'three', tag='author:2')
+
+        cache.delete_tag('author:1')
+
+        self.assertEqual({'message:3': 'three'},
+                         cache.get_many(['message:1', 'message:2', 'message:3']))
+
+    def test_shared(self):
+        """Can fragments be stored, read and deleted on a shared client?"""
+
+        cache = SharedBackend(FakeRedis())
+        cache.set('message:1', 'one')
+
+        self.assertEqual({'message:1': 'one'}, cache.get_many(['message:1', 'message:2']))
+
+        cache.delete('message:1')
+        self.assertEqual({}, cache.get_many(['message:1']))
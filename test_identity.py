@@ -0,0 +1,69 @@
+"""Current-user cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_identity.py
+
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from identity import IdentityCache, LazyGlobals
+
+
+class IdentityCacheTestCase(TestCase):
+    """Test the bounded, expiring user cache."""
+
+    def test_get_set_invalidate(self):
+        """Are cached values returned until invalidated?"""
+
+        cache = IdentityCache()
+        cache.set(1, {'id': 1, 'username': 'testuser'})
+
+        self.assertEqual('testuser', cache.get(1)['username'])
+
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+
+    def test_bounded(self):
+        """Is the least recently used entry dropped when full?"""
+
+        cache = IdentityCache(maxsize=2)
+        cache.set(1, {'id': 1})
+        cache.set(2, {'id': 2})
+        cache.get(1)
+        cache.set(3, {'id': 3})
+
+        self.assertIsNotNone(cache.get(1))
+        self.assertIsNone(cache.get(2))
+        self.assertIsNotNone(cache.get(3))
+
+    def test_ttl(self):
+        """Do entries expire after the TTL?"""
+
+        cache = IdentityCache(ttl=30)
+
+        with patch('identity.monotonic', return_value=100):
+            cache.set(1, {'id': 1})
+
+        with patch('identity.monotonic', return_value=129):
+            self.assertIsNotNone(cache.get(1))
+
+        with patch('identity.monotonic', return_value=131):
+            self.assertIsNone(cache.get(1))
+
+
+class LazyGlobalsTestCase(TestCase):
+    """Test lazily computed `g` attributes."""
+
+    def test_get_runs_loader(self):
+        """Do `g.get` and `in` see an attribute that hasn't been loaded yet?"""
+
+        g = LazyGlobals()
+        g.set_lazy('user', lambda: 'alice')
+
+        self.assertIn('user', g)
+        self.assertEqual('alice', g.get('user'))
+        self.assertEqual('alice', g.user)
+        self.assertIsNone(g.get('missing'))
+        self.assertNotIn('missing', g)
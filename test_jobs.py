@@ -0,0 +1,126 @@
+"""Background job queue tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, Job
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import jobs
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+ran = []
+
+
+@jobs.handler
+def record(value):
+    ran.append(value)
+
+
+@jobs.handler
+def explode():
+    raise ValueError("boom")
+
+
+class JobQueueTestCase(TestCase):
+    """Test queueing, claiming, retrying and reporting jobs."""
+
+    def setUp(self):
+        Job.query.delete()
+        db.session.commit()
+        ran.clear()
+        jobs.stats.clear()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+        self.saved_config = {key: app.config[key] for key in
+                             ('JOBS_INLINE', 'JOB_WORKERS', 'JOB_MAX_ATTEMPTS')}
+        app.config.update(JOBS_INLINE=False, JOB_WORKERS=0, JOB_MAX_ATTEMPTS=2)
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config.update(self.saved_config)
+        self.ctx.pop()
+
+    def test_runs_in_order_once(self):
+        """Do queued jobs run oldest first, and only once?"""
+
+        jobs.enqueue(record, 1)
+        jobs.enqueue(record, 2)
+        db.session.commit()
+
+        self.assertEqual({'due': 2, 'scheduled': 0, 'failed': 0},
+                         {k: v for k, v in jobs.queue_stats().items() if k != 'oldest_wait'})
+
+        self.assertEqual(2, jobs.run_pending())
+        self.assertEqual(0, jobs.run_pending())
+        self.assertEqual([1, 2], ran)
+        self.assertEqual(2, jobs.stats.snapshot()['test_jobs.record']['jobs'])
+
+    def test_rollback_drops_job(self):
+        """Is a job enqueued in a rolled-back transaction never run?"""
+
+        jobs.enqueue(record, 1)
+        db.session.rollback()
+
+        self.assertEqual(0, jobs.run_pending())
+
+    def test_retry_then_fail(self):
+        """Is a failing job retried after a delay, then kept as failed?"""
+
+        jobs.enqueue(explode)
+        db.session.commit()
+
+        self.assertEqual(1, jobs.run_pending())
+        job = Job.query.one()
+        self.assertEqual(1, job.attempts)
+        self.assertIn("boom", job.last_error)
+        self.assertGreater(job.run_at, datetime.utcnow())
+        self.assertEqual(1, jobs.queue_stats()['scheduled'])
+
+        # Pretend the retry delay has passed.
+        job.run_at = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+
+        self.assertEqual(1, jobs.run_pending())
+        job = Job.query.one()
+        self.assertEqual(2, job.attempts)
+        self.assertIsNotNone(job.failed_at)
+        self.assertEqual(0, jobs.run_pending())
+        self.assertEqual(1, jobs.queue_stats()['failed'])
+
+    def test_inline(self):
+        """With JOBS_INLINE, does enqueue just run the job?"""
+
+        app.config['JOBS_INLINE'] = True
+        jobs.enqueue(record, 3)
+
+        self.assertEqual([3], ran)
+        self.assertEqual(0, Job.query.count())
+
+    def test_unregistered(self):
+        """Are only registered handlers accepted?"""
+
+        with self.assertRaises(ValueError):
+            jobs.enqueue(print, "hi")
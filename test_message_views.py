@@ -21,6 +21,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+import search
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -32,6 +33,12 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Run background jobs (timeline fan-out...) right away, in the request.
+app.config['JOBS_INLINE'] = True
+
+# Report SQL statements per request so tests can bound them
+app.config['SQL_STATEMENTS_HEADER'] = True
+
 
 class MessageViewTestCase(TestCase):
     """Test views for messages."""
@@ -129,4 +136,68 @@ class MessageViewTestCase(TestCase):
             self.assertIn("Access unauthorized", str(resp.data))
 
             m = Message.query.get(1234)
-            self.assertIsNotNone(m)
\ No newline at end of file
+            self.assertIsNotNone(m)
+
+    def test_show_message_query_count(self):
+        """Does the message page load its author with the message?"""
+
+        msg = Message(text="Hello", user_id=self.testuser_id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/messages/{msg_id}")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertLessEqual(int(resp.headers["X-SQL-Statements"]), 3)
+
+    def test_show_message_not_modified(self):
+        """Is an unchanged message answered with 304, and a changed one rendered?"""
+
+        msg = Message(text="Hello", user_id=self.testuser_id)
+        db.session.add(msg)
+        db.session.commit()
+        msg_id = msg.id
+
+        resp = self.client.get(f"/messages/{msg_id}")
+        etag = resp.headers["ETag"].strip('"')
+
+        resp = self.client.get(f"/messages/{msg_id}",
+                               headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(b"", resp.data)
+
+        user = User.query.get(self.testuser_id)
+        user.username = "renamed"
+        db.session.commit()
+
+        resp = self.client.get(f"/messages/{msg_id}",
+                               headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@renamed", str(resp.data))
+
+    def test_search_paging_with_tied_ranks(self):
+        """Does paging through equally ranked results visit each once, then stop?"""
+
+        # Rebuild the in-process index (used off Postgres) from this test's rows.
+        search.message_index = None
+
+        db.session.add_all([Message(text="zeppelin sighted", user_id=self.testuser_id)
+                            for i in range(7)])
+        db.session.commit()
+        expected = {msg.id for msg in Message.query}
+
+        seen = []
+        url = "/messages/search?q=zeppelin&limit=2&format=json"
+        while url and len(seen) <= len(expected):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            seen += [item["id"] for item in resp.json["items"]]
+            url = resp.json["older"]
+
+        self.assertEqual(len(expected), len(seen))
+        self.assertEqual(expected, set(seen))
@@ -0,0 +1,79 @@
+"""Keyset pagination tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pagination.py
+
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from unittest import TestCase
+from urllib.parse import parse_qs, urlsplit
+
+from flask import Flask
+from werkzeug.exceptions import BadRequest
+
+from pagination import build_page, decode_cursor, encode_cursor, page_url
+
+Row = namedtuple('Row', ['timestamp', 'id'])
+
+START = datetime(2020, 1, 1, 12, 30, 15, 123456)
+
+
+def rows(*ids):
+    return [Row(START + timedelta(minutes=i), i) for i in ids]
+
+
+class PaginationTestCase(TestCase):
+    """Test cursors and page building."""
+
+    def test_cursor_round_trip(self):
+        """Does a cursor decode back to the key it was made from?"""
+
+        key = (START, 42)
+        self.assertEqual(key, decode_cursor(encode_cursor(key)))
+
+    def test_bad_cursor(self):
+        """Is a garbage cursor a 400?"""
+
+        with self.assertRaises(BadRequest):
+            decode_cursor("not-a-cursor")
+
+    def test_first_page(self):
+        """Does the first page only link to older rows when there are more?"""
+
+        page = build_page(rows(5, 4, 3), limit=2)
+
+        self.assertEqual([5, 4], [row.id for row in page])
+        self.assertEqual((START + timedelta(minutes=4), 4), decode_cursor(page.older))
+        self.assertIsNone(page.newer)
+
+        last = build_page(rows(2, 1), limit=2)
+        self.assertIsNone(last.older)
+
+    def test_newer_page(self):
+        """Are rows fetched `after` a cursor returned newest first?"""
+
+        after = (START, 0)
+        page = build_page(rows(1, 2, 3), after=after, limit=2)
+
+        self.assertEqual([2, 1], [row.id for row in page])
+        self.assertIsNotNone(page.newer)
+        self.assertIsNotNone(page.older)
+
+    def test_page_url_drops_unknown_args(self):
+        """Can crafted query arguments (url_for's _scheme/_external, a view
+        argument) change where the pager link goes?"""
+
+        app = Flask(__name__)
+        app.add_url_rule('/users/<int:user_id>', 'users_show', lambda user_id: '')
+
+        query = ("_external=1&_scheme=javascript&x=%0aalert(1)&user_id=5"
+                 "&q=hi&limit=2&before=old")
+
+        with app.test_request_context(f"/users/3?{query}"):
+            url = urlsplit(page_url(before="new"))
+
+        self.assertEqual(("", "", "/users/3"), (url.scheme, url.netloc, url.path))
+        self.assertEqual({"q": ["hi"], "limit": ["2"], "before": ["new"]},
+                         parse_qs(url.query))
@@ -0,0 +1,75 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+from threading import Thread
+from time import sleep
+from unittest import TestCase
+
+import passwords
+from passwords import PasswordPool, PasswordWorkUnavailable
+
+
+class PasswordTestCase(TestCase):
+    """Test hashing, checking and the bounded pool."""
+
+    def setUp(self):
+        passwords.password_pool.configure(size=0, log_rounds=4)
+
+    def tearDown(self):
+        passwords.password_pool.configure(size=0)
+
+    def test_hash_and_check(self):
+        """Does a hash match its password and nothing else?"""
+
+        hashed = passwords.hash_password("secret")
+
+        self.assertTrue(passwords.check_password(hashed, "secret"))
+        self.assertFalse(passwords.check_password(hashed, "wrong"))
+        self.assertFalse(passwords.check_password("not a hash", "secret"))
+
+    def test_needs_rehash(self):
+        """Are hashes made at another cost flagged for upgrade?"""
+
+        hashed = passwords.hash_password("secret")
+        self.assertFalse(passwords.needs_rehash(hashed))
+
+        passwords.password_pool.log_rounds = 5
+        self.assertTrue(passwords.needs_rehash(hashed))
+
+    def test_pool(self):
+        """Does work run in worker processes?"""
+
+        pool = PasswordPool(size=1, log_rounds=4)
+        try:
+            hashed = pool.run(passwords._hash, "secret", 4)
+            self.assertTrue(pool.run(passwords._check, hashed, "secret"))
+        finally:
+            pool.shutdown()
+
+    def test_queue_full(self):
+        """Is work refused once the queue is full?"""
+
+        pool = PasswordPool(size=1, queue_depth=1, timeout=5)
+        busy = Thread(target=pool.run, args=(sleep, 1))
+        try:
+            busy.start()
+            sleep(0.2)
+            with self.assertRaises(PasswordWorkUnavailable):
+                pool.run(sleep, 0)
+        finally:
+            busy.join()
+            pool.shutdown()
+
+    def test_timeout(self):
+        """Does slow work give up after the timeout?"""
+
+        pool = PasswordPool(size=1, timeout=0.1)
+        try:
+            with self.assertRaises(PasswordWorkUnavailable):
+                pool.run(sleep, 1)
+        finally:
+            pool.shutdown()
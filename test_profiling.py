@@ -0,0 +1,74 @@
+"""SQL profiling tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_profiling.py
+
+
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+import profiling
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config.update(config)
+    profiling.init_app(app)
+
+    engine = create_engine('sqlite://')
+
+    @app.route('/')
+    def index():
+        with engine.connect() as conn:
+            conn.execute(text("SELECT :n"), n=1)
+            conn.execute(text("SELECT :a, :b"), a="x", b=2.5)
+        return "ok"
+
+    return app
+
+
+class ProfilingTestCase(TestCase):
+    """Test statement counts, Server-Timing and the slow-query log."""
+
+    def test_server_timing(self):
+        """Are sampled requests' DB time and query count reported?"""
+
+        app = make_app(SQL_PROFILE_SAMPLE_RATE=1, SQL_STATEMENTS_HEADER=True)
+        resp = app.test_client().get('/')
+
+        self.assertEqual("2", resp.headers[profiling.SQL_STATEMENTS_HEADER])
+        self.assertRegex(resp.headers['Server-Timing'], r'^db;dur=[\d.]+;desc="2 queries"$')
+
+    def test_unsampled(self):
+        """Are unsampled requests left untimed?"""
+
+        app = make_app(SQL_PROFILE_SAMPLE_RATE=0)
+        resp = app.test_client().get('/')
+
+        self.assertNotIn('Server-Timing', resp.headers)
+
+    def test_slow_query_log(self):
+        """Are slow statements logged with their route and parameter types?"""
+
+        app = make_app(SQL_PROFILE_SAMPLE_RATE=1, SLOW_QUERY_MS=0)
+
+        with self.assertLogs('warbler.sql') as logs:
+            app.test_client().get('/')
+
+        self.assertEqual(2, len(logs.output))
+        self.assertIn("GET / (index)", logs.output[1])
+        self.assertIn("str, float", logs.output[1])
+        self.assertNotIn("'x'", logs.output[1])
+
+    def test_add_server_timing(self):
+        """Are metrics appended to an existing Server-Timing header?"""
+
+        resp = Flask(__name__).response_class()
+        profiling.add_server_timing(resp, 'search', 0.0125)
+        profiling.add_server_timing(resp, 'db', 0.002, "1 queries")
+
+        self.assertEqual('search;dur=12.50, db;dur=2.00;desc="1 queries"',
+                         resp.headers['Server-Timing'])
@@ -0,0 +1,153 @@
+"""Query plan regression tests.
+
+These seed a large dataset and EXPLAIN every query the feed and follow
+pages issue, failing if any of them falls back to a sequential scan.
+Seeding takes a while, so they only run when asked for:
+
+    WARBLER_EXPLAIN_TESTS=1 python -m unittest test_query_plans.py
+"""
+
+
+import os
+from unittest import TestCase, skipUnless
+
+from sqlalchemy import text
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+from profiling import capture_queries, explain, sequential_scans
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# Run background jobs (timeline fan-out...) right away, in the request.
+app.config['JOBS_INLINE'] = True
+
+NUM_USERS = 20000
+MESSAGES_PER_USER = 20
+FOLLOWS_PER_USER = 20
+NUM_LIKES = 100000
+
+SEED_SQL = [
+    "TRUNCATE users, messages, follows, likes, timelines RESTART IDENTITY CASCADE",
+
+    """INSERT INTO users (email, username, password, image_url, header_image_url)
+       SELECT 'user' || i || '@test.com', 'user' || i, 'HASHED_PASSWORD',
+              '/static/images/default-pic.png', '/static/images/warbler-hero.jpg'
+       FROM generate_series(1, :users) i""",
+
+    """INSERT INTO messages (text, timestamp, user_id)
+       SELECT 'message ' || i, now() - (i || ' seconds')::interval, 1 + (i % :users)
+       FROM generate_series(1, :users * :messages_per_user) i""",
+
+    """INSERT INTO follows (user_being_followed_id, user_following_id)
+       SELECT 1 + ((u + k * 7919) % :users), u
+       FROM generate_series(1, :users) u, generate_series(1, :follows_per_user) k
+       ON CONFLICT DO NOTHING""",
+
+    """INSERT INTO likes (user_id, message_id)
+       SELECT 1 + (i % :users), i
+       FROM generate_series(1, :likes) i""",
+
+    """INSERT INTO pulled_authors (user_id)
+       SELECT i FROM generate_series(1, 10) i""",
+
+    """INSERT INTO timelines (user_id, message_id, author_id, timestamp)
+       SELECT f.user_following_id, m.id, m.user_id, m.timestamp
+       FROM follows f JOIN messages m ON m.user_id = f.user_being_followed_id
+       WHERE f.user_following_id <= 100
+       ON CONFLICT DO NOTHING""",
+]
+
+ANALYZE_SQL = "ANALYZE users; ANALYZE messages; ANALYZE follows; ANALYZE likes; ANALYZE timelines"
+
+VIEWER_ID = 1
+
+# Tables small by design, which are fine to read whole.
+SMALL_TABLES = {'pulled_authors'}
+PROFILE_ID = 2
+
+
+@skipUnless(os.environ.get('WARBLER_EXPLAIN_TESTS'),
+            "set WARBLER_EXPLAIN_TESTS=1 to run query plan tests")
+class QueryPlanTestCase(TestCase):
+    """EXPLAIN the queries behind the feed and follow pages."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Seed a dataset big enough that the planner prefers indexes."""
+
+        params = dict(users=NUM_USERS,
+                      messages_per_user=MESSAGES_PER_USER,
+                      follows_per_user=FOLLOWS_PER_USER,
+                      likes=NUM_LIKES)
+
+        with app.app_context():
+            for statement in SEED_SQL:
+                db.session.execute(text(statement), params)
+            reconcile_counters()
+            db.session.commit()
+
+        with db.engine.connect() as conn:
+            conn.execute(ANALYZE_SQL)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Leave an empty database for the other test modules."""
+
+        db.session.execute(SEED_SQL[0])
+        db.session.commit()
+
+    def setUp(self):
+        self.client = app.test_client()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = VIEWER_ID
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def assert_no_sequential_scans(self, url):
+        """GET `url` and EXPLAIN every SELECT it ran."""
+
+        with capture_queries(db.engine) as queries:
+            resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, 200)
+
+        selects = [(statement, parameters) for statement, parameters in queries
+                   if statement.lstrip().upper().startswith('SELECT')]
+        self.assertTrue(selects)
+
+        for statement, parameters in selects:
+            scans = [name for name in sequential_scans(explain(db.engine, statement, parameters))
+                     if name not in SMALL_TABLES]
+            self.assertEqual([], scans, f"{url} seq scans {scans}:\n{statement}")
+
+    def test_homepage(self):
+        self.assert_no_sequential_scans("/")
+
+    def test_users_show(self):
+        self.assert_no_sequential_scans(f"/users/{PROFILE_ID}")
+
+    def test_show_following(self):
+        self.assert_no_sequential_scans(f"/users/{PROFILE_ID}/following")
+
+    def test_users_followers(self):
+        self.assert_no_sequential_scans(f"/users/{PROFILE_ID}/followers")
+
+    def test_show_likes(self):
+        self.assert_no_sequential_scans(f"/users/{PROFILE_ID}/likes")
@@ -0,0 +1,78 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+from unittest import TestCase
+
+from search import (InvertedIndex, NgramIndex, decode_rank_cursor,
+                    encode_rank_cursor, escape_like, similarity)
+
+
+class NgramIndexTestCase(TestCase):
+    """Test the in-process username index."""
+
+    def setUp(self):
+        self.index = NgramIndex()
+        for id_, name in enumerate(["alice", "malice", "bob", "alicia"], start=1):
+            self.index.add(id_, name)
+
+    def test_substring_match(self):
+        """Are all usernames containing the query found, best first?"""
+
+        self.assertEqual([1, 4, 2], self.index.search("ali"))
+        self.assertEqual([3], self.index.search("OB"))
+        self.assertEqual([], self.index.search("zzz"))
+
+    def test_short_query(self):
+        """Do queries shorter than a trigram still match?"""
+
+        self.assertEqual({1, 2, 4}, set(self.index.search("l")))
+
+    def test_update_and_remove(self):
+        """Are renamed and removed users reflected?"""
+
+        self.index.add(3, "bobalina")
+        self.index.remove(1)
+
+        self.assertEqual({2, 3, 4}, set(self.index.search("ali")))
+        self.assertEqual([3], self.index.search("bob"))
+
+    def test_similarity(self):
+        self.assertEqual(1.0, similarity("alice", "ALICE"))
+        self.assertGreater(similarity("ali", "alice"), similarity("ali", "malice"))
+
+    def test_escape_like(self):
+        self.assertEqual("50\\%\\_off", escape_like("50%_off"))
+
+
+class InvertedIndexTestCase(TestCase):
+    """Test the in-process message index."""
+
+    def setUp(self):
+        self.index = InvertedIndex()
+        self.index.add(1, "I love the sea")
+        self.index.add(2, "sea sea sea and sky")
+        self.index.add(3, "The mountain")
+
+    def test_all_words_must_match(self):
+        """Are only messages containing every query word returned?"""
+
+        self.assertEqual([1], [id_ for score, id_ in self.index.search("love SEA")])
+        self.assertEqual([], self.index.search("love mountain"))
+        self.assertEqual([], self.index.search("the"))
+
+    def test_ranking(self):
+        """Do messages using a word more often rank higher?"""
+
+        self.assertEqual([2, 1], [id_ for score, id_ in self.index.search("sea")])
+
+    def test_remove(self):
+        self.index.remove(2)
+        self.assertEqual([1], [id_ for score, id_ in self.index.search("sea")])
+
+    def test_rank_cursor_round_trip(self):
+        key = (0.0607927, 42)
+        self.assertEqual(key, decode_rank_cursor(encode_rank_cursor(key)))
@@ -0,0 +1,185 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timelines.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follows, PulledAuthor, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app
+import counters
+import jobs
+import timelines
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.create_all()
+
+# Run background jobs (timeline fan-out...) right away, in the request.
+app.config['JOBS_INLINE'] = True
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out, backfill and reads of home timelines."""
+
+    def setUp(self):
+        """Create two users, u1 following u2."""
+
+        TimelineEntry.query.delete()
+        PulledAuthor.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        User.query.delete()
+
+        self.ctx = app.app_context()
+        self.ctx.push()
+        app.config['TIMELINE_DEPTH'] = 800
+        app.config['TIMELINE_FANOUT_LIMIT'] = 10000
+
+        self.u1 = User(email="u1@test.com", username="u1", password="HASHED_PASSWORD")
+        self.u2 = User(email="u2@test.com", username="u2", password="HASHED_PASSWORD")
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+
+        self.u1.following.append(self.u2)
+        db.session.flush()
+        counters.followed_many(self.u1.id, [self.u2.id])
+        db.session.commit()
+
+    def tearDown(self):
+        """Roll back the transaction to keep the database clean. """
+        db.session.rollback()
+        self.ctx.pop()
+
+    def post(self, user, text):
+        msg = Message(text=text, user_id=user.id)
+        db.session.add(msg)
+        db.session.flush()
+        timelines.add_own_message(msg)
+        jobs.enqueue(timelines.fan_out, msg.id)
+        db.session.commit()
+        return msg
+
+    def test_fan_out(self):
+        """Is a new message written to the author's and followers' timelines?"""
+
+        msg = self.post(self.u2, "hello")
+
+        self.assertEqual([msg.id], [m.id for m in timelines.home_timeline(self.u1).items])
+        self.assertEqual([msg.id], [m.id for m in timelines.home_timeline(self.u2).items])
+
+    def test_trim(self):
+        """Are timelines kept to TIMELINE_DEPTH entries?"""
+
+        app.config['TIMELINE_DEPTH'] = 2
+        for i in range(4):
+            self.post(self.u2, f"msg {i}")
+
+        self.assertEqual(2, TimelineEntry.query.filter_by(user_id=self.u1.id).count())
+
+    def test_unfollow_and_backfill(self):
+        """Does unfollowing remove entries and refollowing backfill them?"""
+
+        msg = self.post(self.u2, "hello")
+
+        timelines.remove_follows(self.u1.id, [self.u2.id])
+        db.session.commit()
+        self.assertEqual([], timelines.home_timeline(self.u1).items)
+
+        timelines.backfill_follow(self.u1.id, self.u2.id)
+        db.session.commit()
+        self.assertEqual([msg.id], [m.id for m in timelines.home_timeline(self.u1).items])
+
+    def test_high_follower_merged_on_read(self):
+        """Are messages of high-follower authors merged at read time?"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        own = self.post(self.u1, "mine")
+        theirs = self.post(self.u2, "popular")
+
+        self.assertEqual(0, TimelineEntry.query.filter_by(user_id=self.u1.id,
+                                                          message_id=theirs.id).count())
+        self.assertEqual({own.id, theirs.id},
+                         {m.id for m in timelines.home_timeline(self.u1).items})
+
+    def test_read_time_merge_skips_unpulled_follows(self):
+        """Does the feed merge only the pulled authors its reader follows?"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        self.post(self.u2, "popular")
+
+        self.assertEqual([self.u2.id], [author_id for (author_id,) in db.session.execute(
+            timelines.pulled_followed_by(self.u1.id))])
+        self.assertEqual([], list(db.session.execute(
+            timelines.pulled_followed_by(self.u2.id))))
+
+    def test_dropping_below_limit_backfills_followers(self):
+        """When a pulled author falls below half the limit, are the messages
+        they posted while pulled copied into their followers' timelines?"""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        pulled = self.post(self.u2, "while popular")
+
+        # Between half the limit and the limit: still pulled.
+        app.config['TIMELINE_FANOUT_LIMIT'] = 2
+        middle = self.post(self.u2, "still popular")
+        self.assertTrue(timelines.is_fanned_out_on_read(self.u2.id))
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 4
+        pushed = self.post(self.u2, "not any more")
+
+        self.assertIsNone(PulledAuthor.query.get(self.u2.id))
+        self.assertEqual({pulled.id, middle.id, pushed.id},
+                         {entry.message_id for entry in
+                          TimelineEntry.query.filter_by(user_id=self.u1.id)})
+
+        after = self.post(self.u2, "fanned out")
+        self.assertEqual(1, TimelineEntry.query.filter_by(user_id=self.u1.id,
+                                                          message_id=after.id).count())
+
+    def test_rebuild_all_timelines(self):
+        """Are timelines rebuilt batch by batch, newest TIMELINE_DEPTH first,
+        without pulled authors?"""
+
+        u3 = User(email="u3@test.com", username="u3", password="HASHED_PASSWORD")
+        db.session.add(u3)
+        db.session.commit()
+        self.u1.following.append(u3)
+        # Self-follows exist in seeded data; they mustn't list messages twice.
+        self.u1.following.append(self.u1)
+        db.session.commit()
+
+        app.config['TIMELINE_DEPTH'] = 3
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        popular = self.post(self.u2, "popular")
+        msgs = [self.post(u3, f"msg {i}") for i in range(4)]
+        own = self.post(self.u1, "mine")
+        TimelineEntry.query.delete()
+        db.session.commit()
+
+        self.assertEqual(3, timelines.rebuild_all_timelines(batch_size=2))
+
+        self.assertEqual([own.id, msgs[3].id, msgs[2].id],
+                         [entry.message_id for entry in (TimelineEntry.query
+                                                         .filter_by(user_id=self.u1.id)
+                                                         .order_by(TimelineEntry.timestamp.desc(),
+                                                                   TimelineEntry.message_id.desc()))])
+        self.assertEqual({popular.id}, {entry.message_id for entry in
+                                        TimelineEntry.query.filter_by(user_id=self.u2.id)})
+        self.assertEqual(3, TimelineEntry.query.filter_by(user_id=u3.id).count())
@@ -22,6 +22,8 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app
+from counters import reconcile_counters
+from profiling import capture_queries
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -139,6 +141,73 @@ class UserModelTestCase(TestCase):
         self.assertEqual(True, user1.is_followed_by(user2))
         self.assertEqual(False, user2.is_followed_by(user1))
 
+    def test_load_follow_state(self):
+        """After load_follow_state, do is_following and
+        is_followed_by answer without another query?"""
+
+        user1 = User(
+            email="test1@test.com",
+            username="testuser1",
+            password="HASHED_PASSWORD"
+        )
+
+        user2 = User(
+            email="test2@test.com",
+            username="testuser2",
+            password="HASHED_PASSWORD"
+        )
+
+        db.session.add_all([user1, user2])
+        db.session.commit()
+
+        db.session.add(Follows(
+            user_being_followed_id=user2.id,
+            user_following_id=user1.id))
+        db.session.commit()
+
+        user1.load_follow_state([user2])
+
+        with capture_queries(db.engine) as queries:
+            self.assertEqual(True, user1.is_following(user2))
+            self.assertEqual(False, user1.is_followed_by(user2))
+
+        self.assertEqual([], queries)
+
+    def test_reconcile_counters(self):
+        """Does reconcile_counters recompute stored counts
+        from the follows and messages tables?"""
+
+        user1 = User(
+            email="test1@test.com",
+            username="testuser1",
+            password="HASHED_PASSWORD"
+        )
+
+        user2 = User(
+            email="test2@test.com",
+            username="testuser2",
+            password="HASHED_PASSWORD"
+        )
+
+        db.session.add_all([user1, user2])
+        db.session.commit()
+
+        db.session.add(Follows(
+            user_being_followed_id=user2.id,
+            user_following_id=user1.id))
+        db.session.add(Message(text="Hello", user_id=user2.id))
+        db.session.commit()
+
+        self.assertEqual(0, user2.followers_count)
+
+        reconcile_counters()
+        db.session.commit()
+
+        self.assertEqual(1, user1.following_count)
+        self.assertEqual(1, user2.followers_count)
+        self.assertEqual(1, user2.messages_count)
+        self.assertEqual(0, user1.messages_count)
+
     def test_User_create_non_null_email(self):
         """Does User.create fail to create a new user
         if any of the validations (e.g. uniqueness,
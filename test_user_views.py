@@ -6,9 +6,10 @@
 
 
 import os
+import re
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Likes
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -21,6 +22,9 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+import identity
+import search
+import timelines
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -32,6 +36,12 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Run background jobs (timeline fan-out...) right away, in the request.
+app.config['JOBS_INLINE'] = True
+
+# Report SQL statements per request so tests can bound them
+app.config['SQL_STATEMENTS_HEADER'] = True
+
 
 class UserViewTestCase(TestCase):
     """Test views for users."""
@@ -42,6 +52,9 @@ class UserViewTestCase(TestCase):
         User.query.delete()
         Message.query.delete()
 
+        # Forget cached profiles of the users just deleted.
+        identity.user_cache.clear()
+
         self.client = app.test_client()
 
         self.testuser = User.signup(username="testuser",
@@ -83,6 +96,32 @@ class UserViewTestCase(TestCase):
             # Make sure it's successful
             self.assertEqual(resp.status_code, 200)
 
+    def test_user_search_paging(self):
+        """Does paging through equally ranked users visit each once, with
+        links that crafted query arguments can't redirect?"""
+
+        # Rebuild the in-process index (used off Postgres) from this test's rows.
+        search.username_index = None
+
+        db.session.add_all([User(email=f"tie{i:02}@test.com", username=f"tie{i:02}",
+                                 password="password")
+                            for i in range(search.USERS_PER_PAGE * 2 + 5)])
+        db.session.commit()
+
+        seen = []
+        for page in range(1, 4):
+            resp = self.client.get(f"/users?q=tie&page={page}"
+                                   "&_external=1&_scheme=javascript&user_id=1")
+            self.assertEqual(resp.status_code, 200)
+
+            html = resp.data.decode()
+            seen += re.findall(r"<p>@(tie\d+)</p>", html)
+            for link in re.findall(r'class="page-link" href="([^"]*)"', html):
+                self.assertTrue(link == "#" or link.startswith("/users?"), link)
+
+        self.assertEqual(search.USERS_PER_PAGE * 2 + 5, len(seen))
+        self.assertEqual(len(seen), len(set(seen)))
+
     def test_not_show_logout(self):
         """When you're logged out, are you disallowed
         from visitn a user's follower/following pages?"""
@@ -170,4 +209,167 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.location, f"http://localhost/users/{self.testuser.id}")
 
             msg = Message.query.one()
-            self.assertEqual(self.testuser.id, msg.user.id)
\ No newline at end of file
+            self.assertEqual(self.testuser.id, msg.user.id)
+
+    def test_homepage_query_count(self):
+        """Does the home timeline load message authors without
+        one query per message?"""
+
+        for i in range(3):
+            u = User(email=f"author{i}@test.com", username=f"author{i}", password="password")
+            db.session.add(u)
+            db.session.commit()
+
+            self.testuser.following.append(u)
+            db.session.add_all([Message(text="one", user_id=u.id),
+                                Message(text="two", user_id=u.id)])
+            db.session.commit()
+
+        testuser_id = self.testuser.id
+
+        with app.app_context():
+            timelines.rebuild_timelines([testuser_id])
+            db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = testuser_id
+
+            resp = c.get("/")
+
+            # five to render, plus one for the conditional GET validators
+            self.assertEqual(resp.status_code, 200)
+            self.assertLessEqual(int(resp.headers["X-SQL-Statements"]), 6)
+
+            resp = c.get("/", headers={"If-None-Match": resp.headers["ETag"]})
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertLessEqual(int(resp.headers["X-SQL-Statements"]), 3)
+
+    def test_homepage_etag_tracks_authors(self):
+        """Does the home feed's ETag change when a followed author edits their
+        profile, and is If-Modified-Since alone never answered with 304?"""
+
+        author = User.signup(username="author", email="author@test.com",
+                             password="password", image_url=None)
+        db.session.commit()
+        self.testuser.following.append(author)
+        db.session.add(Message(text="hello", user_id=author.id))
+        db.session.commit()
+
+        testuser_id, author_id = self.testuser.id, author.id
+
+        with app.app_context():
+            timelines.rebuild_timelines([testuser_id])
+            db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = testuser_id
+
+            resp = c.get("/")
+            etag = resp.headers["ETag"]
+            self.assertNotIn("Last-Modified", resp.headers)
+
+            resp = c.get("/", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+            self.assertEqual(resp.status_code, 200)
+
+        with app.test_client() as author_client:
+            with author_client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = author_id
+
+            resp = author_client.post("/users/profile",
+                                      data={"username": "renamed",
+                                            "email": "author@test.com",
+                                            "password": "password"})
+            self.assertEqual(resp.status_code, 302)
+
+        with self.client as c:
+            resp = c.get("/", headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@renamed", resp.data.decode())
+
+    def test_profile_etag_tracks_swapped_likes(self):
+        """Does the ETag change when the viewer swaps which messages they
+        like, even though how many stays the same?"""
+
+        author = User(email="author@test.com", username="author", password="password")
+        db.session.add(author)
+        db.session.commit()
+
+        msgs = [Message(text=f"msg {i}", user_id=author.id) for i in range(4)]
+        db.session.add_all(msgs)
+        db.session.commit()
+
+        testuser_id, author_id = self.testuser.id, author.id
+        ids = [msg.id for msg in msgs]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = testuser_id
+
+            for message_id in (ids[0], ids[3]):
+                c.post(f"/users/add_like/{message_id}")
+
+            etag = c.get(f"/users/{author_id}").headers["ETag"]
+
+            for message_id in ids:
+                c.post(f"/users/add_like/{message_id}")
+
+            resp = c.get(f"/users/{author_id}", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_likes_query_count(self):
+        """Does the likes page load message authors without
+        one query per message?"""
+
+        for i in range(3):
+            u = User(email=f"author{i}@test.com", username=f"author{i}", password="password")
+            db.session.add(u)
+            db.session.commit()
+
+            msg = Message(text="like me", user_id=u.id)
+            db.session.add(msg)
+            db.session.commit()
+
+            db.session.add(Likes(user_id=self.testuser.id, message_id=msg.id))
+            db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f"/users/{self.testuser.id}/likes")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("like me", str(resp.data))
+            self.assertLessEqual(int(resp.headers["X-SQL-Statements"]), 4)
+
+    def test_liked_flags(self):
+        """Are like buttons lit for exactly the messages the viewer liked?"""
+
+        u = User(email="author@test.com", username="author", password="password")
+        db.session.add(u)
+        db.session.commit()
+
+        liked = Message(text="liked", user_id=u.id)
+        other = Message(text="not liked", user_id=u.id)
+        db.session.add_all([liked, other])
+        db.session.commit()
+
+        db.session.add(Likes(user_id=self.testuser.id, message_id=liked.id))
+        db.session.commit()
+
+        testuser_id, author_id = self.testuser.id, u.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = testuser_id
+
+            resp = c.get(f"/users/{author_id}")
+
+            self.assertEqual(resp.status_code, 200)
+            html = resp.data.decode()
+            self.assertEqual(1, html.count("btn-primary"))
+            self.assertEqual(1, html.count("btn-secondary"))
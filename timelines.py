@@ -0,0 +1,448 @@
+"""Materialized home timelines for Warbler.
+
+Every user has a home timeline stored in the `timelines` table. When a
+message is posted it is copied ("fanned out") into the timeline of each
+follower, so reading the home feed is a single indexed range read instead
+of an `IN (...)` over everyone the user follows.
+
+Authors with a very large audience are not fanned out on write (that would
+mean one insert per follower for every message); their messages are merged
+into the feed at read time instead. Those authors are listed in the small
+`pulled_authors` table, so finding the ones a reader follows costs a probe
+of `follows` per pulled author rather than a scan of everyone the reader
+follows. An author is pulled when they post with TIMELINE_FANOUT_LIMIT or
+more followers, and goes back to fan-out on write only once they're below
+half that, after a job has copied their recent messages into every
+follower's timeline, so nothing posted meanwhile goes missing.
+
+Fan-out to followers and backfills after a follow run as background jobs
+(see jobs.py); the author's own timeline gets a new message at once.
+"""
+
+from heapq import merge
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy import and_, exists, func, literal, select
+from sqlalchemy.orm import joinedload
+
+import jobs
+from models import db, Follows, Message, PulledAuthor, TimelineEntry, User
+from pagination import FEED_PAGE_SIZE, build_page, keyset_query, message_key
+
+DEFAULT_TIMELINE_DEPTH = 800
+DEFAULT_FANOUT_LIMIT = 10000
+
+TIMELINE_COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+# Followers whose timelines a demoted author's messages are copied into
+# per transaction.
+PUSH_BATCH_SIZE = 1000
+
+# Users whose timelines rebuild_all_timelines recomputes per transaction.
+REBUILD_BATCH_SIZE = 500
+
+STREAM_CHUNK_SIZE = 100
+
+
+def timeline_depth():
+    """How many entries we keep per user timeline."""
+
+    return current_app.config.get('TIMELINE_DEPTH', DEFAULT_TIMELINE_DEPTH)
+
+
+def fanout_limit():
+    """Follower count at which an author is merged at read time instead."""
+
+    return current_app.config.get('TIMELINE_FANOUT_LIMIT', DEFAULT_FANOUT_LIMIT)
+
+
+def is_fanned_out_on_read(user_id):
+    """Are `user_id`'s new messages left out of their followers' timelines?"""
+
+    return (db.session
+            .query(PulledAuthor.query
+                   .filter(PulledAuthor.user_id == user_id,
+                           PulledAuthor.demoting.is_(False))
+                   .exists())
+            .scalar())
+
+
+def pulled_followed_by(user_id):
+    """Select of the pulled authors `user_id` follows, whose messages their
+    feed merges at read time."""
+
+    return (select([PulledAuthor.user_id])
+            .where(exists().where(and_(
+                Follows.user_following_id == user_id,
+                Follows.user_being_followed_id == PulledAuthor.user_id))))
+
+
+def update_fanout_mode(user_id):
+    """Pull `user_id` if they've reached TIMELINE_FANOUT_LIMIT followers, or
+    start pushing them again if they've fallen below half of it. Returns
+    whether their new messages are merged at read time."""
+
+    followers_count, demoting = (db.session
+                                 .query(User.followers_count, PulledAuthor.demoting)
+                                 .outerjoin(PulledAuthor, PulledAuthor.user_id == User.id)
+                                 .filter(User.id == user_id)
+                                 .one())
+
+    if demoting is None:
+        if followers_count < fanout_limit():
+            return False
+        db.session.add(PulledAuthor(user_id=user_id))
+        return True
+
+    if not demoting and followers_count < fanout_limit() // 2:
+        jobs.enqueue(push_author, user_id)
+        return True
+
+    return not demoting
+
+
+##############################################################################
+# Writes
+
+
+def trim_timelines(user_ids):
+    """Drop entries older than the configured depth from these timelines.
+
+    `user_ids` may be a list or a select of ids.
+    """
+
+    timelines = TimelineEntry.__table__
+    newer = timelines.alias('newer')
+
+    cutoff = (select([newer.c.timestamp])
+              .where(newer.c.user_id == timelines.c.user_id)
+              .order_by(newer.c.timestamp.desc(), newer.c.message_id.desc())
+              .offset(timeline_depth() - 1)
+              .limit(1)
+              .as_scalar())
+
+    db.session.execute(timelines
+                       .delete()
+                       .where(timelines.c.user_id.in_(user_ids))
+                       .where(timelines.c.timestamp < cutoff))
+
+
+def pull_popular_authors():
+    """Pull every author with TIMELINE_FANOUT_LIMIT followers or more (after
+    a bulk load, say), rather than waiting for them to post."""
+
+    popular = (select([User.id])
+               .where(User.followers_count >= fanout_limit())
+               .where(~User.id.in_(select([PulledAuthor.user_id]))))
+
+    db.session.execute(PulledAuthor.__table__
+                       .insert()
+                       .from_select(['user_id'], popular))
+
+
+def add_own_message(msg):
+    """Put a freshly flushed message in its author's own timeline, so they
+    see it at once even before it's fanned out."""
+
+    db.session.execute(TimelineEntry.__table__.insert().values(
+        user_id=msg.user_id,
+        message_id=msg.id,
+        author_id=msg.user_id,
+        timestamp=msg.timestamp,
+    ))
+
+
+def not_in_timeline(user_id, message_id):
+    """Guard so that running a fan-out or backfill twice inserts nothing twice."""
+
+    return ~exists().where(and_(TimelineEntry.user_id == user_id,
+                                TimelineEntry.message_id == message_id))
+
+
+def fan_out_to_followers(msg):
+    """Copy a message into its followers' timelines."""
+
+    if update_fanout_mode(msg.user_id):
+        trim_timelines([msg.user_id])
+        return
+
+    followers = (select([Follows.user_following_id,
+                         literal(msg.id),
+                         literal(msg.user_id),
+                         literal(msg.timestamp, db.DateTime)])
+                 .where(Follows.user_being_followed_id == msg.user_id)
+                 .where(Follows.user_following_id != msg.user_id)
+                 .where(not_in_timeline(Follows.user_following_id, msg.id)))
+
+    db.session.execute(TimelineEntry.__table__
+                       .insert()
+                       .from_select(TIMELINE_COLUMNS, followers))
+
+    audience = (select([Follows.user_following_id])
+                .where(Follows.user_being_followed_id == msg.user_id)
+                .union(select([literal(msg.user_id)])))
+    trim_timelines(audience)
+
+
+@jobs.handler
+def fan_out(message_id):
+    """Job: fan a posted message out to followers, unless it's gone since."""
+
+    msg = Message.query.get(message_id)
+
+    if msg is not None:
+        fan_out_to_followers(msg)
+
+
+@jobs.handler
+def push_author(author_id):
+    """Job: go back to fanning `author_id` out on write. Their recent
+    messages are copied into their followers' timelines a batch of
+    followers at a time; reads keep merging them until that's done."""
+
+    pulled = PulledAuthor.query.get(author_id)
+
+    if pulled is None:
+        return
+
+    pulled.demoting = True
+    db.session.commit()
+
+    timelines = TimelineEntry.__table__
+    recent = (select([Message.id, Message.user_id, Message.timestamp])
+              .where(Message.user_id == author_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(timeline_depth())
+              .alias('recent'))
+
+    last_id = 0
+    while True:
+        batch = [follower_id for (follower_id,) in (db.session
+                 .query(Follows.user_following_id)
+                 .filter(Follows.user_being_followed_id == author_id,
+                         Follows.user_following_id > last_id)
+                 .order_by(Follows.user_following_id)
+                 .limit(PUSH_BATCH_SIZE))]
+
+        if not batch:
+            break
+
+        entries = (select([Follows.user_following_id,
+                           recent.c.id,
+                           recent.c.user_id,
+                           recent.c.timestamp])
+                   .where(Follows.user_being_followed_id == author_id)
+                   .where(Follows.user_following_id.in_(batch))
+                   .where(not_in_timeline(Follows.user_following_id, recent.c.id)))
+
+        db.session.execute(timelines.insert().from_select(TIMELINE_COLUMNS, entries))
+        trim_timelines(batch)
+        db.session.commit()
+        last_id = batch[-1]
+
+    db.session.execute(PulledAuthor.__table__
+                       .delete()
+                       .where(PulledAuthor.user_id == author_id))
+    db.session.commit()
+
+
+def remove_message(message_id):
+    """Remove a message from every timeline it was fanned out to."""
+
+    db.session.execute(TimelineEntry.__table__
+                       .delete()
+                       .where(TimelineEntry.message_id == message_id))
+
+
+def backfill_follow(follower_id, followed_id):
+    """Pull recent messages of a newly followed user into the follower's timeline."""
+
+    if is_fanned_out_on_read(followed_id):
+        return
+
+    recent = (select([literal(follower_id),
+                      Message.id,
+                      Message.user_id,
+                      Message.timestamp])
+              .where(Message.user_id == followed_id)
+              .where(not_in_timeline(follower_id, Message.id))
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(timeline_depth()))
+
+    db.session.execute(TimelineEntry.__table__
+                       .insert()
+                       .from_select(TIMELINE_COLUMNS, recent))
+    trim_timelines([follower_id])
+
+
+@jobs.handler
+def backfill(follower_id, followed_id):
+    """Job: backfill_follow, unless the follow has been undone since."""
+
+    following = (db.session
+                 .query(Follows.query
+                        .filter_by(user_following_id=follower_id,
+                                   user_being_followed_id=followed_id)
+                        .exists())
+                 .scalar())
+
+    if following:
+        backfill_follow(follower_id, followed_id)
+
+
+def remove_follows(follower_id, followed_ids):
+    """Drop several unfollowed users' messages from the follower's
+    timeline, in one statement."""
+
+    db.session.execute(TimelineEntry.__table__
+                       .delete()
+                       .where(TimelineEntry.user_id == follower_id)
+                       .where(TimelineEntry.author_id.in_(followed_ids)))
+
+
+def rebuild_timelines(user_ids):
+    """Recompute these users' timelines from scratch, set-based: one INSERT
+    ranks each reader's candidate messages with a window function and
+    keeps the newest TIMELINE_DEPTH."""
+
+    timelines = TimelineEntry.__table__
+
+    db.session.execute(timelines
+                       .delete()
+                       .where(timelines.c.user_id.in_(user_ids)))
+
+    # (reader, author) pairs: everyone they follow but pulled authors, and themselves.
+    sources = (select([Follows.user_following_id.label('reader_id'),
+                       Follows.user_being_followed_id.label('author_id')])
+               .where(Follows.user_following_id.in_(user_ids))
+               .where(Follows.user_being_followed_id != Follows.user_following_id)
+               .where(~Follows.user_being_followed_id.in_(select([PulledAuthor.user_id])))
+               .union_all(select([User.id.label('reader_id'), User.id.label('author_id')])
+                          .where(User.id.in_(user_ids)))
+               .alias('sources'))
+
+    ranked = (select([sources.c.reader_id,
+                      Message.id.label('message_id'),
+                      Message.user_id.label('author_id'),
+                      Message.timestamp,
+                      func.row_number().over(
+                          partition_by=sources.c.reader_id,
+                          order_by=[Message.timestamp.desc(), Message.id.desc()],
+                      ).label('recency')])
+              .select_from(sources.join(Message, Message.user_id == sources.c.author_id))
+              .alias('ranked'))
+
+    newest = (select([ranked.c.reader_id, ranked.c.message_id,
+                      ranked.c.author_id, ranked.c.timestamp])
+              .where(ranked.c.recency <= timeline_depth()))
+
+    db.session.execute(timelines.insert().from_select(TIMELINE_COLUMNS, newest))
+
+
+def rebuild_all_timelines(batch_size=REBUILD_BATCH_SIZE):
+    """Recompute every user's timeline, committing after each batch of
+    users. Returns how many users there were."""
+
+    count = 0
+    last_id = 0
+
+    while True:
+        batch = [user_id for (user_id,) in (db.session
+                 .query(User.id)
+                 .filter(User.id > last_id)
+                 .order_by(User.id)
+                 .limit(batch_size))]
+
+        if not batch:
+            return count
+
+        rebuild_timelines(batch)
+        db.session.commit()
+
+        count += len(batch)
+        last_id = batch[-1]
+
+
+##############################################################################
+# Reads
+
+
+def home_timeline_rows(user, before=None, after=None, limit=FEED_PAGE_SIZE,
+                       stream=False):
+    """Iterate up to `limit` + 1 home feed messages, in `keyset_query` order.
+
+    Materialized timeline entries are merged lazily with the messages of
+    followed authors who are merged at read time. With `stream`, rows are
+    fetched from the database in chunks instead of all at once.
+    """
+
+    sources = [keyset_query(Message
+                            .query
+                            .options(joinedload(Message.user))
+                            .join(TimelineEntry,
+                                  TimelineEntry.message_id == Message.id)
+                            .filter(TimelineEntry.user_id == user.id),
+                            TimelineEntry.timestamp, TimelineEntry.message_id,
+                            before, after, limit)]
+
+    pulled = [author_id for (author_id,) in
+              db.session.execute(pulled_followed_by(user.id))]
+
+    if pulled:
+        sources.append(keyset_query(Message
+                                    .query
+                                    .options(joinedload(Message.user))
+                                    .filter(Message.user_id.in_(pulled)),
+                                    Message.timestamp, Message.id,
+                                    before, after, limit))
+
+    if stream:
+        sources = [source.yield_per(STREAM_CHUNK_SIZE) for source in sources]
+
+    in_order = merge(*sources, key=message_key, reverse=after is None)
+
+    seen = set()
+    unique = (msg for msg in in_order
+              if msg.id not in seen and not seen.add(msg.id))
+
+    return islice(unique, limit + 1)
+
+
+def timeline_version(user_id):
+    """A cheap summary of `user_id`'s home feed.
+
+    The summary changes whenever a message enters or leaves the feed, or
+    one of its authors edits their profile. It's one query over indexes
+    and counters, without loading any messages.
+    """
+
+    pulled = User.id.in_(pulled_followed_by(user_id))
+
+    def of_timeline(column):
+        return (select([column])
+                .where(TimelineEntry.user_id == user_id)
+                .as_scalar())
+
+    pulled_messages = select([func.sum(User.messages_count)]).where(pulled)
+    pulled_edited = select([func.max(User.profile_updated_at)]).where(pulled)
+
+    # The timeline holds at most TIMELINE_DEPTH entries, so this is bounded.
+    authors_edited = (select([func.max(User.profile_updated_at)])
+                      .where(User.id == TimelineEntry.author_id)
+                      .where(TimelineEntry.user_id == user_id))
+
+    return tuple(db.session.query(
+        of_timeline(func.count(TimelineEntry.message_id)),
+        of_timeline(func.max(TimelineEntry.message_id)),
+        pulled_messages.as_scalar(),
+        authors_edited.as_scalar(),
+        pulled_edited.as_scalar(),
+    ).one())
+
+
+def home_timeline(user, before=None, after=None, limit=FEED_PAGE_SIZE):
+    """One keyset `Page` of `user`'s home feed, newest first."""
+
+    messages = list(home_timeline_rows(user, before, after, limit))
+    return build_page(messages, before, after, limit)
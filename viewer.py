@@ -0,0 +1,49 @@
+"""What the logged-in viewer has done to the messages on a page.
+
+Templates show a flag per message (has the viewer liked it?). Rather
+than loading everything the viewer ever liked, `load` asks about just
+the page's message ids in one query, answered from the likes primary
+key, and hands templates sets to test against.
+"""
+
+from flask import g
+
+from models import db, Likes
+
+
+class ViewerState:
+    """The viewer's flags for one page of messages, as sets of message ids."""
+
+    def __init__(self, liked=frozenset()):
+        self.liked = liked
+
+
+EMPTY = ViewerState()
+
+
+def load(messages, user=None, all_liked=False):
+    """Flags for `messages` as seen by `user` (default: the logged-in user).
+
+    Pass `all_liked` when the page is the viewer's own likes, which needs
+    no query.
+    """
+
+    user = user if user is not None else getattr(g, 'user', None)
+
+    if not user:
+        return EMPTY
+
+    # Users can't like their own messages, so don't ask about them.
+    ids = {msg.id for msg in messages if msg.user_id != user.id}
+
+    if not ids:
+        return EMPTY
+
+    if all_liked:
+        return ViewerState(liked=frozenset(ids))
+
+    rows = (db.session
+            .query(Likes.message_id)
+            .filter(Likes.user_id == user.id, Likes.message_id.in_(ids)))
+
+    return ViewerState(liked=frozenset(message_id for (message_id,) in rows))